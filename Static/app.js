@@ -730,9 +730,8 @@ async function bulkDeleteFiles() {
         });
         if (!res.ok) throw new Error((await safeJson(res)).msg || 'Bulk delete failed');
         const data = await safeJson(res);
-        showToast(data.msg, 'success');
         clearSelection();
-        loadFiles(currentPath);
+        await finishJob(data);
     } catch (e) {
         showToast(e.message, 'error');
     }
@@ -750,14 +749,53 @@ async function bulkMoveFiles() {
         });
         if (!res.ok) throw new Error((await safeJson(res)).msg || 'Bulk move failed');
         const data = await safeJson(res);
-        showToast(data.msg, 'success');
         clearSelection();
-        loadFiles(currentPath);
+        await finishJob(data);
     } catch (e) {
         showToast(e.message, 'error');
     }
 }
 
+async function bulkCopyFiles() {
+    if (selectedFiles.size === 0) return;
+    const destination = prompt('Copy to folder path (leave empty for root):');
+    if (destination === null) return;
+    try {
+        const res = await fetch('/api/bulk/copy', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Authorization': 'Bearer ' + token },
+            body: JSON.stringify({ filepaths: Array.from(selectedFiles), destination: destination.trim() })
+        });
+        if (!res.ok) throw new Error((await safeJson(res)).msg || 'Bulk copy failed');
+        const data = await safeJson(res);
+        clearSelection();
+        await finishJob(data);
+    } catch (e) {
+        showToast(e.message, 'error');
+    }
+}
+
+// Long file operations answer 202 with a job_id: poll the job, then refresh the listing
+async function finishJob(data) {
+    if (data.job_id) {
+        showToast(data.msg, 'info');
+        let job;
+        do {
+            await new Promise(r => setTimeout(r, 1000));
+            const res = await fetch(`/api/jobs/${data.job_id}`, { headers: { Authorization: 'Bearer ' + token } });
+            if (!res.ok) throw new Error('Job status unavailable');
+            job = await safeJson(res);
+        } while (job.status === 'queued' || job.status === 'running');
+        if (job.status !== 'done') {
+            loadFiles(currentPath);
+            throw new Error(job.error || `Operation ${job.status}`);
+        }
+        data = job.result;
+    }
+    showToast(data.msg, 'success');
+    loadFiles(currentPath);
+}
+
 async function bulkShareFiles() {
     if (selectedFiles.size === 0) return;
     if (!confirm(`Share ${selectedFiles.size} selected file(s) on the network?`)) return;
@@ -788,164 +826,216 @@ async function loadGlobalStats() {
     } catch (e) { /* silently ignore */ }
 }
 
+const FILES_PAGE_SIZE = 500;   // entries per /api/files page; "Load more" fetches the next
+let filesCursor = null;
+
+async function fetchFilesPage(cursor) {
+    let url = '/api/files?folder=' + encodeURIComponent(currentPath) + '&limit=' + FILES_PAGE_SIZE;
+    if (cursor) url += '&cursor=' + encodeURIComponent(cursor);
+    const res = await fetch(url, { headers: { Authorization: 'Bearer ' + token } });
+    if (!res.ok) throw new Error((await safeJson(res)).msg || 'Failed to load files');
+    return safeJson(res);
+}
+
+// Append one page of folders/files to the list; headers are added with the first row of each section
+function appendFilesPage(data) {
+    const folderSection = document.getElementById('folderSection');
+    const fileSection = document.getElementById('fileSection');
+
+    if (data.folders && data.folders.length > 0) {
+        const header = folderSection.childElementCount ? '' : '<div class="section-header">Folders</div>';
+        folderSection.insertAdjacentHTML('beforeend', header + data.folders.map(renderFolderRow).join(''));
+    }
+
+    if (data.files && data.files.length > 0) {
+        const header = fileSection.childElementCount ? '' : '<div class="section-header">Files</div>';
+        const offset = allFiles.length;
+        const rows = data.files.map((file, i) => renderFileRow(file, offset + i)).join('');
+        allFiles = allFiles.concat(data.files.map(file => ({
+            path: currentPath ? currentPath + '/' + file.name : file.name, type: file.type, name: file.name
+        })));
+        fileSection.insertAdjacentHTML('beforeend', header + rows);
+    }
+
+    filesCursor = data.next_cursor || null;
+    document.getElementById('filesLoadMore').style.display = filesCursor ? '' : 'none';
+}
+
 async function loadFiles(path = '') {
     currentPath = path || '';
     selectedFiles.clear();
     allFiles = [];
+    filesCursor = null;
+    const requestedPath = currentPath;
 
     try {
-        const res = await fetch('/api/files?folder=' + encodeURIComponent(currentPath), {
-            headers: { Authorization: 'Bearer ' + token }
-        });
-        if (!res.ok) throw new Error((await safeJson(res)).msg || 'Failed to load files');
-        const data = await safeJson(res);
+        const data = await fetchFilesPage(null);
+        if (requestedPath !== currentPath) return;   // navigated away meanwhile
 
         loadGlobalStats();
         updateBreadcrumb(currentPath);
 
-        const fileListEl = document.getElementById('fileList');
-        let html = '';
-        const newFiles = []; // collect locally, assign atomically at end
-
-        if (data.folders && data.folders.length > 0) {
-            html += '<div class="section-header">Folders</div>';
-            html += data.folders.map(folder => {
-                const folderPath = currentPath ? currentPath + '/' + folder.name : folder.name;
-                return `
-                <div class="list-item" 
-                     draggable="true"
-                     data-path="${escapeHtml(folderPath)}"
-                     data-type="folder"
-                     data-drop-target="true"
-                     ondragstart="onDragStart(event)"
-                     ondragover="onDragOver(event)"
-                     ondragleave="onDragLeave(event)"
-                     ondrop="onDrop(event)">
-                    <div class="item-info">
-                        <div class="item-name folder-item" onclick="loadFiles('${escapeHtml(folderPath)}')">
-                            <svg width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
-                                <path d="M22 19a2 2 0 0 1-2 2H4a2 2 0 0 1-2-2V5a2 2 0 0 1 2-2h5l2 3h9a2 2 0 0 1 2 2z"></path>
-                            </svg>
-                            ${escapeHtml(folder.name)}
-                            ${folder.is_shared ? '<span class="badge badge-shared">Shared</span>' : ''}
-                        </div>
-                        <div class="item-meta">${formatDate(folder.modified)}</div>
-                    </div>
-                    <div class="item-actions">
-                        <div class="kebab-wrap">
-                            <button class="btn-kebab" onclick="toggleMenu(event, '${pathToId('mf-'+folderPath)}')" title="Options">
-                                <svg width="16" height="16" viewBox="0 0 24 24" fill="currentColor"><circle cx="12" cy="5" r="1.5"/><circle cx="12" cy="12" r="1.5"/><circle cx="12" cy="19" r="1.5"/></svg>
-                            </button>
-                            <div class="kebab-menu" id="${pathToId('mf-'+folderPath)}">
-                                ${!folder.is_shared ? `<button class="kebab-item" onclick="requestFolderShare('${escapeHtml(folderPath)}'); closeAllMenus()">
-                                    <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><circle cx="18" cy="5" r="3"/><circle cx="6" cy="12" r="3"/><circle cx="18" cy="19" r="3"/><line x1="8.59" y1="13.51" x2="15.42" y2="17.49"/><line x1="15.41" y1="6.51" x2="8.59" y2="10.49"/></svg>
-                                    Share</button>` : ''}
-                                <button class="kebab-item" onclick="promptMoveItem('${escapeHtml(folderPath)}', 'folder'); closeAllMenus()">
-                                    <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><polyline points="5 9 2 12 5 15"/><polyline points="19 9 22 12 19 15"/><line x1="2" y1="12" x2="22" y2="12"/></svg>
-                                    Move</button>
-                                <button class="kebab-item" onclick="renameFileInline('${escapeHtml(folderPath)}', '${escapeHtml(folder.name)}'); closeAllMenus()">
-                                    <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M11 4H4a2 2 0 0 0-2 2v14a2 2 0 0 0 2 2h14a2 2 0 0 0 2-2v-7"/><path d="M18.5 2.5a2.121 2.121 0 0 1 3 3L12 15l-4 1 1-4 9.5-9.5z"/></svg>
-                                    Rename</button>
-                            </div>
-                        </div>
-                        <button class="btn btn-text btn-danger-text" onclick="deleteFolder('${escapeHtml(folderPath)}'); event.stopPropagation();">Delete</button>
-                    </div>
-                </div>`;
-            }).join('');
-        }
-
         // Drop zone: when inside a folder, the root drop zone = the PARENT folder (enables drag-out)
         const parentPath = currentPath.includes('/')
             ? currentPath.substring(0, currentPath.lastIndexOf('/'))
             : '';
+        let html = '<div id="folderSection"></div>';
         html += `<div class="list-drop-root" data-path="${escapeHtml(parentPath)}" data-type="folder" data-drop-target="true"
                       ondragover="onDragOver(event)" ondragleave="onDragLeave(event)" ondrop="onDrop(event)">
                     ${currentPath ? `<span class="drop-root-label">↑ Drop here to move to ${parentPath ? escapeHtml(parentPath.split('/').pop()) : 'root'}</span>` : ''}
                  </div>`;
+        html += '<div id="fileSection"></div>';
+        html += '<div id="filesLoadMore" style="display: none; text-align: center; margin: 16px 0;"><button class="btn btn-text" onclick="loadMoreFiles()">Load more</button></div>';
 
-        if (data.files && data.files.length > 0) {
-            html += '<div class="section-header">Files</div>';
-            html += data.files.map((file, index) => {
-                const filePath = currentPath ? currentPath + '/' + file.name : file.name;
-                const canPreview = file.type !== 'other';
-                const canEdit = isEditableFile(file.name);
-                newFiles.push({ path: filePath, type: file.type, name: file.name });
-
-                // Respect user preference: open editable files in editor by default
-                const preferEditor = (userPrefs.editorDefault !== false);
-                const nameClick = canEdit && preferEditor
-                    ? `onclick="openEditor('${escapeHtml(filePath)}', '${escapeHtml(file.name)}')"`
-                    : canPreview
-                        ? `onclick="previewFile('${escapeHtml(filePath)}', ${index})"`
-                        : canEdit ? `onclick="openEditor('${escapeHtml(filePath)}', '${escapeHtml(file.name)}')"` : '';
-                return `
-                    <div class="list-item"
-                         draggable="true"
-                         data-path="${escapeHtml(filePath)}"
-                         data-type="file"
-                         ondragstart="onDragStart(event)">
-                        <div class="item-info" style="display: flex; align-items: center; gap: 12px;">
-                            <input type="checkbox" class="file-checkbox" data-filepath="${escapeHtml(filePath)}"
-                                   onclick="toggleFileSelection('${escapeHtml(filePath)}'); event.stopPropagation();">
-                            <div style="flex: 1; min-width: 0;">
-                                <div class="item-name ${canPreview || canEdit ? 'item-name-clickable' : ''}" ${nameClick}>
-                                    ${getFileIcon(file.type)} <span class="item-name-text">${escapeHtml(file.name)}</span>
-                                    ${file.is_shared ? '<span class="badge badge-shared">Shared</span>' : ''}
-                                </div>
-                                <div class="item-meta">${file.size_formatted} • ${formatDate(file.modified)}</div>
-                            </div>
-                        </div>
-                        <div class="item-actions">
-                            <button class="fav-btn icon-btn" data-path="${escapeHtml(filePath)}"
-                                    onclick="toggleFavorite('${escapeHtml(filePath)}', '${escapeHtml(file.name)}', event)"
-                                    title="${userFavorites.has(filePath) ? 'Remove from favorites' : 'Add to favorites'}">
-                                ${getFavStar(filePath)}
-                            </button>
-                            <div class="kebab-wrap">
-                                <button class="btn-kebab" onclick="toggleMenu(event, '${pathToId('mf-'+filePath)}')" title="Options">
-                                    <svg width="16" height="16" viewBox="0 0 24 24" fill="currentColor"><circle cx="12" cy="5" r="1.5"/><circle cx="12" cy="12" r="1.5"/><circle cx="12" cy="19" r="1.5"/></svg>
-                                </button>
-                                <div class="kebab-menu" id="${pathToId('mf-'+filePath)}">
-                                    ${canEdit ? `<button class="kebab-item kebab-item-edit" onclick="openEditor('${escapeHtml(filePath)}', '${escapeHtml(file.name)}'); closeAllMenus()">
-                                        <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M11 4H4a2 2 0 0 0-2 2v14a2 2 0 0 0 2 2h14a2 2 0 0 0 2-2v-7"/><path d="M18.5 2.5a2.121 2.121 0 0 1 3 3L12 15l-4 1 1-4 9.5-9.5z"/></svg>
-                                        Edit</button>` : ''}
-                                    ${canPreview ? `<button class="kebab-item" onclick="previewFile('${escapeHtml(filePath)}', ${index}); closeAllMenus()">
-                                        <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M1 12s4-8 11-8 11 8 11 8-4 8-11 8-11-8-11-8z"/><circle cx="12" cy="12" r="3"/></svg>
-                                        Preview</button>` : ''}
-                                    <button class="kebab-item" onclick="downloadFile('${escapeHtml(filePath)}'); closeAllMenus()">
-                                        <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M21 15v4a2 2 0 0 1-2 2H5a2 2 0 0 1-2-2v-4"/><polyline points="7 10 12 15 17 10"/><line x1="12" y1="15" x2="12" y2="3"/></svg>
-                                        Download</button>
-                                    ${!file.is_shared ? `<button class="kebab-item" onclick="requestShare('${escapeHtml(filePath)}'); closeAllMenus()">
-                                        <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><circle cx="18" cy="5" r="3"/><circle cx="6" cy="12" r="3"/><circle cx="18" cy="19" r="3"/><line x1="8.59" y1="13.51" x2="15.42" y2="17.49"/><line x1="15.41" y1="6.51" x2="8.59" y2="10.49"/></svg>
-                                        Share</button>` : ''}
-                                    <button class="kebab-item" onclick="promptMoveItem('${escapeHtml(filePath)}', 'file'); closeAllMenus()">
-                                        <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><polyline points="5 9 2 12 5 15"/><polyline points="19 9 22 12 19 15"/><line x1="2" y1="12" x2="22" y2="12"/></svg>
-                                        Move</button>
-                                    <button class="kebab-item" onclick="renameFileInline('${escapeHtml(filePath)}', '${escapeHtml(file.name)}'); closeAllMenus()">
-                                        <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M11 4H4a2 2 0 0 0-2 2v14a2 2 0 0 0 2 2h14a2 2 0 0 0 2-2v-7"/><path d="M18.5 2.5a2.121 2.121 0 0 1 3 3L12 15l-4 1 1-4 9.5-9.5z"/></svg>
-                                        Rename</button>
-                                    <button class="kebab-item kebab-item-danger" onclick="deleteFile('${escapeHtml(filePath)}'); closeAllMenus()">
-                                        <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><polyline points="3 6 5 6 21 6"/><path d="M19 6v14a2 2 0 0 1-2 2H7a2 2 0 0 1-2-2V6m3 0V4a1 1 0 0 1 1-1h4a1 1 0 0 1 1 1v2"/></svg>
-                                        Delete</button>
-                                </div>
-                            </div>
-                        </div>
-                    </div>`;
-            }).join('');
-        }
-
-        if (!html) {
-            html = '<div class="empty-state"><div class="empty-state-icon">📁</div><div class="empty-state-text">This folder is empty</div></div>';
-        }
+        document.getElementById('fileList').innerHTML = html;
+        appendFilesPage(data);
+        updateBulkActionsBar();
+    } catch (e) {
+        showToast(e.message, 'error');
+    }
+}
 
-        allFiles = newFiles; // atomic assignment — no race condition duplicates
-        fileListEl.innerHTML = html;
+async function loadMoreFiles() {
+    if (!filesCursor) return;
+    const requestedPath = currentPath;
+    const cursor = filesCursor;
+    filesCursor = null;   // ignore double clicks while the page loads
+    try {
+        const data = await fetchFilesPage(cursor);
+        if (requestedPath !== currentPath) return;
+        appendFilesPage(data);
         updateBulkActionsBar();
     } catch (e) {
+        filesCursor = cursor;
         showToast(e.message, 'error');
     }
 }
 
+function renderFolderRow(folder) {
+    const folderPath = currentPath ? currentPath + '/' + folder.name : folder.name;
+    return `
+    <div class="list-item" 
+         draggable="true"
+         data-path="${escapeHtml(folderPath)}"
+         data-type="folder"
+         data-drop-target="true"
+         ondragstart="onDragStart(event)"
+         ondragover="onDragOver(event)"
+         ondragleave="onDragLeave(event)"
+         ondrop="onDrop(event)">
+        <div class="item-info">
+            <div class="item-name folder-item" onclick="loadFiles('${escapeHtml(folderPath)}')">
+                <svg width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
+                    <path d="M22 19a2 2 0 0 1-2 2H4a2 2 0 0 1-2-2V5a2 2 0 0 1 2-2h5l2 3h9a2 2 0 0 1 2 2z"></path>
+                </svg>
+                ${escapeHtml(folder.name)}
+                ${folder.is_shared ? '<span class="badge badge-shared">Shared</span>' : ''}
+            </div>
+            <div class="item-meta">${formatDate(folder.modified)}</div>
+        </div>
+        <div class="item-actions">
+            <div class="kebab-wrap">
+                <button class="btn-kebab" onclick="toggleMenu(event, '${pathToId('mf-'+folderPath)}')" title="Options">
+                    <svg width="16" height="16" viewBox="0 0 24 24" fill="currentColor"><circle cx="12" cy="5" r="1.5"/><circle cx="12" cy="12" r="1.5"/><circle cx="12" cy="19" r="1.5"/></svg>
+                </button>
+                <div class="kebab-menu" id="${pathToId('mf-'+folderPath)}">
+                    ${!folder.is_shared ? `<button class="kebab-item" onclick="requestFolderShare('${escapeHtml(folderPath)}'); closeAllMenus()">
+                        <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><circle cx="18" cy="5" r="3"/><circle cx="6" cy="12" r="3"/><circle cx="18" cy="19" r="3"/><line x1="8.59" y1="13.51" x2="15.42" y2="17.49"/><line x1="15.41" y1="6.51" x2="8.59" y2="10.49"/></svg>
+                        Share</button>` : ''}
+                    <button class="kebab-item" onclick="downloadArchive(['${escapeHtml(folderPath)}']); closeAllMenus()">
+                        <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M21 15v4a2 2 0 0 1-2 2H5a2 2 0 0 1-2-2v-4"/><polyline points="7 10 12 15 17 10"/><line x1="12" y1="15" x2="12" y2="3"/></svg>
+                        Download</button>
+                    <button class="kebab-item" onclick="promptMoveItem('${escapeHtml(folderPath)}', 'folder'); closeAllMenus()">
+                        <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><polyline points="5 9 2 12 5 15"/><polyline points="19 9 22 12 19 15"/><line x1="2" y1="12" x2="22" y2="12"/></svg>
+                        Move</button>
+                    <button class="kebab-item" onclick="promptMoveItem('${escapeHtml(folderPath)}', 'folder', true); closeAllMenus()">
+                        <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><rect x="9" y="9" width="13" height="13" rx="2" ry="2"/><path d="M5 15H4a2 2 0 0 1-2-2V4a2 2 0 0 1 2-2h9a2 2 0 0 1 2 2v1"/></svg>
+                        Copy</button>
+                    <button class="kebab-item" onclick="renameFileInline('${escapeHtml(folderPath)}', '${escapeHtml(folder.name)}'); closeAllMenus()">
+                        <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M11 4H4a2 2 0 0 0-2 2v14a2 2 0 0 0 2 2h14a2 2 0 0 0 2-2v-7"/><path d="M18.5 2.5a2.121 2.121 0 0 1 3 3L12 15l-4 1 1-4 9.5-9.5z"/></svg>
+                        Rename</button>
+                </div>
+            </div>
+            <button class="btn btn-text btn-danger-text" onclick="deleteFolder('${escapeHtml(folderPath)}'); event.stopPropagation();">Delete</button>
+        </div>
+    </div>`;
+}
+
+function renderFileRow(file, index) {
+    const filePath = currentPath ? currentPath + '/' + file.name : file.name;
+    const canPreview = file.type !== 'other';
+    const canEdit = isEditableFile(file.name);
+
+    // Respect user preference: open editable files in editor by default
+    const preferEditor = (userPrefs.editorDefault !== false);
+    const nameClick = canEdit && preferEditor
+        ? `onclick="openEditor('${escapeHtml(filePath)}', '${escapeHtml(file.name)}')"`
+        : canPreview
+            ? `onclick="previewFile('${escapeHtml(filePath)}', ${index})"`
+            : canEdit ? `onclick="openEditor('${escapeHtml(filePath)}', '${escapeHtml(file.name)}')"` : '';
+    return `
+        <div class="list-item"
+             draggable="true"
+             data-path="${escapeHtml(filePath)}"
+             data-type="file"
+             ondragstart="onDragStart(event)">
+            <div class="item-info" style="display: flex; align-items: center; gap: 12px;">
+                <input type="checkbox" class="file-checkbox" data-filepath="${escapeHtml(filePath)}"
+                       onclick="toggleFileSelection('${escapeHtml(filePath)}'); event.stopPropagation();">
+                <div style="flex: 1; min-width: 0;">
+                    <div class="item-name ${canPreview || canEdit ? 'item-name-clickable' : ''}" ${nameClick}>
+                        ${file.type === 'image'
+                            ? `<img class="item-thumb" loading="lazy" alt="" src="/api/preview/${encodeURIComponent(filePath)}?token=${token}&size=thumb&v=${file.modified}">`
+                            : getFileIcon(file.type)} <span class="item-name-text">${escapeHtml(file.name)}</span>
+                        ${file.is_shared ? '<span class="badge badge-shared">Shared</span>' : ''}
+                    </div>
+                    <div class="item-meta">${file.size_formatted} • ${formatDate(file.modified)}</div>
+                </div>
+            </div>
+            <div class="item-actions">
+                <button class="fav-btn icon-btn" data-path="${escapeHtml(filePath)}"
+                        onclick="toggleFavorite('${escapeHtml(filePath)}', '${escapeHtml(file.name)}', event)"
+                        title="${userFavorites.has(filePath) ? 'Remove from favorites' : 'Add to favorites'}">
+                    ${getFavStar(filePath)}
+                </button>
+                <div class="kebab-wrap">
+                    <button class="btn-kebab" onclick="toggleMenu(event, '${pathToId('mf-'+filePath)}')" title="Options">
+                        <svg width="16" height="16" viewBox="0 0 24 24" fill="currentColor"><circle cx="12" cy="5" r="1.5"/><circle cx="12" cy="12" r="1.5"/><circle cx="12" cy="19" r="1.5"/></svg>
+                    </button>
+                    <div class="kebab-menu" id="${pathToId('mf-'+filePath)}">
+                        ${canEdit ? `<button class="kebab-item kebab-item-edit" onclick="openEditor('${escapeHtml(filePath)}', '${escapeHtml(file.name)}'); closeAllMenus()">
+                            <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M11 4H4a2 2 0 0 0-2 2v14a2 2 0 0 0 2 2h14a2 2 0 0 0 2-2v-7"/><path d="M18.5 2.5a2.121 2.121 0 0 1 3 3L12 15l-4 1 1-4 9.5-9.5z"/></svg>
+                            Edit</button>` : ''}
+                        ${canPreview ? `<button class="kebab-item" onclick="previewFile('${escapeHtml(filePath)}', ${index}); closeAllMenus()">
+                            <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M1 12s4-8 11-8 11 8 11 8-4 8-11 8-11-8-11-8z"/><circle cx="12" cy="12" r="3"/></svg>
+                            Preview</button>` : ''}
+                        <button class="kebab-item" onclick="downloadFile('${escapeHtml(filePath)}'); closeAllMenus()">
+                            <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M21 15v4a2 2 0 0 1-2 2H5a2 2 0 0 1-2-2v-4"/><polyline points="7 10 12 15 17 10"/><line x1="12" y1="15" x2="12" y2="3"/></svg>
+                            Download</button>
+                        ${!file.is_shared ? `<button class="kebab-item" onclick="requestShare('${escapeHtml(filePath)}'); closeAllMenus()">
+                            <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><circle cx="18" cy="5" r="3"/><circle cx="6" cy="12" r="3"/><circle cx="18" cy="19" r="3"/><line x1="8.59" y1="13.51" x2="15.42" y2="17.49"/><line x1="15.41" y1="6.51" x2="8.59" y2="10.49"/></svg>
+                            Share</button>` : ''}
+                        <button class="kebab-item" onclick="promptMoveItem('${escapeHtml(filePath)}', 'file'); closeAllMenus()">
+                            <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><polyline points="5 9 2 12 5 15"/><polyline points="19 9 22 12 19 15"/><line x1="2" y1="12" x2="22" y2="12"/></svg>
+                            Move</button>
+                        <button class="kebab-item" onclick="promptMoveItem('${escapeHtml(filePath)}', 'file', true); closeAllMenus()">
+                            <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><rect x="9" y="9" width="13" height="13" rx="2" ry="2"/><path d="M5 15H4a2 2 0 0 1-2-2V4a2 2 0 0 1 2-2h9a2 2 0 0 1 2 2v1"/></svg>
+                            Copy</button>
+                        <button class="kebab-item" onclick="renameFileInline('${escapeHtml(filePath)}', '${escapeHtml(file.name)}'); closeAllMenus()">
+                            <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M11 4H4a2 2 0 0 0-2 2v14a2 2 0 0 0 2 2h14a2 2 0 0 0 2-2v-7"/><path d="M18.5 2.5a2.121 2.121 0 0 1 3 3L12 15l-4 1 1-4 9.5-9.5z"/></svg>
+                            Rename</button>
+                        ${isArchiveFile(file.name) ? `<button class="kebab-item" onclick="extractArchive('${escapeHtml(filePath)}'); closeAllMenus()">
+                            <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><polyline points="21 8 21 21 3 21 3 8"/><rect x="1" y="3" width="22" height="5"/><line x1="10" y1="12" x2="14" y2="12"/></svg>
+                            Extract here</button>` : ''}
+                        <button class="kebab-item kebab-item-danger" onclick="deleteFile('${escapeHtml(filePath)}'); closeAllMenus()">
+                            <svg width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><polyline points="3 6 5 6 21 6"/><path d="M19 6v14a2 2 0 0 1-2 2H7a2 2 0 0 1-2-2V6m3 0V4a1 1 0 0 1 1-1h4a1 1 0 0 1 1 1v2"/></svg>
+                            Delete</button>
+                    </div>
+                </div>
+            </div>
+        </div>`;
+}
+
 function updateBreadcrumb(path) {
     const breadcrumbEl = document.getElementById('breadcrumb');
     if (!path) {
@@ -1007,9 +1097,7 @@ async function deleteFolder(folderPath) {
             headers: { Authorization: 'Bearer ' + token }
         });
         if (!res.ok) throw new Error((await safeJson(res)).msg || 'Failed to delete folder');
-        const data = await safeJson(res);
-        showToast(data.msg, 'success');
-        loadFiles(currentPath);
+        await finishJob(await safeJson(res));
     } catch (e) {
         showToast(e.message, 'error');
     }
@@ -1019,6 +1107,8 @@ async function deleteFolder(folderPath) {
    UPLOAD (with chunking + cancel)
    ======================= */
 const CHUNK_SIZE = 10 * 1024 * 1024; // 10 MB per chunk
+const CHUNK_RETRIES = 3;             // attempts per chunk before giving up
+const CHUNK_STREAMS = 4;             // chunks of one file in flight at once
 
 function generateUploadId() {
     return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, c => {
@@ -1027,6 +1117,18 @@ function generateUploadId() {
     });
 }
 
+// Server-side progress of a chunked upload, or null if it can't be fetched
+async function chunkUploadStatus(uploadId) {
+    try {
+        const res = await fetch('/api/upload/chunk/status?upload_id=' + encodeURIComponent(uploadId), {
+            headers: { Authorization: 'Bearer ' + token }
+        });
+        return res.ok ? await res.json() : null;
+    } catch (e) {
+        return null;
+    }
+}
+
 async function uploadWithChunks(file, folder, relPath) {
     if (uploadQueue.cancelled) throw new Error('Cancelled');
 
@@ -1036,58 +1138,82 @@ async function uploadWithChunks(file, folder, relPath) {
     const uploadId    = generateUploadId();
     uploadQueue.activeUploadId = uploadId;
 
-    for (let i = 0; i < totalChunks; i++) {
-        if (uploadQueue.cancelled) {
-            // Server-side cleanup
-            fetch('/api/upload/chunk/cancel', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json', Authorization: 'Bearer ' + token },
-                body: JSON.stringify({ upload_id: uploadId })
-            }).catch(() => {});
-            throw new Error('Cancelled');
-        }
+    // One controller for every chunk of this file, so cancel aborts them all
+    const controller = new AbortController();
+    uploadQueue.currentAbortController = controller;
 
-        const start = i * CHUNK_SIZE;
-        const chunk = file.slice(start, Math.min(start + CHUNK_SIZE, file.size));
-        const pct   = Math.round(((i + 1) / totalChunks) * 100);
+    const cancelOnServer = () => fetch('/api/upload/chunk/cancel', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', Authorization: 'Bearer ' + token },
+        body: JSON.stringify({ upload_id: uploadId })
+    }).catch(() => {});
 
-        uploadProgressUpdate(name, pct);
+    let storedPath = null;
 
-        const formData = new FormData();
-        formData.append('file',             chunk);
-        formData.append('upload_id',        uploadId);
-        formData.append('filename',         name);
-        formData.append('chunk_index',      i);
-        formData.append('total_chunks',     totalChunks);
-        formData.append('folder',           folder);
-        if (isFolderUp) formData.append('is_folder_upload', 'true');
+    async function sendChunk(i) {
+        const start = i * CHUNK_SIZE;
+        const chunk = file.slice(start, Math.min(start + CHUNK_SIZE, file.size));
 
-        const controller = new AbortController();
-        uploadQueue.currentAbortController = controller;
+        // Raw body + query string: the server writes it straight to its offset
+        const params = new URLSearchParams({
+            upload_id:    uploadId,
+            filename:     name,
+            chunk_index:  i,
+            total_chunks: totalChunks,
+            total_size:   file.size,
+            chunk_size:   CHUNK_SIZE,
+            folder:       folder
+        });
+        if (isFolderUp) params.append('is_folder_upload', 'true');
 
-        let res;
-        try {
-            res = await fetch('/api/upload/chunk', {
-                method: 'POST',
-                headers: { Authorization: 'Bearer ' + token },
-                body: formData,
-                signal: controller.signal
-            });
-        } catch (e) {
-            if (e.name === 'AbortError' || uploadQueue.cancelled) throw new Error('Cancelled');
-            throw e;
+        for (let attempt = 1; ; attempt++) {
+            let res;
+            try {
+                res = await fetch('/api/upload/chunk?' + params, {
+                    method: 'POST',
+                    headers: { Authorization: 'Bearer ' + token, 'Content-Type': 'application/octet-stream' },
+                    body: chunk,
+                    signal: controller.signal
+                });
+            } catch (e) {
+                if (e.name === 'AbortError' || uploadQueue.cancelled) throw new Error('Cancelled');
+                if (attempt >= CHUNK_RETRIES) throw e;
+                // Connection dropped: wait, then resume unless the server already has this chunk
+                await new Promise(r => setTimeout(r, 1000 * attempt));
+                const status = await chunkUploadStatus(uploadId);
+                if (status && status.done) storedPath = status.filepath;
+                if (status && (status.done || !status.missing.includes(i))) return;
+                continue;
+            }
+            if (!res.ok) {
+                const err = (await safeJson(res).catch(() => ({}))).msg || 'Upload failed';
+                throw new Error(err);
+            }
+            const data = await safeJson(res).catch(() => ({}));
+            if (data.filepath) storedPath = data.filepath;
+            return;
         }
+    }
 
-        if (!res.ok) {
-            fetch('/api/upload/chunk/cancel', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json', Authorization: 'Bearer ' + token },
-                body: JSON.stringify({ upload_id: uploadId })
-            }).catch(() => {});
-            const err = (await safeJson(res).catch(() => ({}))).msg || 'Upload failed';
-            throw new Error(err);
+    let next = 0, sent = 0;
+    async function stream() {
+        while (next < totalChunks) {
+            if (uploadQueue.cancelled) throw new Error('Cancelled');
+            await sendChunk(next++);
+            sent++;
+            uploadProgressUpdate(name, Math.round((sent / totalChunks) * 100));
         }
     }
+
+    uploadProgressUpdate(name, 0);
+    try {
+        await Promise.all(Array.from({ length: Math.min(CHUNK_STREAMS, totalChunks) }, stream));
+    } catch (e) {
+        controller.abort();
+        cancelOnServer();
+        throw e;
+    }
+    return storedPath;
 }
 
 async function uploadFiles() {
@@ -1166,6 +1292,50 @@ async function uploadFolder() {
     }
 }
 
+// One archive instead of thousands of files: upload it in chunks, then the
+// server unpacks it into the current folder as a job and drops the archive
+async function uploadArchive() {
+    const input = document.getElementById('archiveInput');
+    const file = input.files[0];
+    input.value = '';
+    if (!file) return;
+
+    const uploadDestination = currentPath;
+    uploadQueue.total += 1;
+    uploadProgressShow();
+    try {
+        const stored = await uploadWithChunks(file, uploadDestination, null);
+        uploadQueue.done++;
+        uploadProgressHide();
+        await extractArchive(stored, uploadDestination, true);
+    } catch (e) {
+        uploadProgressHide();
+        if (e.message !== 'Cancelled') showToast(`"${file.name}" failed: ${e.message}`, 'error');
+    }
+    await loadGlobalStats();
+}
+
+async function extractArchive(filepath, dstFolder = null, deleteArchive = false) {
+    try {
+        const body = { path: filepath, delete_archive: deleteArchive };
+        if (dstFolder !== null) body.dst_folder = dstFolder;
+        const res = await fetch('/api/extract', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', Authorization: 'Bearer ' + token },
+            body: JSON.stringify(body)
+        });
+        const data = await safeJson(res);
+        if (!res.ok) throw new Error(data.msg || 'Extract failed');
+        await finishJob(data);
+    } catch (e) {
+        showToast(e.message, 'error');
+    }
+}
+
+function isArchiveFile(name) {
+    return /\.(zip|tar|tgz|tar\.gz|tar\.bz2|tar\.xz)$/i.test(name);
+}
+
 /* =======================
    PREVIEW MODAL (larger)
    ======================= */
@@ -1184,6 +1354,9 @@ function previewFile(filepath, index = -1) {
     } else if (file && file.type === 'video') {
         previewUrl = `/api/preview/${encodeURIComponent(filepath)}?token=${token}`;
         openPreviewModal(previewUrl, file ? file.name : filepath.split('/').pop(), index, allFiles.length, 'video');
+    } else if (file && file.type === 'image') {
+        previewUrl = `/api/preview/${encodeURIComponent(filepath)}?token=${token}&v=${file.modified}`;
+        openPreviewModal(previewUrl, file.name, index, allFiles.length, 'iframe');
     } else {
         previewUrl = `/api/preview/${encodeURIComponent(filepath)}?token=${token}`;
         openPreviewModal(previewUrl, file ? file.name : filepath.split('/').pop(), index, allFiles.length, 'iframe');
@@ -1331,6 +1504,31 @@ function downloadFile(filepath) {
     window.open(`/api/download/${encodeURIComponent(filepath)}?token=${token}`, '_blank');
 }
 
+// Folders / selections / shared folders as one streamed archive; a form POST
+// keeps long selections out of the URL and the response just downloads
+function downloadArchive(paths, folderId = null, subfolder = '') {
+    const form = document.createElement('form');
+    form.method = 'POST';
+    form.action = '/api/download/archive';
+    const fields = [['token', token], ['format', 'zip'], ...paths.map(p => ['paths', p])];
+    if (folderId) fields.push(['folder_id', folderId], ['subfolder', subfolder]);
+    for (const [name, value] of fields) {
+        const input = document.createElement('input');
+        input.type = 'hidden';
+        input.name = name;
+        input.value = value;
+        form.appendChild(input);
+    }
+    document.body.appendChild(form);
+    form.submit();
+    form.remove();
+}
+
+function bulkDownloadFiles() {
+    if (selectedFiles.size === 0) return;
+    downloadArchive(Array.from(selectedFiles));
+}
+
 async function deleteFile(filepath) {
     const filename = filepath.split('/').pop();
     if (!confirm(`Delete "${filename}"?`)) return;
@@ -1600,7 +1798,8 @@ async function viewNetworkFolder(folderId, subfolder) {
             });
         }
 
-        let html = `<div style="margin-bottom: 16px;"><button class="btn btn-text" onclick="loadNetworkFiles()">← Back</button></div>`;
+        let html = `<div style="margin-bottom: 16px;"><button class="btn btn-text" onclick="loadNetworkFiles()">← Back</button>
+            <button class="btn btn-text" onclick="downloadArchive([], '${escapeHtml(folderId)}', '${escapeHtml(currentNetworkSubfolder)}')">Download all</button></div>`;
         html += `<div class="breadcrumb-container"><div class="breadcrumb">${breadcrumb}</div></div>`;
 
         if (data.folders && data.folders.length > 0) {
@@ -1639,8 +1838,8 @@ async function viewNetworkFolder(folderId, subfolder) {
                             <div class="item-meta">${formatSize(file.file_size)} • ${formatDate(file.modified)}</div>
                         </div>
                         <div class="item-actions">
-                            ${canPreview ? `<button class="btn btn-text" onclick="previewFile('${escapeHtml(file.filepath)}')">Preview</button>` : ''}
-                            <button class="btn btn-text" onclick="downloadFile('${escapeHtml(file.filepath)}')">Download</button>
+                            ${canPreview ? `<button class="btn btn-text" onclick="previewNetworkFile('${escapeHtml(file.id)}', '${escapeHtml(file.file_type)}')">Preview</button>` : ''}
+                            <button class="btn btn-text" onclick="downloadNetworkFile('${escapeHtml(file.id)}')">Download</button>
                             ${canManage ? `<button class="btn btn-text btn-danger-text" onclick="deleteSharedItem('${escapeHtml(folderId)}', '${escapeHtml(file.relative_path)}', 'file', '${escapeHtml(file.filename)}'); event.stopPropagation();">Delete</button>` : ''}
                         </div>
                     </div>`;
@@ -2627,7 +2826,7 @@ async function onDrop(event) {
    MOVE VIA DIALOG (for the menu "Move" option)
    ===================================================== */
 
-async function promptMoveItem(srcPath, type) {
+async function promptMoveItem(srcPath, type, copy = false) {
     // Load folder list to show options
     let folderList = ['(root)'];
     try {
@@ -2651,7 +2850,7 @@ async function promptMoveItem(srcPath, type) {
     dialog.innerHTML = `
         <div class="move-dialog">
             <div class="move-dialog-header">
-                <span>Move "${escapeHtml(name)}"</span>
+                <span>${copy ? 'Copy' : 'Move'} "${escapeHtml(name)}"</span>
                 <button class="move-dialog-close" onclick="document.getElementById('moveDialog').remove()">✕</button>
             </div>
             <div class="move-dialog-body">
@@ -2670,7 +2869,7 @@ async function promptMoveItem(srcPath, type) {
             </div>
             <div class="move-dialog-footer">
                 <button class="btn btn-text" onclick="document.getElementById('moveDialog').remove()">Cancel</button>
-                <button class="btn btn-primary" onclick="executeMoveDialog('${escapeHtml(srcPath)}')">Move</button>
+                <button class="btn btn-primary" onclick="executeMoveDialog('${escapeHtml(srcPath)}', ${copy})">${copy ? 'Copy' : 'Move'}</button>
             </div>
         </div>
     `;
@@ -2678,20 +2877,19 @@ async function promptMoveItem(srcPath, type) {
     document.getElementById('moveDestInput').focus();
 }
 
-async function executeMoveDialog(srcPath) {
+async function executeMoveDialog(srcPath, copy = false) {
     const dest = document.getElementById('moveDestInput')?.value.trim() || '';
     document.getElementById('moveDialog')?.remove();
 
     try {
-        const res = await fetch('/api/move', {
+        const res = await fetch(copy ? '/api/copy' : '/api/move', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json', 'Authorization': 'Bearer ' + token },
             body: JSON.stringify({ src: srcPath, dst_folder: dest })
         });
         const data = await safeJson(res);
-        if (!res.ok) throw new Error(data.msg || 'Move failed');
-        showToast(data.msg, 'success');
-        loadFiles(currentPath);
+        if (!res.ok) throw new Error(data.msg || (copy ? 'Copy failed' : 'Move failed'));
+        await finishJob(data);
     } catch (e) {
         showToast(e.message, 'error');
     }
@@ -0,0 +1,76 @@
+"""Chunked upload throughput with 1, 2, 4 and 8 chunks of a file in flight.
+
+Uploads a 512 MiB file in 8 MiB chunks to a threaded werkzeug server in a
+child process over loopback. An optional sleep before each request stands
+in for the round trip of a real network:
+
+    python benchmarks/bench_chunk_streams.py [latency_seconds]
+
+STREAMS=1,4 limits the stream counts tried.
+"""
+import http.client
+import json
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import start_server
+
+PORT = 8765
+CHUNK = 8 * 1024 * 1024
+SIZE = 512 * 1024 * 1024
+
+
+def main():
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.0
+    directory = tempfile.mkdtemp(prefix="nas_bench_")
+    server = start_server(PORT, directory)
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", PORT)
+        conn.request("POST", "/api/login", json.dumps({"username": "admin", "password": "admin123"}),
+                     {"Content-Type": "application/json"})
+        headers = {"Authorization": "Bearer " + json.loads(conn.getresponse().read())["access_token"]}
+        data = os.urandom(SIZE)
+        chunks = SIZE // CHUNK
+
+        for streams in (int(x) for x in os.getenv("STREAMS", "1,2,4,8").split(",")):
+            local = threading.local()
+            upload_id = f"bench{streams}_{secrets.token_hex(4)}"
+
+            def send(index):
+                if not hasattr(local, "conn"):
+                    local.conn = http.client.HTTPConnection("127.0.0.1", PORT)
+                boundary = secrets.token_hex(8)
+                fields = {"upload_id": upload_id, "filename": upload_id + ".bin", "chunk_index": index,
+                          "total_chunks": chunks, "total_size": SIZE, "chunk_size": CHUNK, "folder": ""}
+                body = b"".join(
+                    f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode()
+                    for k, v in fields.items())
+                body += (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="blob"\r\n\r\n'.encode()
+                         + data[index * CHUNK:(index + 1) * CHUNK] + f"\r\n--{boundary}--\r\n".encode())
+                if latency:
+                    time.sleep(latency)
+                local.conn.request("POST", "/api/upload/chunk", body,
+                                   {**headers, "Content-Type": f"multipart/form-data; boundary={boundary}"})
+                response = local.conn.getresponse()
+                response.read()
+                assert response.status == 200, response.status
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(streams) as pool:
+                list(pool.map(send, range(chunks)))
+            rate = SIZE / (time.perf_counter() - start) / 2 ** 20
+            print(f"rtt +{latency * 1000:.0f} ms, streams={streams}: {rate:.0f} MiB/s", flush=True)
+    finally:
+        server.kill()
+        server.wait()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Concurrent range readers against /api/preview/<video>: throughput and server CPU.
+
+Each of N streams fetches consecutive 8 MiB ranges, like a player's chunked
+requests, from its own region of a 1 GiB file. The server runs in a child
+process (a threaded werkzeug server, so files are read in Python rather
+than sent with sendfile()) once per streaming configuration:
+
+    python benchmarks/bench_range_streams.py [cold|warm]
+
+"cold" drops the file's pages with POSIX_FADV_DONTNEED before each run.
+CONFIGS="64,0,0;256,8,1" picks buffer KB, read-ahead MB and mmap per run;
+STREAMS=1,4,8 the stream counts. Linux only (/proc, posix_fadvise).
+"""
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from harness import process_cpu, start_server
+
+PORT = 8766
+SIZE = 1024 * 2 ** 20
+RANGE = 8 * 2 ** 20
+PER_STREAM = 128 * 2 ** 20
+
+
+def main():
+    cache = sys.argv[1] if len(sys.argv) > 1 else "cold"
+    directory = Path(tempfile.mkdtemp(prefix="nas_bench_"))
+    try:
+        run(cache, directory)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def run(cache, directory):
+    video = directory / "nas_storage" / "admin" / "v.mp4"
+    video.parent.mkdir(parents=True)
+    with open(video, "wb") as f:
+        block = os.urandom(2 ** 20)
+        for _ in range(SIZE // 2 ** 20):
+            f.write(block)
+
+    def drop_cache():
+        fd = os.open(video, os.O_RDONLY)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        os.close(fd)
+
+    def warm_cache():
+        with open(video, "rb") as f:
+            while f.read(2 ** 24):
+                pass
+
+    configs = os.getenv("CONFIGS", "64,0,0;256,0,0;1024,0,0;256,8,0;256,8,1;1024,8,1")
+    streams_tried = [int(x) for x in os.getenv("STREAMS", "1,4,8").split(",")]
+    for spec in configs.split(";"):
+        kb, readahead, use_mmap = spec.split(",")
+        server = start_server(PORT, directory, NAS_STREAM_BUFFER_KB=kb,
+                              NAS_STREAM_READAHEAD_MB=readahead, NAS_STREAM_MMAP=use_mmap)
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", PORT)
+            conn.request("POST", "/api/login", json.dumps({"username": "admin", "password": "admin123"}),
+                         {"Content-Type": "application/json"})
+            token = json.loads(conn.getresponse().read())["access_token"]
+            for n in streams_tried:
+                drop_cache() if cache == "cold" else warm_cache()
+
+                def stream(i):
+                    c = http.client.HTTPConnection("127.0.0.1", PORT)
+                    offset = i * (SIZE // n) if n > 1 else 0
+                    for start in range(offset, offset + PER_STREAM, RANGE):
+                        c.request("GET", f"/api/preview/v.mp4?token={token}",
+                                  headers={"Range": f"bytes={start}-{start + RANGE - 1}"})
+                        response = c.getresponse()
+                        while response.read(2 ** 20):
+                            pass
+                        assert response.status == 206, response.status
+
+                cpu, start = process_cpu(server.pid), time.perf_counter()
+                threads = [threading.Thread(target=stream, args=(i,)) for i in range(n)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                elapsed, cpu = time.perf_counter() - start, process_cpu(server.pid) - cpu
+                total = n * PER_STREAM
+                print(f"{cache:4} buf {kb}K readahead {readahead}M mmap {use_mmap}  streams={n}: "
+                      f"{total / elapsed / 2 ** 20:6.0f} MiB/s total, {total / elapsed / 2 ** 20 / n:5.0f} MiB/s/stream, "
+                      f"server CPU {cpu / (total / 2 ** 30):.2f} s/GiB, {cpu / elapsed * 100 / n:5.1f}% CPU/stream",
+                      flush=True)
+        finally:
+            server.kill()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
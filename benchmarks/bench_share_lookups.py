@@ -0,0 +1,46 @@
+"""GET /api/files on a 5,000-file folder against a growing share registry.
+
+With the indexed registry the listing cost should not depend on how many
+shares exist.
+
+    python benchmarks/bench_share_lookups.py
+"""
+import time
+
+from harness import load_main, login
+
+FILES = 5000
+SHARE_COUNTS = (0, 1000, 5000, 20000)
+REPEAT = 3
+
+
+def main():
+    nas = load_main()
+    client = nas.app.test_client()
+    headers, _ = login(client)
+    folder = nas.STORAGE_DIR / "admin" / "big"
+    folder.mkdir(parents=True)
+    for i in range(FILES):
+        (folder / f"f{i}.txt").write_bytes(b"")
+
+    shares = nas.shared_manager
+    entries, folders = [], []
+    for n in SHARE_COUNTS:
+        for k in range(len(entries), n):
+            entries.append((f"u{k % 50}", f"p/{k}.txt", "x", 0, "text"))
+            if k % 10 == 0:
+                folders.append(k)
+        # Seed through the public API: one write per batch
+        shares.request_shares_bulk(entries[len(shares.get_approved()):], auto_approve=True)
+        for k in folders:
+            if not shares.is_folder_shared("admin", f"other{k}"):
+                shares.approve_folder_share(shares.request_folder_share("admin", f"other{k}", "o"))
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            assert client.get("/api/files?folder=big", headers=headers).status_code == 200
+        ms = (time.perf_counter() - start) / REPEAT * 1000
+        print(f"{n:6} shares: {ms:6.1f} ms per listing", flush=True)
+
+
+if __name__ == "__main__":
+    main()
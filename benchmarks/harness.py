@@ -0,0 +1,65 @@
+"""Helpers shared by the benchmark scripts.
+
+main.py keeps its data files next to itself and reads its NAS_* settings at
+import time, so each benchmark works on a copy of it in a scratch directory.
+Run as a script, this module serves such a copy over HTTP:
+
+    python benchmarks/harness.py serve PORT DIR
+"""
+import importlib.util
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+MAIN = Path(__file__).resolve().parent.parent / "main.py"
+
+
+def load_main(directory=None, **env):
+    """Import a copy of main.py living in `directory` (a new temp dir by default)."""
+    directory = Path(directory or tempfile.mkdtemp(prefix="nas_bench_"))
+    directory.mkdir(parents=True, exist_ok=True)
+    os.environ.update(env)
+    shutil.copy(MAIN, directory / "main.py")
+    name = f"nas_bench_{directory.name}"
+    spec = importlib.util.spec_from_file_location(name, directory / "main.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    module.logger.setLevel(logging.ERROR)
+    return module
+
+
+def login(client, username="admin", password="admin123"):
+    """Bearer headers and raw token for a Flask test client."""
+    token = client.post("/api/login", json={"username": username, "password": password}).get_json()["access_token"]
+    return {"Authorization": "Bearer " + token}, token
+
+
+def start_server(port, directory, **env):
+    """Run a threaded werkzeug server for `directory` in a child process; returns it once ready."""
+    proc = subprocess.Popen([sys.executable, __file__, "serve", str(port), str(directory)],
+                            env={**os.environ, **env}, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, text=True)
+    while proc.stdout.readline().strip() != "ready":
+        if proc.poll() is not None:
+            raise RuntimeError("benchmark server failed to start")
+    return proc
+
+
+def process_cpu(pid):
+    """User + system CPU seconds used so far by a process (Linux /proc)."""
+    fields = open(f"/proc/{pid}/stat").read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+if __name__ == "__main__" and sys.argv[1:2] == ["serve"]:
+    from werkzeug.serving import make_server
+    nas = load_main(sys.argv[3])
+    server = make_server("127.0.0.1", int(sys.argv[2]), nas.app, threaded=True)
+    print("ready", flush=True)
+    server.serve_forever()
@@ -1,11 +1,16 @@
 from flask import Flask, request, jsonify, send_from_directory, send_file, make_response, abort
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from flask_cors import CORS
-import bcrypt, json, os, shutil, logging, secrets, re, mimetypes
+import bcrypt, json, os, shutil, logging, secrets, re, mimetypes, sqlite3, threading, tempfile, atexit, functools, copy, time, base64, hashlib, errno, queue, zipfile, tarfile, zlib, mmap
 from pathlib import Path
-from datetime import datetime, timedelta
+from contextlib import contextmanager, nullcontext
+from collections import OrderedDict, Counter
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
 from werkzeug.utils import secure_filename
-from PIL import Image
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
+from PIL import Image, ImageOps
 import io
 
 # Load .env file if present (development convenience)
@@ -29,10 +34,28 @@ except ImportError:
     OPENPYXL_AVAILABLE = False
     print("⚠️  openpyxl not installed - Excel preview disabled. Run: pip install openpyxl")
 
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:  # Windows
+    FCNTL_AVAILABLE = False
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    WATCHDOG_AVAILABLE = False
+
 BASE_DIR = Path(__file__).parent
 STORAGE_DIR = BASE_DIR / "nas_storage"
 USERS_FILE = BASE_DIR / "users.json"
 SHARED_FILE = BASE_DIR / "shared_files.json"
+DB_FILE = BASE_DIR / "nas.db"
+FILE_INDEX_FILE = BASE_DIR / ".file_index.db"
+BLOB_DIR = BASE_DIR / "blob_store"
+JOBS_FILE = BASE_DIR / ".jobs.db"
+RENDITION_DIR = BASE_DIR / ".renditions"
 LOG_DIR = BASE_DIR / "logs"
 STATIC_DIR = BASE_DIR / "static"
 
@@ -40,7 +63,80 @@ STORAGE_DIR.mkdir(exist_ok=True)
 LOG_DIR.mkdir(exist_ok=True)
 STATIC_DIR.mkdir(exist_ok=True)
 
-JWT_SECRET = os.getenv("JWT_SECRET_KEY", secrets.token_urlsafe(64))
+# "sqlite" (default) or "json" — see create_storage_backend()
+STORAGE_BACKEND = os.getenv("NAS_STORAGE_BACKEND", "sqlite").lower()
+# JSON backend only: coalesce users.json / shared_files.json rewrites within this window
+JSON_WRITE_DELAY = int(os.getenv("NAS_JSON_WRITE_DELAY_MS", "1000")) / 1000
+# Several worker processes (e.g. gunicorn -w 4) serve the same BASE_DIR:
+# writes take a cross-process file lock and each worker reloads state
+# another worker changed. See SyncedManager.
+SHARED_STATE = os.getenv("NAS_SHARED_STATE", "0").lower() in ("1", "true", "yes")
+JWT_SECRET_FILE = BASE_DIR / ".jwt_secret"
+# Uploads/deletes adjust storage_used by deltas; a background pass re-walks
+# every home directory this often to correct drift (0 disables it)
+STORAGE_RECONCILE_INTERVAL = int(os.getenv("NAS_STORAGE_RECONCILE_SECONDS", "3600"))
+# Background pass dropping shares whose file/folder no longer exists (0 disables)
+SHARE_RECONCILE_INTERVAL = int(os.getenv("NAS_SHARE_RECONCILE_SECONDS", "300"))
+# Also prune on filesystem delete/move events under nas_storage (needs watchdog)
+WATCH_STORAGE = os.getenv("NAS_WATCH_STORAGE", "0").lower() in ("1", "true", "yes")
+# /api/stats re-checks directory mtimes at most this often when nothing was invalidated
+STATS_REVALIDATE_INTERVAL = int(os.getenv("NAS_STATS_REVALIDATE_SECONDS", "30"))
+# Hash uploads while they are written and record the digest in the file index.
+# Chunks whose client sends an expected digest are hashed either way.
+UPLOAD_DIGESTS = os.getenv("NAS_UPLOAD_DIGESTS", "1").lower() in ("1", "true", "yes")
+# Chunked uploads idle this long are deleted from tmp_uploads by a background
+# pass running every NAS_UPLOAD_JANITOR_SECONDS (0 disables the pass)
+UPLOAD_TTL = int(os.getenv("NAS_UPLOAD_TTL_SECONDS", "86400"))
+UPLOAD_JANITOR_INTERVAL = int(os.getenv("NAS_UPLOAD_JANITOR_SECONDS", "600"))
+# Total size of unfinished uploads; new ones beyond it are refused. Defaults to half
+# the free space on the storage disk at startup (0 = no limit)
+UPLOAD_BUDGET = os.getenv("NAS_UPLOAD_BUDGET_MB", "").strip()
+UPLOAD_BUDGET = int(UPLOAD_BUDGET) * 1024 * 1024 if UPLOAD_BUDGET else shutil.disk_usage(STORAGE_DIR).free // 2
+# Content-addressed dedup of stored files: "off" (default), "reflink" (copy-on-write
+# clones, btrfs/XFS) or "hardlink" (any POSIX filesystem; deduped files share an
+# inode, which is safe since the app only ever replaces files). See DedupStore.
+DEDUP_MODE = os.getenv("NAS_DEDUP", "off").lower()
+# /api/copy and /api/bulk/copy run copies bigger than this as background jobs
+COPY_JOB_THRESHOLD = int(os.getenv("NAS_COPY_JOB_THRESHOLD_MB", "64")) * 1024 * 1024
+# Worker threads for background file jobs (bulk delete/move/copy, folder delete)
+JOB_WORKERS = max(1, int(os.getenv("NAS_JOB_WORKERS", "2")))
+# Archive extraction limits (zip bombs): total bytes written, entries, and bytes
+# written per byte of archive (archives under 1 MiB may always expand to 256 MiB)
+EXTRACT_MAX_BYTES = int(os.getenv("NAS_EXTRACT_MAX_MB", "51200")) * 1024 * 1024
+EXTRACT_MAX_FILES = int(os.getenv("NAS_EXTRACT_MAX_FILES", "100000"))
+EXTRACT_MAX_RATIO = int(os.getenv("NAS_EXTRACT_MAX_RATIO", "256"))
+# File serving when the server can't sendfile(): read size per block, a
+# posix_fadvise(WILLNEED) window kept ahead of each stream (0 = leave it to the
+# kernel's read-ahead; worth trying on spinning disks), and reads from an mmap
+# of the file instead of read() calls. With mmap, a file truncated in place while
+# it is being served raises SIGBUS and kills the worker: only enable it when no
+# other program edits the served files (the app replaces files, never truncates)
+STREAM_BUFFER_SIZE = max(64, int(os.getenv("NAS_STREAM_BUFFER_KB", "256"))) * 1024
+STREAM_READAHEAD = int(os.getenv("NAS_STREAM_READAHEAD_MB", "0")) * 1024 * 1024
+STREAM_MMAP = os.getenv("NAS_STREAM_MMAP", "0").lower() in ("1", "true", "yes")
+# Disk budget for resized image previews/thumbnails; least recently used go first
+RENDITION_CACHE_BYTES = int(os.getenv("NAS_RENDITION_CACHE_MB", "1024")) * 1024 * 1024
+
+
+def _shared_jwt_secret(path):
+    """Secret generated by whichever worker starts first and read by the rest."""
+    if not path.exists():
+        fd, tmp_name = tempfile.mkstemp(dir=str(path.parent), prefix=f"{path.name}.")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_urlsafe(64))
+            os.link(tmp_name, path)   # atomic, fails if another worker won the race
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_name)
+    return path.read_text().strip()
+
+
+# Tokens must verify in every worker, so a generated secret is shared via a file
+JWT_SECRET = os.getenv("JWT_SECRET_KEY") or (
+    _shared_jwt_secret(JWT_SECRET_FILE) if SHARED_STATE else secrets.token_urlsafe(64)
+)
 
 DANGEROUS_EXTENSIONS = {
     'exe', 'bat', 'cmd', 'com', 'pif', 'scr', 'vbs', 'msi', 'hta',
@@ -134,27 +230,646 @@ def sanitize_relative_path(rel_path):
     return "/".join(clean_parts)
 
 
-class SharedFilesManager:
-    def __init__(self, shared_file):
+def directory_size(path):
+    """Total bytes of the regular files under path (symlinks are not followed)."""
+    total = 0
+    stack = [str(path)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            total += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return total
+
+
+def path_size(path):
+    """Bytes a file or folder occupies; 0 if it does not exist."""
+    try:
+        if path.is_dir():
+            return directory_size(path)
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+# ==================== CONCURRENCY ====================
+# The managers are shared by request threads and background threads (yt-dlp,
+# persistence timers); every public method takes the manager's RWLock.
+# With SHARED_STATE they are also shared by sibling worker processes, which
+# coordinate through process_lock() and the backend's version() token.
+
+class RWLock:
+    """Many concurrent readers or one writer; waiting writers block new readers.
+
+    Re-entrant per thread: a writer may take read or write again, and a reader
+    may nest reads (but cannot upgrade to write).
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def read(self):
+        me = threading.get_ident()
+        depth = getattr(self._local, "reads", 0)
+        if self._writer == me or depth:
+            self._local.reads = depth + 1
+            try:
+                yield
+            finally:
+                self._local.reads = depth
+            return
+        with self._cond:
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        self._local.reads = 1
+        try:
+            yield
+        finally:
+            self._local.reads = 0
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def held(self):
+        """True if the calling thread holds this lock (read or write)."""
+        return self._writer == threading.get_ident() or bool(getattr(self._local, "reads", 0))
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+            else:
+                if getattr(self._local, "reads", 0):
+                    raise RuntimeError("cannot upgrade a read lock to a write lock")
+                self._writers_waiting += 1
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._writers_waiting -= 1
+                self._writer = me
+                self._writer_depth = 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer_depth -= 1
+                if not self._writer_depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+@contextmanager
+def process_lock(path):
+    """Exclusive flock() on `path`, serializing writers across worker processes.
+
+    The file is opened per acquisition: a descriptor inherited over fork()
+    would share its lock with the parent. No-op where fcntl is unavailable.
+    """
+    if not FCNTL_AVAILABLE:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class SyncedManager:
+    """In-memory state guarded by an RWLock and kept in step with the backend.
+
+    Subclasses set DOCUMENT ("users" / "shares") and implement _reload(). In
+    SHARED_STATE mode the outermost write holds the backend's process lock and
+    reloads first if another process committed since we last looked; reads
+    compare the backend's cheap version token and reload only when it moved.
+    """
+    DOCUMENT = None
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = RWLock()
+        self._seen_version = None
+        self._syncing = False
+        self.reloads = 0
+
+    def _reload(self):
+        raise NotImplementedError
+
+    def _sync(self):
+        version = self.backend.version(self.DOCUMENT)
+        if version != self._seen_version:
+            self._reload()
+            self.reloads += 1
+            self._seen_version = version
+
+    @contextmanager
+    def _reading(self):
+        if (SHARED_STATE and not self._lock.held()
+                and self.backend.version(self.DOCUMENT) != self._seen_version):
+            with self._writing():
+                pass
+        with self._lock.read():
+            yield
+
+    @contextmanager
+    def _writing(self):
+        with self._lock.write():
+            if not SHARED_STATE or self._syncing:
+                yield
+                return
+            self._syncing = True
+            try:
+                with self.backend.process_lock(self.DOCUMENT):
+                    self._sync()
+                    yield
+                    self._seen_version = self.backend.version(self.DOCUMENT)
+            finally:
+                self._syncing = False
+
+
+def _reads(method):
+    """Run a manager method under its read lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._reading():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _writes(method):
+    """Run a manager method under its write lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._writing():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# ==================== STORAGE BACKENDS ====================
+# Users and share entries are held in memory by the managers below; a backend
+# only loads them at startup and persists changes. `changed`/`deleted` name the
+# records touched by a mutation so row-based backends can write just those;
+# changed=None means "persist everything". `lock` is the caller's RWLock, for
+# backends that serialize the document later, off the calling thread.
+# version(document) is a cheap token that changes whenever the stored
+# "users" / "shares" document does; process_lock(document) serializes writers.
+
+def atomic_write_text(path, text):
+    """Write text to a temp file next to path and os.replace() it into place."""
+    fd, tmp_name = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write_json(path, data):
+    atomic_write_text(path, json.dumps(data, indent=2, ensure_ascii=False))
+
+
+class WriteBehindPersister:
+    """Coalesces JSON document writes requested within `delay` seconds into one.
+
+    schedule() records the latest render callable (returning the file's text)
+    per path and arms a timer; when it fires each dirty path is rendered and
+    written once with atomic_write_text().
+    flush() is registered with atexit so nothing pending is lost on shutdown.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}   # path -> callable returning the file text
+        self._timer = None
+        self.writes_requested = 0
+        self.writes_performed = 0
+        atexit.register(self.flush)
+
+    def schedule(self, path, render):
+        with self._lock:
+            self.writes_requested += 1
+            if self.delay > 0:
+                self._pending[path] = render
+                if self._timer is None:
+                    self._timer = threading.Timer(self.delay, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        # No delay: write only this path, here and outside _flush_lock. The
+        # caller holds its own document's write lock; rendering another
+        # manager's pending document from this thread could deadlock on that
+        # manager's lock while its writer waits for us.
+        atomic_write_text(path, render())
+        with self._lock:
+            self.writes_performed += 1
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            for path, render in pending.items():
+                atomic_write_text(path, render())
+                with self._lock:
+                    self.writes_performed += 1
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "write_delay_ms": int(self.delay * 1000),
+                "writes_requested": self.writes_requested,
+                "writes_performed": self.writes_performed,
+                "writes_saved": self.writes_requested - self.writes_performed - len(self._pending),
+                "writes_pending": len(self._pending),
+            }
+
+
+class JsonBackend:
+    """Whole-document users.json / shared_files.json, fine for small installs.
+
+    Writes go through a WriteBehindPersister, so a burst of mutations (e.g. a
+    bulk upload with auto-share) costs one atomic rewrite per file. Share
+    buckets are id -> entry dicts in memory (see SharedFilesManager) and
+    lists in the file.
+    """
+
+    def __init__(self, users_file, shared_file, write_delay=0):
+        self.users_file = users_file
         self.shared_file = shared_file
+        self.persister = WriteBehindPersister(write_delay)
+
+    def load_users(self):
+        if not self.users_file.exists():
+            return None
+        try:
+            with open(self.users_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            backup = self.users_file.with_suffix('.json.backup')
+            self.users_file.rename(backup)
+            print(f"⚠️  Corrupted users.json backed up to {backup}")
+            return None
+
+    @staticmethod
+    def _render(document, lock):
+        def render():
+            with lock.read() if lock else nullcontext():
+                return json.dumps(document, indent=2, ensure_ascii=False)
+        return render
+
+    def commit_users(self, users, changed=None, deleted=(), lock=None):
+        self.persister.schedule(self.users_file, self._render(users, lock))
+
+    def load_shares(self):
+        if not self.shared_file.exists():
+            return None
+        try:
+            with open(self.shared_file, 'r', encoding='utf-8') as f:
+                buckets = json.load(f)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return None
+        return {bucket: {entry["id"]: entry for entry in entries} for bucket, entries in buckets.items()}
+
+    def commit_shares(self, shared_files, changed=None, deleted=(), lock=None):
+        def render():
+            with lock.read() if lock else nullcontext():
+                return json.dumps({bucket: list(entries.values()) for bucket, entries in shared_files.items()},
+                                  indent=2, ensure_ascii=False)
+        self.persister.schedule(self.shared_file, render)
+
+    def _path(self, document):
+        return self.users_file if document == "users" else self.shared_file
+
+    def version(self, document):
+        try:
+            st = os.stat(self._path(document))
+        except FileNotFoundError:
+            return None
+        # atomic_write_text() replaces the file, so the inode changes on every write
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def process_lock(self, document):
+        path = self._path(document)
+        return process_lock(path.with_name(f".{path.name}.lock"))
+
+    def metrics(self):
+        return {"backend": "json", **self.persister.metrics()}
+
+
+class SqliteBackend:
+    """WAL-mode SQLite database: each mutation writes only the rows it touched."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            data     TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS shares (
+            id     TEXT PRIMARY KEY,
+            bucket TEXT NOT NULL,
+            seq    INTEGER NOT NULL,
+            data   TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS shares_bucket_seq ON shares (bucket, seq);
+        CREATE TABLE IF NOT EXISTS meta (
+            key   TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, db_file, users_file=None, shared_file=None):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript(self.SCHEMA)
+        self.row_writes = 0
+        self._data_version = None
+        self._versions = {}
+        if users_file is not None and shared_file is not None:
+            with self.process_lock("migrate"):
+                self._migrate_from_json(JsonBackend(users_file, shared_file))
+
+    def _migrate_from_json(self, source):
+        """One-shot import of users.json / shared_files.json into an empty database."""
+        with self._lock:
+            done = self._conn.execute("SELECT value FROM meta WHERE key = 'migrated_from_json'").fetchone()
+            has_users = self._conn.execute("SELECT 1 FROM users LIMIT 1").fetchone()
+        if done or has_users:
+            return
+        users = source.load_users() if source.users_file.exists() else None
+        shares = source.load_shares() if source.shared_file.exists() else None
+        if users:
+            self.commit_users(users)
+        if shares:
+            self.commit_shares(shares)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+                (datetime.now().isoformat(),)
+            )
+        if users or shares:
+            print(f"✓ Imported {len(users or {})} user(s) and existing shares into {self.db_file.name}")
+
+    def load_users(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT username, data FROM users ORDER BY rowid").fetchall()
+        if not rows:
+            return None
+        return {username: json.loads(data) for username, data in rows}
+
+    def commit_users(self, users, changed=None, deleted=(), lock=None):
+        # Called with the manager's write lock held, so users is stable here
+        with self._lock, self._conn:
+            if changed is None:
+                self._conn.execute("DELETE FROM users WHERE username NOT IN (%s)"
+                                   % ",".join("?" * len(users)), list(users))
+                changed = list(users)
+            self._conn.executemany(
+                "INSERT INTO users (username, data) VALUES (?, ?) "
+                "ON CONFLICT(username) DO UPDATE SET data = excluded.data",
+                [(u, json.dumps(users[u], ensure_ascii=False)) for u in changed if u in users]
+            )
+            self._conn.executemany("DELETE FROM users WHERE username = ?", [(u,) for u in deleted])
+            self._bump_version("users")
+            self.row_writes += len(changed) + len(deleted)
+
+    def load_shares(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT bucket, data FROM shares ORDER BY seq").fetchall()
+            migrated = self._conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_json'").fetchone()
+        if not rows and not migrated:
+            return None
+        shared_files = {}
+        for bucket, data in rows:
+            entry = json.loads(data)
+            shared_files.setdefault(bucket, {})[entry["id"]] = entry
+        return shared_files
+
+    def commit_shares(self, shared_files, changed=None, deleted=(), lock=None):
+        with self._lock, self._conn:
+            if changed is None:
+                self._conn.execute("DELETE FROM shares")
+                self._conn.executemany(
+                    "INSERT INTO shares (id, bucket, seq, data) VALUES (?, ?, ?, ?)",
+                    [(entry["id"], bucket, seq, json.dumps(entry, ensure_ascii=False))
+                     for seq, (bucket, entry) in enumerate(
+                         (b, e) for b, entries in shared_files.items() for e in entries.values())]
+                )
+                self._bump_version("shares")
+                self.row_writes += sum(len(entries) for entries in shared_files.values())
+                return
+            # An entry moving to another bucket is appended to the end of it, the
+            # same as inserting it into the in-memory bucket dict.
+            self._conn.executemany(
+                "INSERT INTO shares (id, bucket, seq, data) "
+                "VALUES (?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM shares), ?) "
+                "ON CONFLICT(id) DO UPDATE SET "
+                "seq = CASE WHEN shares.bucket = excluded.bucket THEN shares.seq ELSE excluded.seq END, "
+                "bucket = excluded.bucket, data = excluded.data",
+                [(entry["id"], bucket, json.dumps(entry, ensure_ascii=False)) for bucket, entry in changed]
+            )
+            self._conn.executemany("DELETE FROM shares WHERE id = ?", [(i,) for i in deleted])
+            self._bump_version("shares")
+            self.row_writes += len(changed) + len(deleted)
+
+    def _bump_version(self, document):
+        # Inside the commit's transaction, with self._lock held
+        key = f"{document}_version"
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1", (key,)
+        )
+        self._versions[key] = self._conn.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+    def version(self, document):
+        # data_version only moves when another connection commits, so the
+        # common case is one PRAGMA without touching the meta table.
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self._versions = dict(self._conn.execute(
+                    "SELECT key, value FROM meta WHERE key IN ('users_version', 'shares_version')"))
+            return self._versions.get(f"{document}_version")
+
+    def process_lock(self, document):
+        return process_lock(self.db_file.with_name(f".{self.db_file.name}.{document}.lock"))
+
+    def metrics(self):
+        return {"backend": "sqlite", "row_writes": self.row_writes}
+
+
+def create_storage_backend():
+    if STORAGE_BACKEND == "json":
+        # Other workers must see a write as soon as its lock is released
+        return JsonBackend(USERS_FILE, SHARED_FILE, write_delay=0 if SHARED_STATE else JSON_WRITE_DELAY)
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteBackend(DB_FILE, USERS_FILE, SHARED_FILE)
+    raise ValueError(f"Unknown NAS_STORAGE_BACKEND: {STORAGE_BACKEND!r} (expected 'sqlite' or 'json')")
+
+
+class SharedFilesManager(SyncedManager):
+    """Share requests and approved shares, in buckets of id -> entry dicts.
+
+    The dicts keep insertion order, so an entry moved to another bucket goes
+    to its end, and removing one by id is constant-time.
+    """
+
+    BUCKETS = ("pending", "approved", "pending_folders", "folders")
+    DOCUMENT = "shares"
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        # Bumped on every change; part of the ETags of listings that show share state
+        self._generation = 0
         self.load_shared_files()
 
+    @_writes
     def load_shared_files(self):
-        if self.shared_file.exists():
-            try:
-                with open(self.shared_file, 'r', encoding='utf-8') as f:
-                    self.shared_files = json.load(f)
-            except (json.JSONDecodeError, UnicodeDecodeError):
-                self.shared_files = {"pending": [], "approved": [], "folders": []}
-                self.save_shared_files()
-        else:
-            self.shared_files = {"pending": [], "approved": [], "folders": []}
-            self.save_shared_files()
+        self._reload()
 
-    def save_shared_files(self):
-        with open(self.shared_file, 'w', encoding='utf-8') as f:
-            json.dump(self.shared_files, f, indent=2, ensure_ascii=False)
+    def _reload(self):
+        self.shared_files = self.backend.load_shares()
+        if self.shared_files is None:
+            self.shared_files = {"pending": {}, "approved": {}, "folders": {}}
+            self.save_shared_files()
+        for bucket in self.BUCKETS:
+            self.shared_files.setdefault(bucket, {})
+        self._rebuild_indexes()
+        self._generation += 1
+
+    def save_shared_files(self, changed=None, deleted=()):
+        """Persist shares; changed is a list of (bucket, entry), deleted a list of ids."""
+        self._generation += 1
+        self.backend.commit_shares(self.shared_files, changed, deleted, lock=self._lock)
+
+    @_reads
+    def generation(self):
+        """Change counter for ETags; reading it first catches up with other workers' writes."""
+        return self._generation
+
+    # ── Indexes ──────────────────────────────────────────────────
+    # _by_id:    entry id -> (bucket, entry)
+    # _by_path:  (bucket, username, path) -> [entries]
+    # _tries:    (bucket, username) -> path trie; each node maps a path segment
+    #            to its child node, and None to the entries at exactly that path.
+
+    @staticmethod
+    def _entry_path(entry):
+        return entry["folder_path"] if "folder_path" in entry else entry["filepath"]
+
+    def _rebuild_indexes(self):
+        self._by_id = {}
+        self._by_path = {}
+        self._tries = {}
+        for bucket in self.BUCKETS:
+            for entry in self.shared_files[bucket].values():
+                self._index_add(bucket, entry)
+
+    def _index_add(self, bucket, entry):
+        path = self._entry_path(entry)
+        self._by_id[entry["id"]] = (bucket, entry)
+        self._by_path.setdefault((bucket, entry["username"], path), []).append(entry)
+        node = self._tries.setdefault((bucket, entry["username"]), {})
+        for seg in path.split("/"):
+            node = node.setdefault(seg, {})
+        node.setdefault(None, []).append(entry)
+
+    def _index_remove(self, bucket, entry):
+        path = self._entry_path(entry)
+        self._by_id.pop(entry["id"], None)
+        key = (bucket, entry["username"], path)
+        entries = [e for e in self._by_path.get(key, []) if e is not entry]
+        if entries:
+            self._by_path[key] = entries
+        else:
+            self._by_path.pop(key, None)
+        root = self._tries.get((bucket, entry["username"]))
+        if root is None:
+            return
+        segs = path.split("/")
+        trail = [root]
+        for seg in segs:
+            child = trail[-1].get(seg)
+            if child is None:
+                return
+            trail.append(child)
+        trail[-1][None] = [e for e in trail[-1].get(None, []) if e is not entry]
+        if not trail[-1][None]:
+            del trail[-1][None]
+        # Prune now-empty nodes back towards the root
+        for depth in range(len(segs), 0, -1):
+            if trail[depth]:
+                break
+            del trail[depth - 1][segs[depth - 1]]
+        if not root:
+            del self._tries[(bucket, entry["username"])]
+
+    def _pop_entry(self, bucket, entry_id):
+        """Remove and return the entry with this id from bucket, or None."""
+        found = self._by_id.get(entry_id)
+        if not found or found[0] != bucket:
+            return None
+        entry = self.shared_files[bucket].pop(entry_id)
+        self._index_remove(bucket, entry)
+        return entry
+
+    def _pop_entries(self, bucket, entry_ids):
+        """Remove every entry in bucket whose id is in entry_ids; return them."""
+        wanted = {i for i in entry_ids if self._by_id.get(i, (None,))[0] == bucket}
+        if not wanted:
+            return []
+        popped = [self.shared_files[bucket].pop(i) for i in wanted]
+        for entry in popped:
+            self._index_remove(bucket, entry)
+        return popped
+
+    def _find_folder(self, username, filepath):
+        node = self._tries.get(("folders", username))
+        if node is None:
+            return None
+        for seg in filepath.split("/"):
+            node = node.get(seg)
+            if node is None:
+                return None
+            if None in node:
+                return node[None][0]
+        return None
 
+    @_writes
     def request_share(self, username, filepath, filename, file_size, file_type):
         file_entry = {
             "id": secrets.token_urlsafe(16),
@@ -166,10 +881,12 @@ class SharedFilesManager:
             "requested_at": datetime.now().isoformat(),
             "status": "pending"
         }
-        self.shared_files["pending"].append(file_entry)
-        self.save_shared_files()
+        self.shared_files["pending"][file_entry["id"]] = file_entry
+        self._index_add("pending", file_entry)
+        self.save_shared_files(changed=[("pending", file_entry)])
         return file_entry["id"]
 
+    @_writes
     def request_folder_share(self, username, folder_path, folder_name):
         folder_entry = {
             "id": secrets.token_urlsafe(16),
@@ -179,177 +896,241 @@ class SharedFilesManager:
             "requested_at": datetime.now().isoformat(),
             "status": "pending"
         }
-        if "pending_folders" not in self.shared_files:
-            self.shared_files["pending_folders"] = []
-        self.shared_files["pending_folders"].append(folder_entry)
-        self.save_shared_files()
+        self.shared_files["pending_folders"][folder_entry["id"]] = folder_entry
+        self._index_add("pending_folders", folder_entry)
+        self.save_shared_files(changed=[("pending_folders", folder_entry)])
         return folder_entry["id"]
 
+    @_writes
+    def request_shares_bulk(self, entries, auto_approve=False):
+        """Create share entries for many files and persist them in one write.
+
+        entries is an iterable of (username, filepath, filename, file_size, file_type)
+        tuples. With auto_approve the entries go straight to "approved".
+        Returns the new ids in the same order.
+        """
+        bucket = "approved" if auto_approve else "pending"
+        now = datetime.now().isoformat()
+        changed = []
+        for username, filepath, filename, file_size, file_type in entries:
+            file_entry = {
+                "id": secrets.token_urlsafe(16),
+                "username": username,
+                "filepath": filepath,
+                "filename": filename,
+                "file_size": file_size,
+                "file_type": file_type,
+                "requested_at": now,
+                "status": "pending"
+            }
+            if auto_approve:
+                file_entry["status"] = "approved"
+                file_entry["approved_at"] = now
+            self.shared_files[bucket][file_entry["id"]] = file_entry
+            self._index_add(bucket, file_entry)
+            changed.append((bucket, file_entry))
+        if changed:
+            self.save_shared_files(changed=changed)
+        return [entry["id"] for _, entry in changed]
+
+    @_writes
     def approve_share(self, file_id):
-        for i, entry in enumerate(self.shared_files["pending"]):
-            if entry["id"] == file_id:
-                entry["status"] = "approved"
-                entry["approved_at"] = datetime.now().isoformat()
-                self.shared_files["approved"].append(entry)
-                self.shared_files["pending"].pop(i)
-                self.save_shared_files()
-                return True
-        return False
+        entry = self._pop_entry("pending", file_id)
+        if entry is None:
+            return False
+        entry["status"] = "approved"
+        entry["approved_at"] = datetime.now().isoformat()
+        self.shared_files["approved"][entry["id"]] = entry
+        self._index_add("approved", entry)
+        self.save_shared_files(changed=[("approved", entry)])
+        return True
 
+    @_writes
     def approve_folder_share(self, folder_id):
-        if "pending_folders" not in self.shared_files:
-            self.shared_files["pending_folders"] = []
-        if "folders" not in self.shared_files:
-            self.shared_files["folders"] = []
-
-        for i, entry in enumerate(self.shared_files["pending_folders"]):
-            if entry["id"] == folder_id:
-                entry["status"] = "approved"
-                entry["approved_at"] = datetime.now().isoformat()
-                self.shared_files["folders"].append(entry)
-                self.shared_files["pending_folders"].pop(i)
-                self.save_shared_files()
-                return True
-        return False
+        entry = self._pop_entry("pending_folders", folder_id)
+        if entry is None:
+            return False
+        entry["status"] = "approved"
+        entry["approved_at"] = datetime.now().isoformat()
+        self.shared_files["folders"][entry["id"]] = entry
+        self._index_add("folders", entry)
+        self.save_shared_files(changed=[("folders", entry)])
+        return True
 
+    @_writes
     def reject_share(self, file_id):
-        for i, entry in enumerate(self.shared_files["pending"]):
-            if entry["id"] == file_id:
-                self.shared_files["pending"].pop(i)
-                self.save_shared_files()
-                return True
-        return False
+        if self._pop_entry("pending", file_id) is None:
+            return False
+        self.save_shared_files(deleted=[file_id])
+        return True
 
+    @_writes
     def reject_folder_share(self, folder_id):
-        if "pending_folders" not in self.shared_files:
+        if self._pop_entry("pending_folders", folder_id) is None:
             return False
-        for i, entry in enumerate(self.shared_files["pending_folders"]):
-            if entry["id"] == folder_id:
-                self.shared_files["pending_folders"].pop(i)
-                self.save_shared_files()
-                return True
-        return False
+        self.save_shared_files(deleted=[folder_id])
+        return True
 
+    @_writes
     def remove_share(self, file_id):
-        for i, entry in enumerate(self.shared_files["approved"]):
-            if entry["id"] == file_id:
-                self.shared_files["approved"].pop(i)
-                self.save_shared_files()
-                return True
-        return False
+        if self._pop_entry("approved", file_id) is None:
+            return False
+        self.save_shared_files(deleted=[file_id])
+        return True
 
+    @_writes
     def remove_folder_share(self, folder_id):
-        if "folders" not in self.shared_files:
+        if self._pop_entry("folders", folder_id) is None:
             return False
-        for i, entry in enumerate(self.shared_files["folders"]):
-            if entry["id"] == folder_id:
-                self.shared_files["folders"].pop(i)
-                self.save_shared_files()
-                return True
-        return False
+        self.save_shared_files(deleted=[folder_id])
+        return True
+
+    @_writes
+    def _drop_bulk(self, bucket, entry_ids):
+        popped = self._pop_entries(bucket, entry_ids)
+        if popped:
+            self.save_shared_files(deleted=[e["id"] for e in popped])
+        return len(popped)
+
+    def reject_shares_bulk(self, file_ids):
+        """Reject many pending file shares with one write; returns how many were removed."""
+        return self._drop_bulk("pending", file_ids)
 
+    def remove_shares_bulk(self, file_ids):
+        """Remove many approved file shares with one write; returns how many were removed."""
+        return self._drop_bulk("approved", file_ids)
+
+    def remove_folder_shares_bulk(self, folder_ids):
+        """Remove many approved folder shares with one write; returns how many were removed."""
+        return self._drop_bulk("folders", folder_ids)
+
+    # Readers get copies so callers can serialize them without holding the lock.
+
+    @_reads
     def get_pending(self):
-        return self.shared_files["pending"]
+        return [dict(e) for e in self.shared_files["pending"].values()]
 
+    @_reads
     def get_pending_folders(self):
-        if "pending_folders" not in self.shared_files:
-            self.shared_files["pending_folders"] = []
-        return self.shared_files["pending_folders"]
+        return [dict(e) for e in self.shared_files["pending_folders"].values()]
 
+    @_reads
     def get_approved(self):
-        return self.shared_files["approved"]
+        return [dict(e) for e in self.shared_files["approved"].values()]
 
+    @_reads
     def get_approved_folders(self):
-        if "folders" not in self.shared_files:
-            self.shared_files["folders"] = []
-        return self.shared_files["folders"]
-
-    def is_file_shared(self, username, filepath):
-        for entry in self.shared_files["approved"]:
-            if entry["username"] == username and entry["filepath"] == filepath:
-                return True
-        return False
-
-    def is_folder_shared(self, username, folder_path):
-        if "folders" not in self.shared_files:
-            return False
-        for entry in self.shared_files["folders"]:
-            if entry["username"] == username and entry["folder_path"] == folder_path:
-                return True
-        return False
+        return [dict(e) for e in self.shared_files["folders"].values()]
 
-    def is_in_shared_folder(self, username, filepath):
-        if "folders" not in self.shared_files:
-            return False
-        for folder in self.shared_files["folders"]:
-            if folder["username"] == username:
-                if filepath.startswith(folder["folder_path"] + "/") or filepath == folder["folder_path"]:
-                    return True
-        return False
+    @_reads
+    def get_approved_share(self, file_id):
+        found = self._by_id.get(file_id)
+        return dict(found[1]) if found and found[0] == "approved" else None
 
-    def get_shared_folder_for_path(self, username, filepath):
-        """Return the shared folder entry that contains the given filepath, or None."""
-        if "folders" not in self.shared_files:
-            return None
-        for folder in self.shared_files["folders"]:
-            if folder["username"] == username:
-                if filepath.startswith(folder["folder_path"] + "/") or filepath == folder["folder_path"]:
-                    return folder
-        return None
+    @_reads
+    def get_approved_folder(self, folder_id):
+        found = self._by_id.get(folder_id)
+        return dict(found[1]) if found and found[0] == "folders" else None
 
-    def cleanup_missing_items(self):
-        changed = False
+    @_reads
+    def find_shares(self, bucket, username, path):
+        """Entries in bucket shared by username at exactly this path."""
+        return [dict(e) for e in self._by_path.get((bucket, username, path), [])]
 
-        approved = self.shared_files.get("approved", [])
-        cleaned_approved = []
-        for entry in approved:
-            user_dir = STORAGE_DIR / entry["username"]
-            file_path = user_dir / entry["filepath"]
-            if file_path.exists():
-                cleaned_approved.append(entry)
-            else:
-                changed = True
-                logger.info(f"Removed missing shared file: {entry['username']}/{entry['filepath']}")
-
-        if len(cleaned_approved) != len(approved):
-            self.shared_files["approved"] = cleaned_approved
-
-        folders = self.shared_files.get("folders", [])
-        cleaned_folders = []
-        for entry in folders:
-            user_dir = STORAGE_DIR / entry["username"]
-            folder_path = user_dir / entry["folder_path"]
-            if folder_path.exists() and folder_path.is_dir():
-                cleaned_folders.append(entry)
-            else:
-                changed = True
-                logger.info(f"Removed missing shared folder: {entry['username']}/{entry['folder_path']}")
+    @_reads
+    def find_shares_under(self, bucket, username, path):
+        """Entries in bucket shared by username at path or anywhere below it.
 
-        if len(cleaned_folders) != len(folders):
-            self.shared_files["folders"] = cleaned_folders
+        An empty path is the user's root, i.e. every entry of theirs.
+        """
+        node = self._tries.get((bucket, username))
+        for seg in path.split("/") if path else ():
+            if node is None:
+                return []
+            node = node.get(seg)
+        found, stack = [], [node] if node is not None else []
+        while stack:
+            node = stack.pop()
+            for key, value in node.items():
+                if key is None:
+                    found.extend(dict(e) for e in value)
+                else:
+                    stack.append(value)
+        return found
 
-        if changed:
-            self.save_shared_files()
+    @_reads
+    def is_file_shared(self, username, filepath):
+        return ("approved", username, filepath) in self._by_path
 
-        return changed
+    @_reads
+    def is_folder_shared(self, username, folder_path):
+        return ("folders", username, folder_path) in self._by_path
 
+    @_reads
+    def is_in_shared_folder(self, username, filepath):
+        return self._find_folder(username, filepath) is not None
 
-class UserManager:
-    def __init__(self, users_file):
-        self.users_file = users_file
+    @_reads
+    def get_shared_folder_for_path(self, username, filepath):
+        """Return the shared folder entry that contains the given filepath, or None."""
+        folder = self._find_folder(username, filepath)
+        return dict(folder) if folder else None
+
+    @_writes
+    def rename_user(self, old_username, new_username):
+        changed = []
+        for bucket in self.BUCKETS:
+            for entry in self.shared_files[bucket].values():
+                if entry["username"] == old_username:
+                    entry["username"] = new_username
+                    changed.append((bucket, entry))
+        self._rebuild_indexes()
+        self.save_shared_files(changed=changed)
+
+    def prune_missing(self, files=(), folders=()):
+        """Drop the given approved file/folder entries whose path is gone.
+
+        Paths are stat()ed without the lock; everything missing goes in one
+        write. Returns how many entries were removed.
+        """
+        missing_files = [e for e in files
+                         if not (STORAGE_DIR / e["username"] / e["filepath"]).exists()]
+        missing_folders = [e for e in folders
+                           if not (STORAGE_DIR / e["username"] / e["folder_path"]).is_dir()]
+        if not missing_files and not missing_folders:
+            return 0
+        for entry in missing_files:
+            logger.info(f"Removed missing shared file: {entry['username']}/{entry['filepath']}")
+        for entry in missing_folders:
+            logger.info(f"Removed missing shared folder: {entry['username']}/{entry['folder_path']}")
+
+        with self._writing():
+            removed = self._pop_entries("approved", [e["id"] for e in missing_files])
+            removed += self._pop_entries("folders", [e["id"] for e in missing_folders])
+            if removed:
+                self.save_shared_files(deleted=[e["id"] for e in removed])
+        return len(removed)
+
+    def prune_under(self, username, path):
+        """prune_missing() for the shares at or below one path (filesystem events)."""
+        return self.prune_missing(self.find_shares_under("approved", username, path),
+                                  self.find_shares_under("folders", username, path))
+
+
+class UserManager(SyncedManager):
+    DOCUMENT = "users"
+
+    def __init__(self, backend):
+        super().__init__(backend)
         self.load_users()
 
+    @_writes
     def load_users(self):
-        if self.users_file.exists():
-            try:
-                with open(self.users_file, 'r', encoding='utf-8') as f:
-                    self.users = json.load(f)
-            except (json.JSONDecodeError, UnicodeDecodeError):
-                backup = self.users_file.with_suffix('.json.backup')
-                self.users_file.rename(backup)
-                print(f"⚠️  Corrupted users.json backed up to {backup}")
-                self._create_default_user()
-        else:
+        self._reload()
+
+    def _reload(self):
+        self.users = self.backend.load_users()
+        if self.users is None:
             self._create_default_user()
 
     def _create_default_user(self):
@@ -366,145 +1147,1399 @@ class UserManager:
         }
         self.save_users()
 
-    def save_users(self):
-        with open(self.users_file, 'w', encoding='utf-8') as f:
-            json.dump(self.users, f, indent=2, ensure_ascii=False)
+    @_writes
+    def save_users(self, changed=None, deleted=()):
+        """Persist users; changed/deleted are lists of usernames (None = all)."""
+        self.backend.commit_users(self.users, changed, deleted, lock=self._lock)
 
     def register_user(self, username, password):
         if not validate_username(username):
             return False, "Invalid username format"
-        if username in self.users:
+        if self.user_exists(username):
             return False, "Username already exists"
         if len(password) < 6:
             return False, "Password must be at least 6 characters"
-
-        self.users[username] = {
-            "password_hash": bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode(),
-            "role": "user",
-            "status": "pending",
-            "created_at": datetime.now().isoformat(),
-            "storage_used": 0,
-            "trusted_uploader": False,
-            "auto_share": False
-        }
-        self.save_users()
+        # Hash before taking the lock — bcrypt is deliberately slow
+        password_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+
+        with self._writing():
+            if username in self.users:
+                return False, "Username already exists"
+            self.users[username] = {
+                "password_hash": password_hash,
+                "role": "user",
+                "status": "pending",
+                "created_at": datetime.now().isoformat(),
+                "storage_used": 0,
+                "trusted_uploader": False,
+                "auto_share": False
+            }
+            self.save_users([username])
         return True, "Registration submitted for approval"
 
     def approve_user(self, username):
-        if username not in self.users:
-            return False, "User not found"
-        self.users[username]["status"] = "approved"
-        self.save_users()
+        with self._writing():
+            if username not in self.users:
+                return False, "User not found"
+            self.users[username]["status"] = "approved"
+            self.save_users([username])
         (STORAGE_DIR / username).mkdir(exist_ok=True)
         return True, "User approved"
 
+    @_writes
     def reject_user(self, username):
         if username not in self.users or self.users[username]["status"] == "approved":
             return False, "Cannot reject"
         del self.users[username]
-        self.save_users()
+        self.save_users(changed=[], deleted=[username])
         return True, "User rejected"
 
-    def add_user(self, username, password, role="user"):
-        if not validate_username(username):
-            return False, "Invalid username format"
-        if username in self.users:
-            return False, "User exists"
-        if len(password) < 6:
-            return False, "Password must be at least 6 characters"
+    def add_user(self, username, password, role="user"):
+        if not validate_username(username):
+            return False, "Invalid username format"
+        if self.user_exists(username):
+            return False, "User exists"
+        if len(password) < 6:
+            return False, "Password must be at least 6 characters"
+        password_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+
+        with self._writing():
+            if username in self.users:
+                return False, "User exists"
+            self.users[username] = {
+                "password_hash": password_hash,
+                "role": role,
+                "status": "approved",
+                "created_at": datetime.now().isoformat(),
+                "storage_used": 0,
+                "trusted_uploader": role == "admin",
+                "auto_share": False
+            }
+            self.save_users([username])
+        (STORAGE_DIR / username).mkdir(exist_ok=True)
+        return True, "User created"
+
+    def delete_user(self, username):
+        with self._writing():
+            if username == "admin" or username not in self.users:
+                return False, "Cannot delete"
+            del self.users[username]
+            self.save_users(changed=[], deleted=[username])
+        user_dir = STORAGE_DIR / username
+        if user_dir.exists():
+            shutil.rmtree(user_dir)
+        return True, "User deleted"
+
+    def authenticate(self, username, password):
+        with self._reading():
+            user = self.users.get(username)
+            if not user or user["status"] != "approved":
+                return False
+            password_hash = user["password_hash"]
+        return bcrypt.checkpw(password.encode(), password_hash.encode())
+
+    def set_password(self, username, password):
+        password_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+        with self._writing():
+            if username not in self.users:
+                return False
+            self.users[username]["password_hash"] = password_hash
+            self.save_users([username])
+        return True
+
+    @_writes
+    def rename_user(self, old_username, new_username):
+        if new_username in self.users:
+            return False, "Username already exists"
+        if old_username not in self.users:
+            return False, "User not found"
+        self.users[new_username] = self.users.pop(old_username)
+        self.save_users([new_username], deleted=[old_username])
+        return True, "Username changed"
+
+    @_reads
+    def get_user(self, username):
+        """Return a copy of the user's record (None if unknown)."""
+        return copy.deepcopy(self.users.get(username))
+
+    @_reads
+    def user_exists(self, username):
+        return username in self.users
+
+    @_reads
+    def list_users(self, status=None):
+        return [
+            {
+                "username": u,
+                "role": d["role"],
+                "status": d["status"],
+                "created_at": d["created_at"],
+                "storage_used": d["storage_used"],
+                "trusted_uploader": d.get("trusted_uploader", False),
+                "auto_share": d.get("auto_share", False)
+            }
+            for u, d in self.users.items()
+            if status is None or d["status"] == status
+        ]
+
+    @_writes
+    def adjust_storage_used(self, username, delta):
+        """Apply the byte delta of an upload, write or delete — O(1), no tree walk."""
+        if not delta or username not in self.users:
+            return
+        user = self.users[username]
+        user["storage_used"] = max(0, user.get("storage_used", 0) + delta)
+        self.save_users([username])
+
+    def update_storage_used(self, username):
+        """Recompute storage_used from disk; used by the reconciliation pass.
+
+        The walk runs unlocked, so if a delta lands meanwhile the result is
+        discarded and left to the next pass. Returns the drift corrected.
+        """
+        with self._reading():
+            if username not in self.users:
+                return 0
+            before = self.users[username].get("storage_used", 0)
+        total = directory_size(STORAGE_DIR / username)
+        with self._writing():
+            user = self.users.get(username)
+            if user is None or user.get("storage_used", 0) != before or total == before:
+                return 0
+            user["storage_used"] = total
+            self.save_users([username])
+        return total - before
+
+    @_writes
+    def set_trusted_uploader(self, username, value: bool):
+        if username not in self.users:
+            return False, "User not found"
+        self.users[username]["trusted_uploader"] = value
+        self.save_users([username])
+        return True, "Updated"
+
+    @_writes
+    def set_auto_share(self, username, value: bool):
+        if username not in self.users:
+            return False, "User not found"
+        self.users[username]["auto_share"] = value
+        self.save_users([username])
+        return True, "Updated"
+
+    # ── Per-user lists (pinned folders, favorites) ───────────────
+
+    @_writes
+    def add_path_item(self, username, field, path, name):
+        """Append {"path", "name"} to a user's list field unless the path is there.
+
+        Returns (added, items), or None if the user doesn't exist (any more).
+        """
+        if username not in self.users:
+            return None
+        items = self.users[username].setdefault(field, [])
+        if any(p["path"] == path for p in items):
+            return False, copy.deepcopy(items)
+        items.append({"path": path, "name": name})
+        self.save_users([username])
+        return True, copy.deepcopy(items)
+
+    @_writes
+    def remove_path_item(self, username, field, path):
+        """Drop entries with this path from a user's list field; returns the new list.
+
+        None if the user doesn't exist (any more).
+        """
+        if username not in self.users:
+            return None
+        items = [p for p in self.users[username].get(field, []) if p["path"] != path]
+        self.users[username][field] = items
+        self.save_users([username])
+        return copy.deepcopy(items)
+
+    # ── Music preferences ────────────────────────────────────────
+
+    @_writes
+    def save_music_prefs(self, username, playlists=None, favorites=None):
+        if username not in self.users:
+            return False
+        if playlists is not None:
+            self.users[username]["music_playlists"] = playlists
+        if favorites is not None:
+            self.users[username]["music_favorites"] = favorites
+        self.save_users([username])
+        return True
+
+    @_writes
+    def upsert_music_playlist(self, username, name, tracks):
+        """Create the named playlist, or replace its tracks if it exists; returns it.
+
+        None if the user doesn't exist (any more).
+        """
+        if username not in self.users:
+            return None
+        playlists = self.users[username].setdefault("music_playlists", [])
+        playlist = next((p for p in playlists if p["name"] == name), None)
+        if playlist:
+            playlist["tracks"] = tracks
+        else:
+            playlist = {"id": secrets.token_urlsafe(6), "name": name, "tracks": tracks}
+            playlists.append(playlist)
+        self.save_users([username])
+        return dict(playlist)
+
+    @_reads
+    def music_like_counts(self):
+        counts = Counter()
+        for udata in self.users.values():
+            for f in udata.get("music_favorites", []):
+                counts[f] += 1
+        return counts
+
+
+app = Flask(__name__, static_folder='static')
+app.config.update(
+    JWT_SECRET_KEY=JWT_SECRET,
+    JWT_ACCESS_TOKEN_EXPIRES=timedelta(hours=8),
+    JWT_TOKEN_LOCATION=["headers", "query_string"],
+    JWT_QUERY_STRING_NAME="token",
+    MAX_CONTENT_LENGTH=2 * 1024 * 1024 * 1024,  # 2 GB
+)
+CORS(app)
+jwt = JWTManager(app)
+if SHARED_STATE and not FCNTL_AVAILABLE:
+    print("⚠️  fcntl not available - NAS_SHARED_STATE cannot lock across processes; run a single worker")
+storage_backend = create_storage_backend()
+user_manager = UserManager(storage_backend)
+shared_manager = SharedFilesManager(storage_backend)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler(LOG_DIR / 'nas.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+# ==================== STORAGE ACCOUNTING ====================
+
+def reconcile_storage_used():
+    """Re-walk every approved user's directory and fix storage_used drift."""
+    for user in user_manager.list_users("approved"):
+        try:
+            drift = user_manager.update_storage_used(user["username"])
+            # Also catches in-place overwrites made outside the app, which mtimes miss
+            dir_stats.forget(user["username"])
+            if drift:
+                logger.info(f"Storage reconciled for {user['username']}: {drift:+d} bytes")
+        except Exception as e:
+            logger.error(f"Storage reconcile error for {user['username']}: {e}")
+
+
+_storage_reconcile_stop = threading.Event()
+
+
+def _storage_reconcile_loop():
+    while not _storage_reconcile_stop.wait(STORAGE_RECONCILE_INTERVAL):
+        reconcile_storage_used()
+        if dedup_store is not None:
+            try:
+                dedup_store.collect()
+                dedup_store.usage()
+            except Exception as e:
+                logger.error(f"Dedup store pass error: {e}")
+
+
+if STORAGE_RECONCILE_INTERVAL > 0:
+    threading.Thread(target=_storage_reconcile_loop, daemon=True).start()
+
+
+class DirStatsCache:
+    """Per-user file count / byte / type aggregates, kept per directory.
+
+    Each cached directory holds only its direct files plus its child folder
+    names; subtree totals are rebuilt from those on refresh. Write paths call
+    invalidate() for the folders they touched (an in-place overwrite does not
+    move the folder's mtime), and a refresh re-stats every cached folder but
+    rescans only the dirty ones and those whose mtime moved, so changes made
+    outside the app are picked up too. Between refreshes stats() is a lookup.
+    """
+
+    def __init__(self, root, revalidate_interval):
+        self.root = root
+        self.revalidate_interval = revalidate_interval
+        self._lock = threading.Lock()
+        self._trees = {}
+
+    @staticmethod
+    def _folder(path):
+        folder = str(path).replace("\\", "/").strip("/")
+        return "" if folder == "." else folder
+
+    def _tree(self, username):
+        with self._lock:
+            tree = self._trees.get(username)
+            if tree is None:
+                tree = self._trees[username] = {
+                    "lock": threading.Lock(), "dirs": {}, "dirty": set(),
+                    "generation": 0, "summary": None, "summary_generation": -1, "checked": 0,
+                }
+            return tree
+
+    def invalidate(self, username, *folders):
+        """Mark folders (relative to the user's root) as changed."""
+        tree = self._tree(username)
+        with self._lock:
+            tree["dirty"].update(self._folder(f) for f in folders or ("",))
+            tree["generation"] += 1
+
+    def forget(self, username):
+        with self._lock:
+            self._trees.pop(username, None)
+
+    def generation(self, username):
+        """Counter bumped by every invalidate() for this user (for ETags)."""
+        return self._tree(username)["generation"]
+
+    @staticmethod
+    def _scan(path):
+        # mtime is taken before listing, so a change during the scan shows next time
+        entry = {"mtime": os.stat(path).st_mtime_ns, "files": 0, "bytes": 0, "types": {}, "children": []}
+        with os.scandir(path) as entries:
+            for e in entries:
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        entry["children"].append(e.name)
+                    elif e.is_file(follow_symlinks=False):
+                        size = e.stat(follow_symlinks=False).st_size
+                        entry["files"] += 1
+                        entry["bytes"] += size
+                        counts = entry["types"].setdefault(get_file_type(e.name), [0, 0])
+                        counts[0] += 1
+                        counts[1] += size
+                except OSError:
+                    continue
+        return entry
+
+    def _refresh(self, username, tree):
+        with self._lock:
+            dirty, tree["dirty"] = tree["dirty"], set()
+            generation = tree["generation"]
+        user_dir = self.root / username
+        cached, dirs = tree["dirs"], {}
+        stack = [""]
+        while stack:
+            rel = stack.pop()
+            path = user_dir / rel if rel else user_dir
+            entry = cached.get(rel)
+            try:
+                if entry is None or rel in dirty or os.stat(path).st_mtime_ns != entry["mtime"]:
+                    entry = self._scan(path)
+            except OSError:
+                continue
+            dirs[rel] = entry
+            stack.extend(f"{rel}/{c}" if rel else c for c in entry["children"])
+
+        # Subtree totals, deepest folders first
+        folders = {}
+        by_type = {}
+        for rel in sorted(dirs, key=lambda r: r.count("/") + 1 if r else 0, reverse=True):
+            entry = dirs[rel]
+            node = {"files": entry["files"], "bytes": entry["bytes"],
+                    "own_files": entry["files"], "own_bytes": entry["bytes"],
+                    "children": [c for c in entry["children"] if (f"{rel}/{c}" if rel else c) in dirs]}
+            for c in node["children"]:
+                child = folders[f"{rel}/{c}" if rel else c]
+                node["files"] += child["files"]
+                node["bytes"] += child["bytes"]
+            folders[rel] = node
+            for file_type, (count, size) in entry["types"].items():
+                totals = by_type.setdefault(file_type, {"files": 0, "bytes": 0})
+                totals["files"] += count
+                totals["bytes"] += size
+
+        root = folders.get("", {"files": 0, "bytes": 0})
+        tree["dirs"] = dirs
+        tree["summary"] = {"files": root["files"], "bytes": root["bytes"],
+                           "by_type": by_type, "folders": folders}
+        tree["summary_generation"] = generation
+        tree["checked"] = time.monotonic()
+
+    def stats(self, username):
+        """Summary dict: files, bytes, by_type, folders (rel path -> subtree totals).
+
+        The returned dict is replaced, never mutated, so callers may read it freely.
+        """
+        tree = self._tree(username)
+        with tree["lock"]:
+            if (tree["summary_generation"] != tree["generation"]
+                    or time.monotonic() - tree["checked"] > self.revalidate_interval):
+                self._refresh(username, tree)
+            return tree["summary"]
+
+
+dir_stats = DirStatsCache(STORAGE_DIR, STATS_REVALIDATE_INTERVAL)
+
+
+# ==================== CONTENT DIGESTS ====================
+# A file's digest is BLAKE2b-256 over the BLAKE2b-256 digests of its 1 MiB
+# blocks, in order ("b2-1m"). Blocks hash independently, so the chunks of a
+# parallel upload each contribute their blocks' digests as they stream to
+# disk and the file digest is combined at the end without re-reading it.
+# A chunk's digest is the same construction over the chunk's own bytes.
+
+HASH_BLOCK_SIZE = 1024 * 1024
+DIGEST_SIZE = 32
+DIGEST_ALGORITHM = "b2-1m"
+
+
+def combine_digests(block_digests):
+    """Digest of a file (or chunk) from its blocks' raw digests, in order."""
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE, person=b"nas-b2-1m")
+    for d in block_digests:
+        h.update(d)
+    return h.hexdigest()
+
+
+class ContentHasher:
+    """Incremental b2-1m digest; update() with the bytes in order, any slicing."""
+
+    def __init__(self):
+        self.blocks = []
+        self.size = 0
+        self._block = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        self._filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        self.size += len(view)
+        while view:
+            take = min(len(view), HASH_BLOCK_SIZE - self._filled)
+            self._block.update(view[:take])
+            self._filled += take
+            view = view[take:]
+            if self._filled == HASH_BLOCK_SIZE:
+                self.blocks.append(self._block.digest())
+                self._block = hashlib.blake2b(digest_size=DIGEST_SIZE)
+                self._filled = 0
+
+    def block_digests(self):
+        """Raw digests of every block so far, including a trailing partial one."""
+        return self.blocks + [self._block.digest()] if self._filled else list(self.blocks)
+
+    def hexdigest(self):
+        return combine_digests(self.block_digests())
+
+
+def hash_file(path):
+    hasher = ContentHasher()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class FileIndex:
+    """Content digests of stored files, keyed by owner and path (SQLite).
+
+    Each row remembers the size and mtime its digest was computed for and
+    is ignored once the file no longer matches, so writes never have to
+    invalidate it; stale rows are just overwritten or left for forget().
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            username TEXT NOT NULL,
+            path     TEXT NOT NULL,
+            size     INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            digest   TEXT NOT NULL,
+            PRIMARY KEY (username, path)
+        );
+        CREATE INDEX IF NOT EXISTS files_digest ON files (digest);
+    """
+
+    def __init__(self, db_file, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript(self.SCHEMA)
+
+    def record(self, username, rel, digest, st=None):
+        st = st or os.stat(self.root / username / rel)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (username, path, size, mtime_ns, digest) VALUES (?, ?, ?, ?, ?)",
+                (username, rel, st.st_size, st.st_mtime_ns, digest)
+            )
+
+    def _fresh(self, username, rel, size, mtime_ns):
+        try:
+            st = os.stat(self.root / username / rel)
+        except OSError:
+            return False
+        return (st.st_size, st.st_mtime_ns) == (size, mtime_ns)
+
+    def lookup(self, username, rel):
+        """Recorded digest of the file as it is now, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime_ns, digest FROM files WHERE username = ? AND path = ?",
+                                     (username, rel)).fetchone()
+        if row and self._fresh(username, rel, row[0], row[1]):
+            return row[2]
+        return None
+
+    def digest(self, username, rel):
+        """Digest of a stored file, hashing (and recording) it if the index has none."""
+        digest = self.lookup(username, rel)
+        if digest is None:
+            path = self.root / username / rel
+            st = os.stat(path)
+            digest = hash_file(path)
+            self.record(username, rel, digest, st)
+        return digest
+
+    def find(self, digest):
+        """(username, rel) of every stored file currently known to have this digest."""
+        with self._lock:
+            rows = self._conn.execute("SELECT username, path, size, mtime_ns FROM files WHERE digest = ?",
+                                      (digest,)).fetchall()
+        return [(u, p) for u, p, size, mtime_ns in rows if self._fresh(u, p, size, mtime_ns)]
+
+    def forget(self, username, rel=None):
+        """Drop rows for a user, or for one path (and everything under it)."""
+        with self._lock, self._conn:
+            if rel is None:
+                self._conn.execute("DELETE FROM files WHERE username = ?", (username,))
+            else:
+                self._conn.execute("DELETE FROM files WHERE username = ? AND (path = ? OR path LIKE ? ESCAPE '\\')",
+                                   (username, rel, rel.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "/%"))
+
+    def rename_user(self, old_username, new_username):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE files SET username = ? WHERE username = ?", (new_username, old_username))
+
+    def metrics(self):
+        with self._lock:
+            return {"indexed_files": self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]}
+
+
+file_index = FileIndex(FILE_INDEX_FILE, STORAGE_DIR)
+
+
+# ==================== DEDUP STORE ====================
+
+DEDUP_MIN_SIZE = 4096  # smaller files aren't worth an extra inode
+FICLONE = 0x40049409   # linux/fs.h: _IOW(0x94, 9, int)
+
+
+def reflink(src, dst):
+    """Create dst as a copy-on-write clone of src; OSError where unsupported."""
+    if not FCNTL_AVAILABLE:
+        raise OSError(errno.EOPNOTSUPP, "reflink needs fcntl")
+    with open(src, "rb") as s, open(dst, "xb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+class DedupStore:
+    """Hash-keyed blob store that identical stored files share storage with.
+
+    blob_store/ab/cd/<b2-1m digest> holds one copy of each content. A newly
+    written file whose digest already has a blob is replaced by a hard link
+    to (or reflink clone of) that blob; otherwise the file becomes the blob.
+    Users keep their own paths and quotas count logical bytes. Blobs no
+    user file references any more are removed by collect().
+    """
+
+    def __init__(self, root, mode):
+        self.root = root
+        self.mode = mode
+        self.saved = 0          # bytes not written thanks to an existing blob
+        self.usage_cache = None
+        self._warned = False
+
+    def blob_path(self, digest):
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def _clone(self, src, dst):
+        if self.mode == "reflink":
+            reflink(src, dst)
+        else:
+            os.link(src, dst)
+
+    def adopt(self, path, digest):
+        """Make the file at `path` share storage with its content's blob.
+
+        Returns True when an existing blob was reused (the file's own bytes
+        are freed), False when the file became the blob or was left alone.
+        """
+        try:
+            st = os.stat(path)
+            if st.st_size < DEDUP_MIN_SIZE:
+                return False
+            blob = self.blob_path(digest)
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                self._clone(path, blob)
+                return False
+            except FileExistsError:
+                pass
+            blob_st = os.stat(blob)
+            if (blob_st.st_dev, blob_st.st_ino) == (st.st_dev, st.st_ino):
+                return False
+            if blob_st.st_size != st.st_size:
+                logger.warning(f"Blob {digest} has the wrong size, not deduplicating {path}")
+                return False
+            tmp = path.with_name(f".{path.name}.dedup-{secrets.token_hex(4)}")
+            self._clone(blob, tmp)
+            os.replace(tmp, path)
+            self.saved += st.st_size
+            return True
+        except OSError as e:
+            # Typically EXDEV (blob_store on another filesystem) or no reflink support
+            if not self._warned:
+                self._warned = True
+                logger.warning(f"Dedup ({self.mode}) unavailable for {path}: {e}")
+            return False
+
+    def materialize(self, digest, dst):
+        """Create dst from the blob for digest; False if there is none (or it fails)."""
+        blob = self.blob_path(digest)
+        try:
+            self._clone(blob, dst)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                raise
+            return False
+        self.saved += os.stat(dst).st_size
+        return True
+
+    def _referenced(self, digest, st):
+        if self.mode == "hardlink":
+            return st.st_nlink > 1
+        return bool(file_index.find(digest))
+
+    def collect(self):
+        """Delete blobs no stored file uses any more; returns how many."""
+        removed = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                blob = os.path.join(dirpath, name)
+                try:
+                    if not self._referenced(name, os.stat(blob)):
+                        os.remove(blob)
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
+
+    def usage(self):
+        """Logical vs physical bytes under nas_storage (plus blobs), by a full walk.
+
+        Physical counts each inode once; with reflinks, files whose indexed
+        digest has a blob count once per digest, since they share extents.
+        """
+        logical, seen, physical = 0, set(), 0
+        blobs, blob_bytes = 0, 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                try:
+                    st = os.stat(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+                blobs += 1
+                blob_bytes += st.st_size
+                seen.add(name if self.mode == "reflink" else (st.st_dev, st.st_ino))
+                physical += st.st_size
+        for user_dir in STORAGE_DIR.iterdir():
+            if not user_dir.is_dir():
+                continue
+            for dirpath, _, filenames in os.walk(user_dir):
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    logical += st.st_size
+                    key = (st.st_dev, st.st_ino)
+                    if self.mode == "reflink" and st.st_size >= DEDUP_MIN_SIZE:
+                        digest = file_index.lookup(user_dir.name, os.path.relpath(path, user_dir))
+                        if digest and digest in seen:
+                            key = digest
+                    if key not in seen:
+                        seen.add(key)
+                        physical += st.st_size
+        self.usage_cache = {
+            "mode": self.mode, "blobs": blobs, "blob_bytes": blob_bytes,
+            "logical_bytes": logical, "physical_bytes": physical,
+            "saved_bytes": max(0, logical - physical),
+            "computed": datetime.now().isoformat(),
+        }
+        return self.usage_cache
+
+
+dedup_store = DedupStore(BLOB_DIR, DEDUP_MODE) if DEDUP_MODE in ("hardlink", "reflink") else None
+if DEDUP_MODE not in ("off", "hardlink", "reflink"):
+    print(f"⚠️  Unknown NAS_DEDUP={DEDUP_MODE!r} (expected off, hardlink or reflink) - dedup disabled")
+
+
+def record_stored_file(username, rel, digest):
+    """Index a newly stored file's digest, deduplicating it first when enabled."""
+    if dedup_store is not None:
+        dedup_store.adopt(STORAGE_DIR / username / rel, digest)
+    file_index.record(username, rel, digest)
+
+
+# ==================== BACKGROUND JOBS ====================
+# Bulk delete/move/copy and folder deletes run on a small worker pool instead
+# of inside the request; the client polls /api/jobs/<id> like the yt-dlp
+# downloads' status routes.
+
+class JobCancelled(Exception):
+    """Raised by JobQueue.advance() once a job has been asked to stop."""
+
+
+class JobQueue:
+    """Bounded pool of daemon threads running long file operations.
+
+    A job is a status dict like _dl_status's entries (status, progress
+    counters, errors, result). Records are written to SQLite, throttled
+    while a job runs, so they survive restarts and any worker process can
+    answer a poll or take a cancel. Jobs a dead process left queued or
+    running are marked "interrupted"; they are not resumed.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id      TEXT PRIMARY KEY,
+            owner   TEXT NOT NULL,
+            status  TEXT NOT NULL,
+            pid     INTEGER NOT NULL,
+            cancel  INTEGER NOT NULL DEFAULT 0,
+            created REAL NOT NULL,
+            record  TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created);
+    """
+    ACTIVE = ("queued", "running")
+    FLUSH_INTERVAL = 0.5     # seconds between progress writes (and cancel checks)
+    KEEP = 7 * 86400         # finished records are dropped after a week
+    LIST_LIMIT = 50
+
+    def __init__(self, db_file, workers):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._queue = queue.Queue()
+        self._threads = []
+        self._jobs = {}          # id -> record, for jobs this process runs
+        self._cancelled = set()
+        self._flushed = {}
+        with self._conn:
+            self._conn.executescript(self.SCHEMA)
+        self._interrupt_orphans()
+
+    @staticmethod
+    def _alive(pid):
+        if pid == os.getpid():
+            return True
+        if not SHARED_STATE:
+            return False
+        try:
+            os.kill(pid, 0)
+            return True
+        except ProcessLookupError:
+            return False
+        except OSError:
+            return True
+
+    def _interrupt_orphans(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT id, pid, record FROM jobs WHERE status IN (?, ?)",
+                                      self.ACTIVE).fetchall()
+        for job_id, pid, record in rows:
+            if self._alive(pid):
+                continue
+            job = json.loads(record)
+            job.update({"status": "interrupted", "error": "Server restarted", "finished": time.time()})
+            self._save(job, pid)
+
+    def _save(self, job, pid=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, owner, status, pid, created, record) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET status = excluded.status, record = excluded.record",
+                (job["id"], job["owner"], job["status"], pid or os.getpid(), job["created"], json.dumps(job))
+            )
+        self._flushed[job["id"]] = time.monotonic()
+
+    def _start_workers(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                t = threading.Thread(target=self._work, daemon=True, name=f"job-worker-{len(self._threads)}")
+                self._threads.append(t)
+                t.start()
+
+    def submit(self, owner, kind, fn, total=0, total_bytes=0, **info):
+        """Queue fn(job) and return the job's record.
+
+        fn reports progress with advance(job, ...) and returns the job's
+        result (a JSON-able dict, ideally with a "msg").
+        """
+        job = {"id": secrets.token_urlsafe(8), "owner": owner, "kind": kind, "status": "queued",
+               "total": total, "done": 0, "total_bytes": total_bytes, "done_bytes": 0,
+               "errors": [], "result": None, "error": None,
+               "created": time.time(), "started": None, "finished": None, **info}
+        self._jobs[job["id"]] = job
+        self._save(job)
+        self._start_workers()
+        self._queue.put((job, fn))
+        self.prune()
+        return job
+
+    def _work(self):
+        while True:
+            job, fn = self._queue.get()
+            try:
+                if self._cancel_requested(job["id"]):
+                    raise JobCancelled()
+                job.update({"status": "running", "started": time.time()})
+                self._save(job)
+                job["result"] = fn(job)
+                job["status"] = "done"
+            except JobCancelled:
+                job["status"] = "cancelled"
+            except Exception as e:
+                logger.error(f"Job {job['id']} ({job['kind']}) failed: {e}")
+                job.update({"status": "error", "error": str(e)})
+            job["finished"] = time.time()
+            self._save(job)
+            self._jobs.pop(job["id"], None)
+            self._cancelled.discard(job["id"])
+            self._flushed.pop(job["id"], None)
+
+    def _cancel_requested(self, job_id):
+        if job_id in self._cancelled:
+            return True
+        with self._lock:
+            row = self._conn.execute("SELECT cancel FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def advance(self, job, done=0, done_bytes=0):
+        """Add to a job's progress; raises JobCancelled if it should stop."""
+        job["done"] += done
+        job["done_bytes"] += done_bytes
+        if job["id"] in self._cancelled:
+            raise JobCancelled()
+        if time.monotonic() - self._flushed.get(job["id"], 0) >= self.FLUSH_INTERVAL:
+            self._save(job)
+            if self._cancel_requested(job["id"]):
+                raise JobCancelled()
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        with self._lock:
+            row = self._conn.execute("SELECT record FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list(self, owner):
+        """The owner's most recent jobs, newest first."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, record FROM jobs WHERE owner = ? ORDER BY created DESC LIMIT ?",
+                                      (owner, self.LIST_LIMIT)).fetchall()
+        return [self._jobs.get(job_id) or json.loads(record) for job_id, record in rows]
+
+    def cancel(self, job_id):
+        """Ask a queued or running job to stop; False if it already finished."""
+        job = self.get(job_id)
+        if job is None or job["status"] not in self.ACTIVE:
+            return False
+        self._cancelled.add(job_id)
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET cancel = 1 WHERE id = ?", (job_id,))
+        return True
+
+    def prune(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE status NOT IN (?, ?) AND created < ?",
+                               (*self.ACTIVE, time.time() - self.KEEP))
+
+    def metrics(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {"workers": self.workers, "queued_here": self._queue.qsize(), "by_status": dict(rows)}
+
+
+jobs = JobQueue(JOBS_FILE, JOB_WORKERS)
+
+
+# ==================== ARCHIVES ====================
+# Folders and multi-selections download as a zip or tar produced while it
+# is sent: files are read a block at a time and the archive bytes yielded
+# as soon as they exist, so nothing is held whole in memory or spooled.
+
+ARCHIVE_FORMATS = {"zip": "application/zip", "tar": "application/x-tar"}
+ARCHIVE_BLOCK_SIZE = 256 * 1024
+# Already-compressed formats gain nothing from deflate; zip stores them as-is
+STORED_EXTENSIONS = {
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'avif',
+    'mp4', 'webm', 'mov', 'mkv', 'avi', 'm4v',
+    'mp3', 'm4a', 'aac', 'ogg', 'opus', 'flac', 'wma',
+    'zip', 'gz', 'tgz', 'bz2', 'xz', '7z', 'rar', 'zst',
+    'docx', 'xlsx', 'pptx', 'pdf', 'epub',
+}
+
+
+class _ArchiveSink:
+    """Write-only, unseekable file object that zipfile writes into and the generator drains."""
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def archive_members(items):
+    """(path, arcname, is_dir) for each (path, arcname) item and everything under it.
+
+    Symlinks are skipped, so an archive never reaches outside the tree it was asked for.
+    """
+    for path, arcname in items:
+        if path.is_symlink():
+            continue
+        if not path.is_dir():
+            yield path, arcname, False
+            continue
+        yield path, arcname, True
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(d for d in dirnames if not os.path.islink(os.path.join(dirpath, d)))
+            rel = os.path.relpath(dirpath, path)
+            prefix = arcname if rel == "." else f"{arcname}/{rel.replace(os.sep, '/')}"
+            for name in dirnames:
+                yield Path(dirpath, name), f"{prefix}/{name}", True
+            for name in sorted(filenames):
+                full = os.path.join(dirpath, name)
+                if not os.path.islink(full):
+                    yield Path(full), f"{prefix}/{name}", False
+
+
+def stream_zip(members):
+    """Yield a zip of members; entries use data descriptors since the output can't seek."""
+    sink = _ArchiveSink()
+    with zipfile.ZipFile(sink, "w", allowZip64=True) as zf:
+        for path, arcname, is_dir in members:
+            try:
+                info = zipfile.ZipInfo.from_file(path, arcname, strict_timestamps=False)
+                src = None if is_dir else open(path, "rb")
+            except OSError as e:
+                logger.warning(f"Archive: skipping {path}: {e}")
+                continue
+            if src is None:
+                zf.writestr(info, b"")
+            else:
+                ext = arcname.rsplit('.', 1)[-1].lower() if '.' in arcname else ''
+                info.compress_type = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                with src, zf.open(info, "w") as dst:
+                    for block in iter(lambda: src.read(ARCHIVE_BLOCK_SIZE), b""):
+                        dst.write(block)
+                        yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+
+
+def stream_tar(members):
+    """Yield a POSIX (pax) tar of members, header and data blocks written directly."""
+    written = 0
+    for path, arcname, is_dir in members:
+        try:
+            st = os.stat(path)
+            src = None if is_dir else open(path, "rb")
+        except OSError as e:
+            logger.warning(f"Archive: skipping {path}: {e}")
+            continue
+        info = tarfile.TarInfo(arcname)
+        info.mtime = int(st.st_mtime)
+        info.mode = st.st_mode & 0o7777
+        if src is None:
+            info.type = tarfile.DIRTYPE
+        else:
+            info.size = st.st_size
+        header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+        written += len(header)
+        yield header
+        if src is None:
+            continue
+        with src:
+            remaining = info.size
+            while remaining:
+                # The header already promised info.size bytes: pad a file that shrank meanwhile
+                block = src.read(min(ARCHIVE_BLOCK_SIZE, remaining)) or bytes(min(ARCHIVE_BLOCK_SIZE, remaining))
+                remaining -= len(block)
+                yield block
+        padding = -info.size % tarfile.BLOCKSIZE
+        written += info.size + padding
+        yield bytes(padding)
+    end = 2 * tarfile.BLOCKSIZE
+    yield bytes(end + -(written + end) % tarfile.RECORDSIZE)
+
+
+# ── Extraction ───────────────────────────────────────────────────
+# An uploaded zip or tar is unpacked into a folder by a background job.
+# Member names go through sanitize_relative_path (no "..", no absolute
+# paths) and allowed_file; only regular files and folders are created
+# (symlinks, hard links and devices are skipped). Bytes written are
+# counted as they land, so sizes an archive lies about don't help a bomb.
+
+class ArchiveError(ValueError):
+    """The archive is unreadable or breaks an extraction limit."""
+
+
+def archive_entries(archive_path):
+    """(name, is_dir, mtime, declared size, open()) for each file/folder in a zip or tar.
+
+    A zip is read through its central directory; a tar (optionally gz/bz2/xz)
+    is read as a stream, one member at a time.
+    """
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as zf:
+            infos = zf.infolist()
+            if len(infos) > EXTRACT_MAX_FILES:
+                raise ArchiveError(f"Archive has more than {EXTRACT_MAX_FILES} entries")
+            for info in infos:
+                kind = (info.external_attr >> 16) & 0o170000
+                if kind not in (0, 0o100000, 0o040000):
+                    continue   # symlink or special file
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                yield info.filename, info.is_dir(), mtime, info.file_size, functools.partial(zf.open, info)
+        return
+    try:
+        tf = tarfile.open(archive_path, "r|*")
+    except tarfile.TarError:
+        raise ArchiveError("Not a zip or tar archive")
+    with tf:
+        for member in tf:
+            if member.isdir():
+                yield member.name, True, member.mtime, 0, None
+            elif member.isreg():
+                yield member.name, False, member.mtime, member.size, functools.partial(tf.extractfile, member)
+
+
+def is_archive(path):
+    """Whether path looks like a zip or a (possibly compressed) tar."""
+    if zipfile.is_zipfile(path):
+        return True
+    try:
+        with tarfile.open(path, "r|*") as tf:
+            return tf.next() is not None
+    except (tarfile.TarError, OSError, EOFError, zlib.error):
+        return False
+
+
+def extract_archive(username, archive_path, folder_path, job):
+    """Unpack archive_path into folder_path of the user's home as a job.
+
+    Files already there are kept: extracted ones get name_N.ext. Refused
+    names and failed members are listed in job["errors"].
+    """
+    user_dir = STORAGE_DIR / username
+    base_dir = user_dir / folder_path if folder_path else user_dir
+    user = user_manager.get_user(username) or {}
+    shared_folder_entry = shared_manager.get_shared_folder_for_path(username, folder_path) if folder_path else None
+    archive_size = os.path.getsize(archive_path)
+    byte_limit = min(EXTRACT_MAX_BYTES, max(archive_size, 1024 * 1024) * EXTRACT_MAX_RATIO)
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as zf:
+            job["total"] = sum(not i.is_dir() for i in zf.infolist())
+            job["total_bytes"] = sum(i.file_size for i in zf.infolist())
+        if job["total_bytes"] > byte_limit:
+            raise ArchiveError("Archive expands beyond the extraction limit")
+        if job["total_bytes"] > shutil.disk_usage(STORAGE_DIR).free:
+            raise ArchiveError("Not enough free space to extract this archive")
+
+    extracted, to_share, written, entries = [], [], 0, 0
+    try:
+        for name, is_dir, mtime, size, open_member in archive_entries(archive_path):
+            entries += 1
+            if entries > EXTRACT_MAX_FILES:
+                raise ArchiveError(f"Archive has more than {EXTRACT_MAX_FILES} entries")
+            rel_path = sanitize_relative_path(name)
+            if not rel_path:
+                continue
+            target_path = base_dir / rel_path
+            try:
+                target_path.resolve().relative_to(base_dir.resolve())
+            except ValueError:
+                job["errors"].append(f"{name}: Outside the target folder")
+                continue
+            if is_dir:
+                target_path.mkdir(parents=True, exist_ok=True)
+                continue
+            if not allowed_file(rel_path):
+                job["errors"].append(f"{name}: File type not allowed")
+                jobs.advance(job, 1)
+                continue
+
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            if target_path.exists():
+                stem, ext = os.path.splitext(target_path.name)
+                counter = 1
+                while target_path.exists():
+                    target_path = target_path.parent / f"{stem}_{counter}{ext}"
+                    counter += 1
+
+            hasher = ContentHasher() if UPLOAD_DIGESTS else None
+            try:
+                with open_member() as src, open(target_path, "xb") as dst:
+                    for block in iter(lambda: src.read(COPY_BUFFER_SIZE), b""):
+                        written += len(block)
+                        if written > byte_limit:
+                            raise ArchiveError("Archive expands beyond the extraction limit")
+                        dst.write(block)
+                        if hasher is not None:
+                            hasher.update(block)
+                        jobs.advance(job, 0, len(block))
+            except (ArchiveError, JobCancelled):
+                target_path.unlink(missing_ok=True)
+                raise
+            except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError, zlib.error) as e:
+                target_path.unlink(missing_ok=True)
+                logger.error(f"Extract error for {username}/{rel_path}: {e}")
+                job["errors"].append(f"{name}: {e}")
+                if isinstance(e, tarfile.TarError):
+                    break   # a broken tar stream can't be resynchronised
+                jobs.advance(job, 1)
+                continue
+
+            try:
+                os.utime(target_path, (mtime, mtime))
+            except (OSError, OverflowError, ValueError):
+                pass
+            rel = str(target_path.relative_to(user_dir))
+            if hasher is not None:
+                record_stored_file(username, rel, hasher.hexdigest())
+            extracted.append((rel, target_path.stat().st_size))
+            if user.get("auto_share", False) or shared_folder_entry:
+                to_share.append((username, rel, target_path.name, extracted[-1][1], get_file_type(target_path.name)))
+            jobs.advance(job, 1)
+    finally:
+        if to_share:
+            shared_manager.request_shares_bulk(to_share, auto_approve=True)
+        user_manager.adjust_storage_used(username, sum(size for _, size in extracted))
+        dir_stats.invalidate(username, folder_path, *{os.path.dirname(rel) for rel, _ in extracted})
+        logger.info(f"Extracted {len(extracted)} file(s) into {username}/{folder_path or '(root)'}")
+
+    msg = f"Extracted {len(extracted)} file(s)"
+    if job["errors"]:
+        msg += f". {len(job['errors'])} skipped"
+    return {"msg": msg, "folder": folder_path, "extracted": len(extracted)}
+
+
+def attachment_disposition(filename):
+    """Content-Disposition for a download name that may not be ASCII."""
+    fallback = secure_filename(filename) or "download"
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+# ==================== SHARE RECONCILIATION ====================
+# Shares whose file or folder disappeared outside the share routes (deleted
+# on disk, moved) are pruned here, off the request path.
+
+SHARE_RECONCILE_BATCH = 500
+
+
+def reconcile_shares():
+    """Check every approved share against the disk, a batch per write."""
+    files = shared_manager.get_approved()
+    folders = shared_manager.get_approved_folders()
+    removed = 0
+    for i in range(0, max(len(files), len(folders)), SHARE_RECONCILE_BATCH):
+        removed += shared_manager.prune_missing(files[i:i + SHARE_RECONCILE_BATCH],
+                                                folders[i:i + SHARE_RECONCILE_BATCH])
+    return removed
+
+
+_share_reconcile_stop = threading.Event()
+
+
+def _share_reconcile_loop():
+    while not _share_reconcile_stop.wait(SHARE_RECONCILE_INTERVAL):
+        try:
+            reconcile_shares()
+        except Exception as e:
+            logger.error(f"Share reconcile error: {e}")
+
+
+def _prune_event_path(src_path):
+    try:
+        parts = Path(src_path).relative_to(STORAGE_DIR).parts
+    except ValueError:
+        return
+    if len(parts) >= 2:
+        shared_manager.prune_under(parts[0], "/".join(parts[1:]))
+
+
+def start_storage_watcher():
+    """Prune shares as soon as watchdog reports a delete or move under STORAGE_DIR."""
+    class ShareWatcher(FileSystemEventHandler):
+        def on_deleted(self, event):
+            _prune_event_path(event.src_path)
+
+        def on_moved(self, event):
+            _prune_event_path(event.src_path)
 
-        self.users[username] = {
-            "password_hash": bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode(),
-            "role": role,
-            "status": "approved",
-            "created_at": datetime.now().isoformat(),
-            "storage_used": 0,
-            "trusted_uploader": role == "admin",
-            "auto_share": False
-        }
-        self.save_users()
-        (STORAGE_DIR / username).mkdir(exist_ok=True)
-        return True, "User created"
+    observer = Observer()
+    observer.schedule(ShareWatcher(), str(STORAGE_DIR), recursive=True)
+    observer.daemon = True
+    observer.start()
+    return observer
 
-    def delete_user(self, username):
-        if username == "admin" or username not in self.users:
-            return False, "Cannot delete"
-        user_dir = STORAGE_DIR / username
-        if user_dir.exists():
-            shutil.rmtree(user_dir)
-        del self.users[username]
-        self.save_users()
-        return True, "User deleted"
 
-    def authenticate(self, username, password):
-        if username not in self.users:
-            return False
-        if self.users[username]["status"] != "approved":
-            return False
-        return bcrypt.checkpw(password.encode(), self.users[username]["password_hash"].encode())
+class SharedFolderFiles:
+    """Stable IDs for the files inside shared folders, and the index resolving them.
 
-    def get_user(self, username):
-        return self.users.get(username)
+    An ID is "<folder share id>.<hash of (owner, path, inode)>", so a file keeps
+    its ID across listings and restarts while a replaced file (new inode) gets a
+    new one. IDs handed out by listings are remembered in a bounded LRU; an
+    unknown ID walks its folder once to find the file again; a walk that finds
+    nothing makes further unknown IDs in that folder fail fast for a short while.
+    """
 
-    def list_users(self, status=None):
-        return [
-            {
-                "username": u,
-                "role": d["role"],
-                "status": d["status"],
-                "created_at": d["created_at"],
-                "storage_used": d["storage_used"],
-                "trusted_uploader": d.get("trusted_uploader", False),
-                "auto_share": d.get("auto_share", False)
-            }
-            for u, d in self.users.items()
-            if status is None or d["status"] == status
-        ]
+    MAX_ENTRIES = 200_000
+    MISS_TTL = 10   # seconds a fruitless walk of a folder is remembered
+    _DIGEST = re.compile(r"[0-9a-f]{24}")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths = OrderedDict()   # file id -> filepath relative to the owner's root
+        self._misses = {}             # folder id -> monotonic time of the last fruitless walk
+
+    @staticmethod
+    def make_id(folder_id, owner, filepath, inode):
+        digest = hashlib.blake2b(f"{owner}\0{filepath}\0{inode}".encode(), digest_size=12).hexdigest()
+        return f"{folder_id}.{digest}"
+
+    def _remember(self, file_id, filepath):
+        with self._lock:
+            self._paths[file_id] = filepath
+            self._paths.move_to_end(file_id)
+            while len(self._paths) > self.MAX_ENTRIES:
+                self._paths.popitem(last=False)
+
+    def file_id(self, folder_entry, filepath, inode):
+        file_id = self.make_id(folder_entry["id"], folder_entry["username"], filepath, inode)
+        self._remember(file_id, filepath)
+        return file_id
+
+    def _search(self, folder_entry, wanted):
+        user_dir = STORAGE_DIR / folder_entry["username"]
+        stack = [folder_entry["folder_path"]]
+        while stack:
+            rel_dir = stack.pop()
+            try:
+                with os.scandir(user_dir / rel_dir) as entries:
+                    for entry in entries:
+                        filepath = f"{rel_dir}/{entry.name}"
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(filepath)
+                        elif entry.is_file(follow_symlinks=False):
+                            if self.make_id(folder_entry["id"], folder_entry["username"],
+                                            filepath, entry.inode()) == wanted:
+                                self._remember(wanted, filepath)
+                                return filepath
+            except OSError:
+                continue
+        return None
 
-    def update_storage_used(self, username):
-        user_dir = STORAGE_DIR / username
-        if user_dir.exists():
-            total = sum(f.stat().st_size for f in user_dir.rglob('*') if f.is_file())
-            self.users[username]["storage_used"] = total
-            self.save_users()
+    def resolve(self, file_id):
+        """(folder share entry, filepath) for a live file ID, else None."""
+        folder_id, sep, digest = file_id.rpartition(".")
+        if not sep or not self._DIGEST.fullmatch(digest):
+            return None
+        folder_entry = shared_manager.get_approved_folder(folder_id)
+        if not folder_entry:
+            return None
+        with self._lock:
+            filepath = self._paths.get(file_id)
+            missed = self._misses.get(folder_id)
+        if filepath is None:
+            if missed is not None and time.monotonic() - missed < self.MISS_TTL:
+                return None
+            filepath = self._search(folder_entry, file_id)
+            if filepath is None:
+                with self._lock:
+                    now = time.monotonic()
+                    self._misses = {fid: t for fid, t in self._misses.items()
+                                    if now - t < self.MISS_TTL}
+                    self._misses[folder_id] = now
+                return None
+        # Same path and inode as when the ID was issued?
+        try:
+            inode = os.lstat(STORAGE_DIR / folder_entry["username"] / filepath).st_ino
+        except OSError:
+            return None
+        if self.make_id(folder_id, folder_entry["username"], filepath, inode) != file_id:
+            return None
+        return folder_entry, filepath
 
-    def set_trusted_uploader(self, username, value: bool):
-        if username not in self.users:
-            return False, "User not found"
-        self.users[username]["trusted_uploader"] = value
-        self.save_users()
-        return True, "Updated"
 
-    def set_auto_share(self, username, value: bool):
-        if username not in self.users:
-            return False, "User not found"
-        self.users[username]["auto_share"] = value
-        self.save_users()
-        return True, "Updated"
+shared_folder_files = SharedFolderFiles()
 
 
-app = Flask(__name__, static_folder='static')
-app.config.update(
-    JWT_SECRET_KEY=JWT_SECRET,
-    JWT_ACCESS_TOKEN_EXPIRES=timedelta(hours=8),
-    JWT_TOKEN_LOCATION=["headers", "query_string"],
-    JWT_QUERY_STRING_NAME="token",
-    MAX_CONTENT_LENGTH=2 * 1024 * 1024 * 1024,  # 2 GB
-)
-CORS(app)
-jwt = JWTManager(app)
-user_manager = UserManager(USERS_FILE)
-shared_manager = SharedFilesManager(SHARED_FILE)
+def resolve_network_file(file_id):
+    """Path of a network-visible file: an approved share or a file in a shared folder."""
+    file_entry = shared_manager.get_approved_share(file_id)
+    if file_entry:
+        return STORAGE_DIR / file_entry["username"] / file_entry["filepath"]
+    found = shared_folder_files.resolve(file_id)
+    if found:
+        folder_entry, filepath = found
+        return STORAGE_DIR / folder_entry["username"] / filepath
+    return None
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_DIR / 'nas.log'),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
+
+# Network files are addressed by stable IDs, so browsers may reuse them briefly
+NETWORK_FILE_CACHE_CONTROL = "private, max-age=300"
+
+
+if SHARE_RECONCILE_INTERVAL > 0:
+    threading.Thread(target=_share_reconcile_loop, daemon=True).start()
+if WATCH_STORAGE:
+    if WATCHDOG_AVAILABLE:
+        start_storage_watcher()
+    else:
+        print("⚠️  watchdog not installed - NAS_WATCH_STORAGE ignored. Run: pip install watchdog")
 
 
 # ==================== GLOBAL ERROR HANDLERS ====================
@@ -555,6 +2590,544 @@ def should_auto_approve(user):
     return user.get("role") == "admin" or user.get("trusted_uploader", False)
 
 
+# ==================== DIRECTORY LISTING ====================
+# One os.scandir() pass per folder; DirEntry caches the file type and stat()
+# result, and entries outside the requested page are never stat()ed unless
+# the sort order needs it.
+
+LIST_SORTS = {"name": "asc", "mtime": "desc", "size": "desc", "type": "asc"}   # default order
+LIST_MAX_LIMIT = 5000
+
+
+def _list_sort_key(sort, is_dir):
+    def key(entry):
+        name = (entry.name.lower(), entry.name)
+        if sort == "mtime":
+            return (entry.stat().st_mtime_ns,) + name
+        if sort == "size":
+            return (0 if is_dir else entry.stat().st_size,) + name
+        if sort == "type" and not is_dir:
+            return (get_file_type(entry.name), os.path.splitext(entry.name)[1].lower()) + name
+        return name
+    return key
+
+
+def _list_key_types(sort, is_dir):
+    """Element types of the keys _list_sort_key(sort, is_dir) returns, for checking cursors."""
+    name = (str, str)
+    if sort in ("mtime", "size"):
+        return (int,) + name
+    if sort == "type" and not is_dir:
+        return (str, str) + name
+    return name
+
+
+def _encode_cursor(sort, group, key):
+    raw = json.dumps({"s": sort, "g": group, "k": list(key)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor, sort, key_types):
+    """(group, key) from a cursor; key_types holds each group's key element types."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if data["s"] != sort or data["g"] not in (0, 1) or isinstance(data["g"], bool):
+            raise ValueError
+        key = tuple(data["k"])
+        types = key_types[data["g"]]
+        # The key is compared with real sort keys, so it must have their exact shape
+        if len(key) != len(types) or any(type(v) is not t for v, t in zip(key, types)):
+            raise ValueError
+        return data["g"], key
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def listing_args(args):
+    """Validate sort / order / cursor / limit query args; raises ValueError."""
+    sort = args.get("sort", "").strip().lower() or None
+    if sort is not None and sort not in LIST_SORTS:
+        raise ValueError(f"sort must be one of: {', '.join(LIST_SORTS)}")
+    order = args.get("order", "").strip().lower() or None
+    if order not in (None, "asc", "desc"):
+        raise ValueError("order must be asc or desc")
+    limit = args.get("limit", "").strip()
+    if limit:
+        if not limit.isdigit() or not 0 < int(limit) <= LIST_MAX_LIMIT:
+            raise ValueError(f"limit must be between 1 and {LIST_MAX_LIMIT}")
+        limit = int(limit)
+    return {"sort": sort, "order": order, "cursor": args.get("cursor", "").strip() or None,
+            "limit": limit or None}
+
+
+def list_directory(path, sort=None, order=None, cursor=None, limit=None):
+    """List a folder, folders first; returns (folders, files, next_cursor).
+
+    Without `sort` the original order is kept: folders by name, files newest
+    first. `cursor` is a previous page's next_cursor — a position in the sort
+    order rather than an offset, so entries added or removed between requests
+    don't shift the page. folders/files are os.DirEntry lists.
+    """
+    needs_stat = sort in ("mtime", "size") or sort is None
+    folders, files = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file():
+                    if needs_stat:
+                        entry.stat()
+                    files.append(entry)
+                elif entry.is_dir():
+                    if sort == "mtime":
+                        entry.stat()
+                    folders.append(entry)
+            except OSError:
+                continue    # vanished mid-listing
+
+    if sort is None:
+        groups = [(folders, _list_sort_key("name", True), False),
+                  (files, _list_sort_key("mtime", False), True)]
+    else:
+        reverse = (order or LIST_SORTS[sort]) == "desc"
+        groups = [(folders, _list_sort_key(sort, True), reverse),
+                  (files, _list_sort_key(sort, False), reverse)]
+    cursor_sort = f"{sort or ''}:{order or ''}"
+    key_types = [_list_key_types(sort or "name", True), _list_key_types(sort or "mtime", False)]
+    start_group, start_key = _decode_cursor(cursor, cursor_sort, key_types) if cursor else (0, None)
+
+    page = ([], [])
+    taken = 0
+    next_cursor = None
+    for group, (entries, key, reverse) in enumerate(groups):
+        if group < start_group:
+            continue
+        entries.sort(key=key, reverse=reverse)
+        start = 0
+        if group == start_group and start_key is not None:
+            # First entry strictly after the cursor (binary search on the sorted list)
+            lo, hi = 0, len(entries)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                k = key(entries[mid])
+                if (k >= start_key) if reverse else (k <= start_key):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            start = lo
+        for entry in entries[start:]:
+            if limit and taken == limit:
+                last_group = 1 if page[1] else 0
+                next_cursor = _encode_cursor(cursor_sort, last_group, groups[last_group][1](page[last_group][-1]))
+                break
+            page[group].append(entry)
+            taken += 1
+        if next_cursor:
+            break
+    return page[0], page[1], next_cursor
+
+
+# ── Conditional GET ──────────────────────────────────────────────
+# Listing ETags are built from cheap version inputs (folder mtime, the
+# DirStatsCache generation, the share registry generation, query args), so a
+# matching If-None-Match is answered before the folder is read at all.
+# The per-process salt keeps generations from different workers apart.
+
+ETAG_SALT = secrets.token_hex(4)
+
+
+def listing_etag(*parts):
+    return hashlib.blake2b(repr((ETAG_SALT,) + parts).encode(), digest_size=12).hexdigest()
+
+
+def not_modified(etag):
+    """A 304 response if the request's If-None-Match matches etag, else None."""
+    if request.if_none_match.contains_weak(etag):
+        return with_etag(make_response("", 304), etag)
+    return None
+
+
+def with_etag(response, etag):
+    response.set_etag(etag, weak=True)
+    # Let browsers keep the body but revalidate on every request
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+# ==================== FILE SERVING ====================
+# Every route that sends a stored file goes through serve_file(): strong
+# ETag + Last-Modified, 304s, If-Range, and single, suffix and multiple
+# byte ranges. Full and single-range bodies are handed to the server's
+# wsgi.file_wrapper as a file bounded to the range, so gunicorn sends them
+# with sendfile() (Content-Length caps the count) and nothing passes
+# through Python; servers without one read it in STREAM_BUFFER_SIZE blocks.
+# Either way the kernel is told the range is read sequentially (larger
+# read-ahead) and, with STREAM_READAHEAD, asked to prefetch that far ahead
+# of the reader, so players scrubbing through large videos don't stall on
+# small disk reads.
+
+SERVE_MAX_RANGES = 16    # more (after merging) and the whole file is sent instead
+
+
+class _FileRange:
+    """Read-only view of `length` bytes of a file from `start`.
+
+    The file is unbuffered, so the descriptor's offset is the range start
+    for servers that sendfile() from fileno(); read() stops at the range end
+    and, with STREAM_MMAP, slices an mmap of the file rather than calling
+    read(). Read-ahead is advised in windows as the reader advances.
+    """
+
+    def __init__(self, path, start, length):
+        self._file = open(path, "rb", buffering=0)
+        self._file.seek(start)
+        self._pos = start
+        self._end = start + length
+        self._ahead = start
+        self._map = None
+        self._advise = bool(STREAM_READAHEAD and length and hasattr(os, "posix_fadvise"))
+        if length and hasattr(os, "posix_fadvise"):
+            try:
+                os.posix_fadvise(self._file.fileno(), start, length, os.POSIX_FADV_SEQUENTIAL)
+            except OSError:
+                pass
+        if self._advise:
+            self._read_ahead()
+        if STREAM_MMAP and length:
+            try:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(self._map, "madvise"):
+                    self._map.madvise(mmap.MADV_SEQUENTIAL)
+            except (OSError, ValueError):
+                self._map = None
+            if self._map is not None and len(self._map) < self._end:
+                self._end = len(self._map)    # shrank since stat(); read() would stop there too
+
+    def _read_ahead(self):
+        """Keep WILLNEED advice STREAM_READAHEAD bytes ahead of the reader."""
+        if self._ahead >= self._end or self._ahead - self._pos > STREAM_READAHEAD // 2:
+            return
+        start = max(self._ahead, self._pos)
+        count = min(STREAM_READAHEAD, self._end - start)
+        try:
+            os.posix_fadvise(self._file.fileno(), start, count, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        self._ahead = start + count
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def read(self, size=-1):
+        left = self._end - self._pos
+        if left <= 0:
+            return b""
+        size = left if size is None or size < 0 else min(size, left)
+        if self._advise:
+            self._read_ahead()
+        if self._map is not None:
+            data = self._map[self._pos:self._pos + size]
+        else:
+            data = self._file.read(size)
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+
+def file_etag(st):
+    return f"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def byte_ranges(header, size):
+    """Satisfiable (start, end) spans of a Range header, merged and sorted.
+
+    None when the header is malformed or not in bytes (serve the
+    whole file); [] when no range is satisfiable (416).
+    """
+    # Parsed by hand: werkzeug's parser rejects overlapping or unordered
+    # ranges, which RFC 9110 allows and some players send.
+    units, _, specs = header.partition("=")
+    if units.strip().lower() != "bytes":
+        return None
+    spans = []
+    for spec in specs.split(","):
+        first, dash, last = spec.strip().partition("-")
+        if not dash or not (first or last) or not (first + last).isdigit():
+            return None
+        if not first:
+            begin, end = max(0, size - int(last)), size
+        else:
+            begin = int(first)
+            end = size if not last else min(int(last) + 1, size)
+            if last and int(last) < begin:
+                return None
+        if begin < end:
+            spans.append((begin, end))
+    spans.sort()
+    merged = []
+    for begin, end in spans:
+        if merged and begin <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((begin, end))
+    return merged
+
+
+def _multipart_body(path, spans, parts, closing):
+    for (start, end), head in zip(spans, parts):
+        yield head
+        part = _FileRange(path, start, end - start)
+        try:
+            remaining = end - start
+            while remaining:
+                block = part.read(STREAM_BUFFER_SIZE)
+                if not block:
+                    return
+                remaining -= len(block)
+                yield block
+        finally:
+            part.close()
+        yield b"\r\n"
+    yield closing
+
+
+def serve_file(path, mimetype=None, as_attachment=False, download_name=None,
+               cache_control="private, no-cache"):
+    """Response sending a stored file, honouring conditional and Range requests."""
+    st = os.stat(path)
+    size = st.st_size
+    etag = file_etag(st)
+    last_modified = datetime.fromtimestamp(int(st.st_mtime), timezone.utc)
+    mimetype = mimetype or mimetypes.guess_type(str(path))[0] or "application/octet-stream"
+    environ = request.environ
+
+    def finish(response):
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.headers["Accept-Ranges"] = "bytes"
+        if cache_control:
+            response.headers["Cache-Control"] = cache_control
+        if as_attachment:
+            response.headers["Content-Disposition"] = attachment_disposition(download_name or Path(path).name)
+        return response
+
+    if not is_resource_modified(environ, etag=etag, last_modified=last_modified):
+        return finish(app.response_class(status=304))
+
+    spans = None
+    if "HTTP_RANGE" in environ and size and (
+            "HTTP_IF_RANGE" not in environ
+            or not is_resource_modified(environ, etag=etag, last_modified=last_modified, ignore_if_range=False)):
+        spans = byte_ranges(environ["HTTP_RANGE"], size)
+        if spans is not None and len(spans) > SERVE_MAX_RANGES:
+            spans = None
+
+    if spans == []:
+        response = app.response_class(status=416)
+        response.headers["Content-Range"] = f"bytes */{size}"
+        return finish(response)
+
+    if spans is None or len(spans) == 1:
+        start, end = spans[0] if spans else (0, size)
+        body = wrap_file(environ, _FileRange(path, start, end - start), STREAM_BUFFER_SIZE)
+        response = app.response_class(body, 206 if spans else 200, mimetype=mimetype, direct_passthrough=True)
+        response.content_length = end - start
+        if spans:
+            response.headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        return finish(response)
+
+    boundary = secrets.token_hex(12)
+    parts = [f"--{boundary}\r\nContent-Type: {mimetype}\r\nContent-Range: bytes {start}-{end - 1}/{size}\r\n\r\n".encode()
+             for start, end in spans]
+    closing = f"--{boundary}--\r\n".encode()
+    response = app.response_class(_multipart_body(path, spans, parts, closing), 206,
+                                  mimetype=f"multipart/byteranges; boundary={boundary}", direct_passthrough=True)
+    response.content_length = (sum(len(p) + 2 for p in parts) + len(closing)
+                               + sum(end - start for start, end in spans))
+    return finish(response)
+
+
+# ==================== IMAGE RENDITIONS ====================
+# Image previews are resized once and kept in .renditions/, keyed by the
+# source's path, mtime and size and the rendition's dimensions and format,
+# so a changed photo gets a new entry and stale ones age out. Entries are
+# evicted least recently used first (a hit bumps the file's mtime) once the
+# cache passes RENDITION_CACHE_BYTES. Clients that add ?v=<file mtime> to
+# the URL get long-lived cache headers, since the URL changes with the file.
+
+RENDITION_SIZES = {"thumb": (256, 256), "preview": (1920, 1080)}
+RENDITION_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+RENDITION_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+
+class RenditionCache:
+    """LRU disk cache of resized images, shared by all workers."""
+
+    TOUCH_INTERVAL = 60     # don't re-stamp an entry used less than a minute ago
+    # Other workers fill the cache too, so the running total is only trusted for
+    # this long, or until this process has added this share of the budget
+    RECOUNT_INTERVAL = 60
+    RECOUNT_SHARE = 0.1
+
+    def __init__(self, root, budget):
+        self.root = root
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self._used = None       # bytes in the cache as of the last count, plus our renders since
+        self._added_since = 0
+        self._counted_at = 0
+        self._lock = threading.Lock()
+
+    def _entries(self):
+        entries = []
+        try:
+            shards = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return entries
+        for shard in shards:
+            if not shard.is_dir(follow_symlinks=False):
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                if entry.name.startswith("."):
+                    # Leftover temp file of an interrupted render
+                    if st.st_mtime < time.time() - 3600:
+                        try:
+                            os.unlink(entry.path)
+                        except OSError:
+                            pass
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _evict(self, keep):
+        """Drop least recently used entries, except `keep`, until the cache is 90% of budget."""
+        entries = sorted(self._entries())
+        used = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if used <= self.budget * 0.9:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            used -= size
+        self._used = used
+        self._added_since = 0
+        self._counted_at = time.monotonic()
+
+    def _added(self, path):
+        with self._lock:
+            if self._used is not None:
+                self._used += os.path.getsize(path)
+                self._added_since += os.path.getsize(path)
+            if (self._used is None or self._added_since > self.budget * self.RECOUNT_SHARE
+                    or time.monotonic() - self._counted_at > self.RECOUNT_INTERVAL):
+                self._used = sum(size for _, size, _ in self._entries())
+                self._added_since = 0
+                self._counted_at = time.monotonic()
+            if self._used > self.budget:
+                self._evict(keep=str(path))
+
+    def path_for(self, path, st, dims, fmt):
+        key = f"{os.path.realpath(path)}\0{st.st_mtime_ns}\0{st.st_size}\0{dims[0]}x{dims[1]}\0{fmt}"
+        digest = hashlib.blake2b(key.encode("utf-8", "surrogateescape"), digest_size=16).hexdigest()
+        return self.root / digest[:2] / f"{digest}.{fmt.lower()}"
+
+    def get(self, path, dims):
+        """(rendition path, mimetype) of the image at `path` fitted into `dims`.
+
+        None when the original should be sent as is: it already fits in a
+        web format, or Pillow can't read it. Raises like os.stat on a
+        missing source.
+        """
+        st = os.stat(path)
+        try:
+            with Image.open(path) as img:
+                fmt = img.format if img.format in RENDITION_FORMATS else (
+                    "PNG" if "A" in img.getbands() or img.mode == "P" else "JPEG")
+                if img.width <= dims[0] and img.height <= dims[1] and fmt == img.format:
+                    return None
+                target = self.path_for(path, st, dims, fmt)
+                try:
+                    cached = os.stat(target)
+                except FileNotFoundError:
+                    cached = None
+                if cached is not None:
+                    with self._lock:
+                        self.hits += 1
+                    if cached.st_mtime < time.time() - self.TOUCH_INTERVAL:
+                        try:
+                            os.utime(target)
+                        except OSError:
+                            pass
+                    return target, RENDITION_FORMATS[fmt]
+                with self._lock:
+                    self.misses += 1
+                # JPEGs decode straight at a reduced scale (DCT scaling), far
+                # cheaper than decoding the full image and shrinking it
+                img.draft(img.mode, dims)
+                img = ImageOps.exif_transpose(img)
+                img.thumbnail(dims, Image.Resampling.LANCZOS, reducing_gap=3.0)
+                if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+                    img = img.convert("RGB")
+                target.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp_name = tempfile.mkstemp(dir=str(target.parent), prefix=".")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        img.save(f, format=fmt, **({"quality": 85} if fmt in ("JPEG", "WEBP") else {}))
+                    os.replace(tmp_name, target)
+                except BaseException:
+                    try:
+                        os.unlink(tmp_name)
+                    except FileNotFoundError:
+                        pass
+                    raise
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            if isinstance(e, FileNotFoundError) and not os.path.exists(path):
+                raise
+            logger.warning(f"Image preview of {path} failed, sending original: {e}")
+            return None
+        self._added(target)
+        return target, RENDITION_FORMATS[fmt]
+
+    def metrics(self):
+        with self._lock:
+            if self._used is None:
+                self._used = sum(size for _, size, _ in self._entries())
+            return {"bytes": self._used, "budget_bytes": self.budget, "hits": self.hits, "misses": self.misses}
+
+
+renditions = RenditionCache(RENDITION_DIR, RENDITION_CACHE_BYTES)
+
+
+def serve_image_preview(file_path, cache_control="private, no-cache"):
+    """Image preview: a cached rendition for ?size=thumb|preview (default), the file for ?size=full."""
+    size = request.args.get("size", "preview")
+    if size != "full" and size not in RENDITION_SIZES:
+        return make_response(jsonify({"msg": f"Unknown size '{size}'"}), 400)
+    if request.args.get("v"):
+        cache_control = RENDITION_CACHE_CONTROL
+    rendition = renditions.get(file_path, RENDITION_SIZES[size]) if size != "full" else None
+    if rendition is None:
+        return serve_file(file_path, cache_control=cache_control)
+    path, mimetype = rendition
+    try:
+        return serve_file(path, mimetype=mimetype, cache_control=cache_control)
+    except FileNotFoundError:
+        # Evicted by another worker in the meantime
+        return serve_file(file_path, cache_control=cache_control)
+
+
 # ==================== STATIC FILES ====================
 @app.route("/")
 def index():
@@ -686,22 +3259,44 @@ def login():
 def upload_files():
     username = get_jwt_identity()
     user = user_manager.get_user(username)
-    folder_path = request.form.get('folder', '').strip()
+
+    reservation, refused = reserve_upload(request.content_length or 0)
+    if refused:
+        return refused
+
+    try:
+        # File parts stream straight into spools next to nas_storage (see UploadSpool)
+        form, request_files = parse_upload_form(reservation)
+        try:
+            return _store_uploaded_files(username, user, form, request_files)
+        finally:
+            for _, file in request_files.items(multi=True):
+                file.stream.discard()
+    finally:
+        reservation.release()
+
+
+def _store_uploaded_files(username, user, form, request_files):
+    folder_path = form.get('folder', '').strip()
     folder_path = validate_path(username, folder_path)
-    is_folder_upload = request.form.get('is_folder_upload', 'false') == 'true'
+    is_folder_upload = form.get('is_folder_upload', 'false') == 'true'
 
     user_dir = STORAGE_DIR / username
     base_dir = user_dir / folder_path if folder_path else user_dir
     base_dir.mkdir(parents=True, exist_ok=True)
 
-    if 'files' not in request.files:
+    if 'files' not in request_files:
         return jsonify({"msg": "No files provided"}), 400
 
-    files = request.files.getlist('files')
-    paths = request.form.getlist('paths')
+    files = request_files.getlist('files')
+    paths = form.getlist('paths')
+    # Optional expected b2-1m digests, one per file (empty to skip one)
+    digests = form.getlist('digests')
 
     uploaded = []
     errors = []
+    to_share = []
+    added_bytes = 0
 
     # Check if uploading into an already-shared folder
     shared_folder_entry = shared_manager.get_shared_folder_for_path(username, folder_path) if folder_path else None
@@ -737,25 +3332,35 @@ def upload_files():
                     counter += 1
 
         try:
-            file.save(str(target_path))
+            expected = digests[idx].strip().lower() if idx < len(digests) else ""
+            digest = file.stream.save_as(target_path)
+            if expected and digest is None:
+                digest = hash_file(target_path)
+            if expected and digest != expected:
+                target_path.unlink()
+                errors.append(f"{file.filename}: Checksum mismatch")
+                continue
             rel = str(target_path.relative_to(user_dir))
+            if digest:
+                record_stored_file(username, rel, digest)
             uploaded.append(rel)
+            size = target_path.stat().st_size
+            added_bytes += size
 
             # Auto-share if: user has auto_share flag, OR uploading into a shared folder
             if user.get("auto_share", False) or shared_folder_entry:
-                stat = target_path.stat()
-                file_id = shared_manager.request_share(
-                    username, rel, target_path.name,
-                    stat.st_size, get_file_type(target_path.name)
-                )
-                shared_manager.approve_share(file_id)
+                to_share.append((username, rel, target_path.name,
+                                 size, get_file_type(target_path.name)))
 
             logger.info(f"File uploaded: {username}/{rel}")
         except Exception as e:
             logger.error(f"Upload error for {username}/{file.filename}: {str(e)}")
             errors.append(f"{file.filename}: Upload failed")
 
-    user_manager.update_storage_used(username)
+    if to_share:
+        shared_manager.request_shares_bulk(to_share, auto_approve=True)
+    user_manager.adjust_storage_used(username, added_bytes)
+    dir_stats.invalidate(username, *{os.path.dirname(rel) for rel in uploaded})
 
     if uploaded:
         msg = f"Uploaded {len(uploaded)} file(s)"
@@ -768,22 +3373,230 @@ def upload_files():
     return jsonify({"msg": "No files uploaded", "errors": errors}), 400
 
 
+@app.route("/api/upload/stream", methods=["POST", "PUT"])
+@jwt_required()
+def upload_stream():
+    """Upload one file sent as the raw request body, written to disk once.
+
+    Query args: filename, folder, is_folder_upload, digest (optional b2-1m
+    hex to verify). The body goes into an UploadSpool and is renamed into place.
+    """
+    username = get_jwt_identity()
+    user = user_manager.get_user(username)
+
+    filename    = request.args.get("filename", "").strip()
+    folder_path = validate_path(username, request.args.get("folder", "").strip())
+    is_folder   = request.args.get("is_folder_upload", "false") == "true"
+    expected    = request.args.get("digest", "").strip().lower()
+
+    if not filename:
+        return jsonify({"msg": "Missing filename"}), 400
+    if not allowed_file(filename):
+        return jsonify({"msg": f"File type not allowed: {filename}"}), 400
+    if request.content_length is None:
+        return jsonify({"msg": "Content-Length required"}), 411
+
+    reservation, refused = reserve_upload(request.content_length)
+    if refused:
+        return refused
+
+    user_dir = STORAGE_DIR / username
+    spool = reservation.spool()
+    try:
+        spool.copy_from(request.stream)
+        if spool.tell() != request.content_length:
+            return jsonify({"msg": "Upload incomplete"}), 400
+        target_path = upload_target_path(username, folder_path, filename, is_folder)
+        digest = spool.save_as(target_path)
+    finally:
+        spool.discard()
+        reservation.release()
+
+    if expected and digest is None:
+        digest = hash_file(target_path)
+    if expected and digest != expected:
+        target_path.unlink()
+        return jsonify({"msg": "File checksum mismatch", "expected": expected, "actual": digest}), 422
+
+    rel = str(target_path.relative_to(user_dir))
+    size = request.content_length
+    if digest:
+        record_stored_file(username, rel, digest)
+
+    # Auto-share if user has auto_share flag OR uploading into a shared folder
+    shared_folder_entry = shared_manager.get_shared_folder_for_path(username, folder_path) if folder_path else None
+    if user.get("auto_share", False) or shared_folder_entry:
+        shared_manager.request_shares_bulk(
+            [(username, rel, target_path.name, size, get_file_type(target_path.name))],
+            auto_approve=True
+        )
+
+    user_manager.adjust_storage_used(username, size)
+    dir_stats.invalidate(username, os.path.dirname(rel))
+    logger.info(f"File uploaded: {username}/{rel}")
+
+    return jsonify({
+        "msg": f"'{target_path.name}' uploaded successfully",
+        "filepath": rel,
+        "digest": digest
+    }), 200
+
+
+@app.route("/api/upload/archive", methods=["POST", "PUT"])
+@jwt_required()
+def upload_archive():
+    """Upload a zip or tar as the raw request body and unpack it into ?folder=.
+
+    The body is spooled once into tmp_uploads and extracted by a background
+    job (see extract_archive); the response carries its job_id.
+    """
+    username = get_jwt_identity()
+    folder_path = validate_path(username, request.args.get("folder", "").strip())
+    filename = request.args.get("filename", "").strip()
+
+    if request.content_length is None:
+        return jsonify({"msg": "Content-Length required"}), 411
+
+    user_dir = STORAGE_DIR / username
+    base_dir = user_dir / folder_path if folder_path else user_dir
+    try:
+        base_dir.resolve().relative_to(user_dir.resolve())
+    except ValueError:
+        return jsonify({"msg": "Access denied"}), 403
+
+    reservation, refused = reserve_upload(request.content_length)
+    if refused:
+        return refused
+
+    # The spool, and its reservation, live until the extraction job is done
+    spool = reservation.spool()
+    spool.hasher = None   # the archive itself isn't kept
+
+    def discard():
+        spool.discard()
+        reservation.release()
+
+    try:
+        spool.copy_from(request.stream)
+        complete = spool.tell() == request.content_length
+        spool.close()
+        if not complete:
+            discard()
+            return jsonify({"msg": "Upload incomplete"}), 400
+        if not is_archive(spool.name):
+            discard()
+            return jsonify({"msg": "Not a zip or tar archive"}), 400
+    except Exception:
+        discard()
+        raise
+
+    def run(job):
+        try:
+            base_dir.mkdir(parents=True, exist_ok=True)
+            return extract_archive(username, spool.name, folder_path, job)
+        finally:
+            discard()
+
+    job = jobs.submit(username, "extract", run, archive=filename, folder=folder_path)
+    logger.info(f"Archive uploaded for extraction: {username}/{folder_path or '(root)'} ({filename})")
+    return jsonify({"msg": "Extracting archive", "job_id": job["id"]}), 202
+
+
+@app.route("/api/extract", methods=["POST"])
+@jwt_required()
+def extract_stored_archive():
+    """Unpack a zip or tar already in the user's storage, e.g. after a chunked upload.
+
+    JSON: path, dst_folder (defaults to the archive's folder) and
+    delete_archive to remove the archive once it has been extracted.
+    """
+    username = get_jwt_identity()
+    data = request.get_json()
+    path = validate_path(username, (data.get('path') or '').strip())
+    dst_folder = validate_path(username, (data.get('dst_folder') or '').strip()) \
+        if 'dst_folder' in data else os.path.dirname(path)
+    delete_archive = bool(data.get('delete_archive'))
+
+    if not path:
+        return jsonify({"msg": "Archive path required"}), 400
+
+    user_dir = STORAGE_DIR / username
+    archive_path = user_dir / path
+    dst_dir = user_dir / dst_folder if dst_folder else user_dir
+    try:
+        archive_path.resolve().relative_to(user_dir.resolve())
+        dst_dir.resolve().relative_to(user_dir.resolve())
+    except ValueError:
+        return jsonify({"msg": "Access denied"}), 403
+
+    if not archive_path.is_file():
+        return jsonify({"msg": "File not found"}), 404
+    if not is_archive(archive_path):
+        return jsonify({"msg": "Not a zip or tar archive"}), 400
+
+    def run(job):
+        dst_dir.mkdir(parents=True, exist_ok=True)
+        result = extract_archive(username, archive_path, dst_folder, job)
+        if delete_archive:
+            size = archive_path.stat().st_size
+            archive_path.unlink()
+            user_manager.adjust_storage_used(username, -size)
+            dir_stats.invalidate(username, os.path.dirname(path))
+            shared_manager.remove_shares_bulk(e["id"] for e in shared_manager.find_shares("approved", username, path))
+            shared_manager.reject_shares_bulk(e["id"] for e in shared_manager.find_shares("pending", username, path))
+        return result
+
+    job = jobs.submit(username, "extract", run, archive=path, folder=dst_folder)
+    return jsonify({"msg": f"Extracting '{archive_path.name}'", "job_id": job["id"]}), 202
+
+
 @app.route("/api/stats", methods=["GET"])
 @jwt_required()
 def get_stats():
     username = get_jwt_identity()
-    user_dir = STORAGE_DIR / username
+    stats = dir_stats.stats(username)
 
-    if not user_dir.exists():
-        return jsonify({"total_files": 0, "total_size": 0, "total_size_formatted": "0 B"}), 200
+    return jsonify({
+        "total_files": stats["files"],
+        "total_size": stats["bytes"],
+        "total_size_formatted": format_size(stats["bytes"]),
+        "by_type": stats["by_type"],
+    }), 200
+
+
+@app.route("/api/stats/breakdown", methods=["GET"])
+@jwt_required()
+def get_stats_breakdown():
+    """Per-folder sizes directly under ?folder= (disk-usage view)."""
+    username = get_jwt_identity()
+    folder_path = validate_path(username, request.args.get('folder', '').strip())
+    folders = dir_stats.stats(username)["folders"]
+
+    node = folders.get(folder_path)
+    if node is None:
+        return jsonify({"msg": "Folder not found"}), 404
 
-    total_files = sum(1 for f in user_dir.rglob('*') if f.is_file())
-    total_size  = sum(f.stat().st_size for f in user_dir.rglob('*') if f.is_file())
+    children = []
+    for name in node["children"]:
+        path = f"{folder_path}/{name}" if folder_path else name
+        child = folders[path]
+        children.append({
+            "name": name,
+            "path": path,
+            "files": child["files"],
+            "size": child["bytes"],
+            "size_formatted": format_size(child["bytes"]),
+        })
+    children.sort(key=lambda c: c["size"], reverse=True)
 
     return jsonify({
-        "total_files": total_files,
-        "total_size": total_size,
-        "total_size_formatted": format_size(total_size)
+        "folder": folder_path,
+        "total_files": node["files"],
+        "total_size": node["bytes"],
+        "total_size_formatted": format_size(node["bytes"]),
+        "loose_files": node["own_files"],
+        "loose_size": node["own_bytes"],
+        "folders": children,
     }), 200
 
 
@@ -807,51 +3620,68 @@ def list_files():
             "current_path": folder_path,
             "total_files": 0,
             "total_size": 0,
-            "total_size_formatted": "0 B"
+            "total_size_formatted": "0 B",
+            "next_cursor": None
         }), 200
 
+    etag = listing_etag("files", username, folder_path, target_dir.stat().st_mtime_ns,
+                        dir_stats.generation(username), shared_manager.generation(),
+                        sorted(request.args.items(multi=True)))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    try:
+        folder_entries, file_entries, next_cursor = list_directory(target_dir, **listing_args(request.args))
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
     files = []
     folders = []
-    total_size = 0
+    prefix = f"{folder_path}/" if folder_path else ""
 
-    for item in target_dir.iterdir():
-        if item.is_file():
+    for item in file_entries:
+        try:
             stat = item.stat()
-            ext = item.suffix[1:].lower() if item.suffix else ''
-            filepath_relative = str(item.relative_to(user_dir))
-            is_shared = shared_manager.is_file_shared(username,
-                                                      filepath_relative) or shared_manager.is_in_shared_folder(username,
-                                                                                                               filepath_relative)
-            files.append({
-                "name": item.name,
-                "size": stat.st_size,
-                "size_formatted": format_size(stat.st_size),
-                "modified": stat.st_mtime,
-                "type": get_file_type(item.name),
-                "ext": ext,
-                "is_shared": is_shared
-            })
-            total_size += stat.st_size
-        elif item.is_dir():
+        except OSError:
+            continue
+        ext = os.path.splitext(item.name)[1][1:].lower()
+        filepath_relative = prefix + item.name
+        is_shared = shared_manager.is_file_shared(username,
+                                                  filepath_relative) or shared_manager.is_in_shared_folder(username,
+                                                                                                           filepath_relative)
+        files.append({
+            "name": item.name,
+            "size": stat.st_size,
+            "size_formatted": format_size(stat.st_size),
+            "modified": stat.st_mtime,
+            "type": get_file_type(item.name),
+            "ext": ext,
+            "is_shared": is_shared
+        })
+    for item in folder_entries:
+        try:
             stat = item.stat()
-            folder_relative = str(item.relative_to(user_dir))
-            folders.append({
-                "name": item.name,
-                "modified": stat.st_mtime,
-                "is_shared": shared_manager.is_folder_shared(username, folder_relative)
-            })
+        except OSError:
+            continue
+        folders.append({
+            "name": item.name,
+            "modified": stat.st_mtime,
+            "is_shared": shared_manager.is_folder_shared(username, prefix + item.name)
+        })
 
-    files.sort(key=lambda x: x["modified"], reverse=True)
-    folders.sort(key=lambda x: x["name"])
+    # Folder totals cover every file, not just this page
+    totals = dir_stats.stats(username)["folders"].get(folder_path, {"own_files": 0, "own_bytes": 0})
 
-    return jsonify({
+    return with_etag(jsonify({
         "files": files,
         "folders": folders,
         "current_path": folder_path,
-        "total_files": len(files),
-        "total_size": total_size,
-        "total_size_formatted": format_size(total_size)
-    }), 200
+        "total_files": totals["own_files"],
+        "total_size": totals["own_bytes"],
+        "total_size_formatted": format_size(totals["own_bytes"]),
+        "next_cursor": next_cursor
+    }), etag), 200
 
 
 @app.route("/api/share/request", methods=["POST"])
@@ -875,17 +3705,14 @@ def request_share():
         return jsonify({"msg": "File not found"}), 404
 
     stat = file_path.stat()
-    file_id = shared_manager.request_share(
-        username,
-        filepath,
-        file_path.name,
-        stat.st_size,
-        get_file_type(file_path.name)
+    # Auto-approve for admins and trusted uploaders
+    auto_approve = should_auto_approve(user)
+    file_id, = shared_manager.request_shares_bulk(
+        [(username, filepath, file_path.name, stat.st_size, get_file_type(file_path.name))],
+        auto_approve=auto_approve
     )
 
-    # Auto-approve for admins and trusted uploaders
-    if should_auto_approve(user):
-        shared_manager.approve_share(file_id)
+    if auto_approve:
         logger.info(f"Share auto-approved for {username}: {filepath}")
         return jsonify({"msg": "File shared to network", "file_id": file_id, "auto_approved": True}), 200
 
@@ -1013,13 +3840,7 @@ def remove_share(file_id):
     username = get_jwt_identity()
     user = user_manager.get_user(username)
 
-    approved = shared_manager.get_approved()
-    file_entry = None
-    for entry in approved:
-        if entry["id"] == file_id:
-            file_entry = entry
-            break
-
+    file_entry = shared_manager.get_approved_share(file_id)
     if not file_entry:
         return jsonify({"msg": "Share not found"}), 404
 
@@ -1039,13 +3860,7 @@ def remove_folder_share(folder_id):
     username = get_jwt_identity()
     user = user_manager.get_user(username)
 
-    approved_folders = shared_manager.get_approved_folders()
-    folder_entry = None
-    for entry in approved_folders:
-        if entry["id"] == folder_id:
-            folder_entry = entry
-            break
-
+    folder_entry = shared_manager.get_approved_folder(folder_id)
     if not folder_entry:
         return jsonify({"msg": "Folder share not found"}), 404
 
@@ -1062,12 +3877,15 @@ def remove_folder_share(folder_id):
 @app.route("/api/network/files", methods=["GET"])
 @jwt_required()
 def get_network_files():
-    """Network files - requires login. Also cleans up missing items."""
-    shared_manager.cleanup_missing_items()
+    """Network files - requires login. Stale entries are pruned by reconcile_shares()."""
+    etag = listing_etag("network", shared_manager.generation())
+    cached = not_modified(etag)
+    if cached:
+        return cached
 
     approved_files = shared_manager.get_approved()
     approved_folders = shared_manager.get_approved_folders()
-    return jsonify({"files": approved_files, "folders": approved_folders}), 200
+    return with_etag(jsonify({"files": approved_files, "folders": approved_folders}), etag), 200
 
 
 @app.route("/api/network/folder/<folder_id>/delete", methods=["DELETE"])
@@ -1076,8 +3894,7 @@ def delete_item_in_shared_folder(folder_id):
     requester = get_jwt_identity()
     requester_user = user_manager.get_user(requester)
 
-    approved_folders = shared_manager.get_approved_folders()
-    folder_entry = next((f for f in approved_folders if f["id"] == folder_id), None)
+    folder_entry = shared_manager.get_approved_folder(folder_id)
     if not folder_entry:
         return jsonify({"msg": "Shared folder not found"}), 404
 
@@ -1105,6 +3922,7 @@ def delete_item_in_shared_folder(folder_id):
         return jsonify({"msg": "Item not found"}), 404
 
     try:
+        size = path_size(item_path)
         if item_type == "folder" and item_path.is_dir():
             shutil.rmtree(item_path)
             logger.info(f"Shared folder item deleted (dir) by {requester}: {owner}/{folder_entry['folder_path']}/{item_rel}")
@@ -1114,7 +3932,8 @@ def delete_item_in_shared_folder(folder_id):
         else:
             return jsonify({"msg": "Type mismatch or item not found"}), 400
 
-        user_manager.update_storage_used(owner)
+        user_manager.adjust_storage_used(owner, -size)
+        dir_stats.invalidate(owner, item_path.parent.relative_to(user_dir))
         return jsonify({"msg": "Deleted successfully"}), 200
     except Exception as e:
         logger.error(f"Error deleting shared folder item: {e}")
@@ -1125,14 +3944,7 @@ def delete_item_in_shared_folder(folder_id):
 @jwt_required()
 def get_network_folder(folder_id):
     """Get contents of a shared folder with proper navigation."""
-    approved_folders = shared_manager.get_approved_folders()
-
-    folder_entry = None
-    for entry in approved_folders:
-        if entry["id"] == folder_id:
-            folder_entry = entry
-            break
-
+    folder_entry = shared_manager.get_approved_folder(folder_id)
     if not folder_entry:
         return jsonify({"msg": "Folder not found"}), 404
 
@@ -1154,41 +3966,57 @@ def get_network_folder(folder_id):
     if not current_path.exists() or not current_path.is_dir():
         return jsonify({"msg": "Folder not found"}), 404
 
+    etag = listing_etag("network-folder", folder_id, subfolder, current_path.stat().st_mtime_ns,
+                        dir_stats.generation(folder_entry["username"]), shared_manager.generation(),
+                        sorted(request.args.items(multi=True)))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    try:
+        folder_entries, file_entries, next_cursor = list_directory(current_path, **listing_args(request.args))
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
     files = []
     folders = []
+    prefix = f"{subfolder}/" if subfolder else ""
 
-    for item in current_path.iterdir():
-        if item.is_file():
+    for item in file_entries:
+        try:
             stat = item.stat()
-            relative_to_base = str(item.relative_to(base_folder_path))
-            files.append({
-                "id": secrets.token_urlsafe(16),
-                "username": folder_entry["username"],
-                "filepath": str(item.relative_to(user_dir)),
-                "filename": item.name,
-                "relative_path": relative_to_base,
-                "file_size": stat.st_size,
-                "file_type": get_file_type(item.name),
-                "modified": stat.st_mtime
-            })
-        elif item.is_dir():
+        except OSError:
+            continue
+        relative_to_base = prefix + item.name
+        filepath = f"{folder_entry['folder_path']}/{relative_to_base}"
+        files.append({
+            "id": shared_folder_files.file_id(folder_entry, filepath, item.inode()),
+            "username": folder_entry["username"],
+            "filepath": filepath,
+            "filename": item.name,
+            "relative_path": relative_to_base,
+            "file_size": stat.st_size,
+            "file_type": get_file_type(item.name),
+            "modified": stat.st_mtime
+        })
+    for item in folder_entries:
+        try:
             stat = item.stat()
-            relative_to_base = str(item.relative_to(base_folder_path))
-            folders.append({
-                "name": item.name,
-                "relative_path": relative_to_base,
-                "modified": stat.st_mtime
-            })
-
-    folders.sort(key=lambda x: x["name"])
-    files.sort(key=lambda x: x["modified"], reverse=True)
+        except OSError:
+            continue
+        folders.append({
+            "name": item.name,
+            "relative_path": prefix + item.name,
+            "modified": stat.st_mtime
+        })
 
-    return jsonify({
+    return with_etag(jsonify({
         "folder": folder_entry,
         "files": files,
         "folders": folders,
-        "current_subfolder": subfolder
-    }), 200
+        "current_subfolder": subfolder,
+        "next_cursor": next_cursor
+    }), etag), 200
 
 
 @app.route("/api/folder/create", methods=["POST"])
@@ -1227,6 +4055,7 @@ def create_folder():
 
     try:
         target_dir.mkdir(parents=True, exist_ok=False)
+        dir_stats.invalidate(username, target_dir.parent.relative_to(user_dir))
         logger.info(f"Folder created: {username}/{current_path}/{folder_name}")
         return jsonify({"msg": "Folder created successfully"}), 200
     except Exception as e:
@@ -1234,6 +4063,67 @@ def create_folder():
         return jsonify({"msg": "Failed to create folder"}), 500
 
 
+def drop_shares_under(username, *paths):
+    """Remove file/folder shares and pending requests at or below paths that are gone.
+
+    Called after deletes and moves, so network listings don't offer entries
+    that would 404 until the next reconcile pass.
+    """
+    folder_ids, approved_ids, pending_ids = [], [], []
+    for path in paths:
+        folder_ids += [e["id"] for e in shared_manager.find_shares_under("folders", username, path)]
+        approved_ids += [e["id"] for e in shared_manager.find_shares_under("approved", username, path)]
+        pending_ids += [e["id"] for e in shared_manager.find_shares_under("pending", username, path)]
+    if folder_ids:
+        shared_manager.remove_folder_shares_bulk(folder_ids)
+    if approved_ids:
+        shared_manager.remove_shares_bulk(approved_ids)
+    if pending_ids:
+        shared_manager.reject_shares_bulk(pending_ids)
+
+
+def delete_folder_job(username, folder_path, job):
+    """Delete a folder file by file, so a large tree reports progress and can be cancelled.
+
+    Symlinks are removed, not followed. A cancelled delete leaves the rest
+    of the tree in place; its shares are then left to the reconcile pass.
+    """
+    target_dir = STORAGE_DIR / username / folder_path
+    files, folders, stack = [], [], [str(target_dir)]
+    while stack:
+        path = stack.pop()
+        folders.append(path)
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    regular = entry.is_file(follow_symlinks=False)
+                    files.append((entry.path, entry.stat(follow_symlinks=False).st_size if regular else 0))
+    job["total"] = len(files)
+    job["total_bytes"] = sum(size for _, size in files)
+
+    freed = 0
+    try:
+        for path, size in files:
+            try:
+                os.unlink(path)
+                freed += size
+            except FileNotFoundError:
+                pass
+            jobs.advance(job, 1, size)
+        for path in reversed(folders):  # pre-order, so children come before parents
+            os.rmdir(path)
+    finally:
+        user_manager.adjust_storage_used(username, -freed)
+        dir_stats.invalidate(username, os.path.dirname(folder_path), folder_path)
+
+    # Remove folder and all files within it from shared cache
+    drop_shares_under(username, folder_path)
+    logger.info(f"Folder deleted: {username}/{folder_path}")
+    return {"msg": "Folder deleted successfully"}
+
+
 @app.route("/api/folder/delete", methods=["DELETE"])
 @jwt_required()
 def delete_folder():
@@ -1255,33 +4145,9 @@ def delete_folder():
     if not target_dir.exists() or not target_dir.is_dir():
         return jsonify({"msg": "Folder not found"}), 404
 
-    try:
-        shutil.rmtree(target_dir)
-        user_manager.update_storage_used(username)
-        # Remove folder and all files within it from shared cache
-        approved_folders = list(shared_manager.get_approved_folders())
-        for entry in approved_folders:
-            if entry["username"] == username and (
-                entry["folder_path"] == folder_path or
-                entry["folder_path"].startswith(folder_path + "/")
-            ):
-                shared_manager.remove_folder_share(entry["id"])
-        approved = list(shared_manager.get_approved())
-        for entry in approved:
-            if entry["username"] == username and (
-                entry["filepath"] == folder_path or
-                entry["filepath"].startswith(folder_path + "/")
-            ):
-                shared_manager.remove_share(entry["id"])
-        pending = list(shared_manager.get_pending())
-        for entry in pending:
-            if entry["username"] == username and entry["filepath"].startswith(folder_path + "/"):
-                shared_manager.reject_share(entry["id"])
-        logger.info(f"Folder deleted: {username}/{folder_path}")
-        return jsonify({"msg": "Folder deleted successfully"}), 200
-    except Exception as e:
-        logger.error(f"Folder deletion error: {str(e)}")
-        return jsonify({"msg": "Failed to delete folder"}), 500
+    job = jobs.submit(username, "delete_folder", lambda job: delete_folder_job(username, folder_path, job),
+                      path=folder_path)
+    return jsonify({"msg": f"Deleting folder '{folder_path}'", "job_id": job["id"]}), 202
 
 
 @app.route("/api/preview/<path:filepath>", methods=["GET"])
@@ -1312,67 +4178,22 @@ def preview_file(filepath):
     file_type = get_file_type(file_path.name)
 
     if file_type == 'image':
-        try:
-            img = Image.open(file_path)
-            img.thumbnail((1920, 1080), Image.Resampling.LANCZOS)
-            img_io = io.BytesIO()
-            img.save(img_io, format=img.format or 'PNG')
-            img_io.seek(0)
-            return send_file(img_io, mimetype=f'image/{img.format.lower()}')
-        except:
-            return send_file(file_path, mimetype=mimetypes.guess_type(file_path)[0])
+        return serve_image_preview(file_path)
 
     elif file_type == 'pdf':
-        return send_file(file_path, mimetype='application/pdf')
+        return serve_file(file_path, mimetype='application/pdf')
 
     elif file_type == 'text':
-        return send_file(file_path, mimetype='text/plain')
+        return serve_file(file_path, mimetype='text/plain')
 
     elif file_type == 'video':
         mime = mimetypes.guess_type(file_path)[0] or 'video/mp4'
-        return _stream_video(file_path, mime)
+        return serve_file(file_path, mimetype=mime)
 
     else:
         return jsonify({"msg": "Preview not available for this file type"}), 400
 
 
-def _stream_video(file_path, mime_type):
-    """Stream a video file with range request support for seeking."""
-    file_size = file_path.stat().st_size
-    range_header = request.headers.get('Range', None)
-
-    if range_header:
-        byte_start, byte_end = 0, None
-        match = re.match(r'bytes=(\d+)-(\d*)', range_header)
-        if match:
-            byte_start = int(match.group(1))
-            byte_end = int(match.group(2)) if match.group(2) else file_size - 1
-        byte_end = min(byte_end, file_size - 1)
-        length = byte_end - byte_start + 1
-
-        def generate():
-            with open(file_path, 'rb') as f:
-                f.seek(byte_start)
-                remaining = length
-                while remaining > 0:
-                    chunk = f.read(min(65536, remaining))
-                    if not chunk:
-                        break
-                    remaining -= len(chunk)
-                    yield chunk
-
-        response = app.response_class(generate(), 206, mimetype=mime_type, direct_passthrough=True)
-        response.headers['Content-Range'] = f'bytes {byte_start}-{byte_end}/{file_size}'
-        response.headers['Accept-Ranges'] = 'bytes'
-        response.headers['Content-Length'] = length
-        return response
-    else:
-        response = send_file(file_path, mimetype=mime_type)
-        response.headers['Accept-Ranges'] = 'bytes'
-        response.headers['Content-Length'] = file_size
-        return response
-
-
 @app.route("/api/network/preview/<file_id>", methods=["GET"])
 def preview_network_file(file_id):
     """Preview for shared files - requires login via token"""
@@ -1387,48 +4208,34 @@ def preview_network_file(file_id):
     except Exception:
         return jsonify({"msg": "Invalid token"}), 401
 
-    approved = shared_manager.get_approved()
-
-    file_entry = None
-    for entry in approved:
-        if entry["id"] == file_id:
-            file_entry = entry
-            break
-
-    if not file_entry:
+    file_path = resolve_network_file(file_id)
+    if not file_path or not file_path.exists():
         return jsonify({"msg": "File not found"}), 404
 
-    user_dir = STORAGE_DIR / file_entry["username"]
-    file_path = user_dir / file_entry["filepath"]
+    response = _preview_network_response(file_path)
+    if response.status_code in (200, 206, 304) and response.headers.get("Cache-Control") != RENDITION_CACHE_CONTROL:
+        response.headers["Cache-Control"] = NETWORK_FILE_CACHE_CONTROL
+    return response
 
-    if not file_path.exists():
-        return jsonify({"msg": "File not found"}), 404
 
+def _preview_network_response(file_path):
     file_type = get_file_type(file_path.name)
 
     if file_type == 'image':
-        try:
-            img = Image.open(file_path)
-            img.thumbnail((1920, 1080), Image.Resampling.LANCZOS)
-            img_io = io.BytesIO()
-            img.save(img_io, format=img.format or 'PNG')
-            img_io.seek(0)
-            return send_file(img_io, mimetype=f'image/{img.format.lower()}')
-        except:
-            return send_file(file_path, mimetype=mimetypes.guess_type(file_path)[0])
+        return serve_image_preview(file_path, cache_control=NETWORK_FILE_CACHE_CONTROL)
 
     elif file_type == 'pdf':
-        return send_file(file_path, mimetype='application/pdf')
+        return serve_file(file_path, mimetype='application/pdf')
 
     elif file_type == 'text':
-        return send_file(file_path, mimetype='text/plain')
+        return serve_file(file_path, mimetype='text/plain')
 
     elif file_type == 'video':
         mime = mimetypes.guess_type(file_path)[0] or 'video/mp4'
-        return _stream_video(file_path, mime)
+        return serve_file(file_path, mimetype=mime)
 
     else:
-        return jsonify({"msg": "Preview not available for this file type"}), 400
+        return make_response(jsonify({"msg": "Preview not available for this file type"}), 400)
 
 
 @app.route("/api/download/<path:filepath>", methods=["GET"])
@@ -1458,13 +4265,19 @@ def download_file(filepath):
         return jsonify({"msg": "File not found"}), 404
 
     logger.info(f"File downloaded: {username}/{filepath}")
-    return send_file(file_path, as_attachment=True, download_name=file_path.name)
+    return serve_file(file_path, as_attachment=True)
 
 
-@app.route("/api/network/download/<file_id>", methods=["GET"])
-def download_network_file(file_id):
-    """Download for shared files - requires login via token"""
-    token = request.args.get('token')
+@app.route("/api/download/archive", methods=["GET", "POST"])
+def download_archive():
+    """Download files and folders as one zip or tar, streamed as it is built.
+
+    Own files: `paths` (repeatable) relative to the user's home. A shared
+    folder: `folder_id`, optionally `subfolder` and `paths` inside it (the
+    whole folder when there are none). `format` is zip (default) or tar.
+    Takes `token` like /api/download; a form POST suits long selections.
+    """
+    token = request.values.get('token')
     if not token:
         return jsonify({"msg": "No token provided"}), 401
 
@@ -1475,25 +4288,103 @@ def download_network_file(file_id):
     except Exception:
         return jsonify({"msg": "Invalid token"}), 401
 
-    approved = shared_manager.get_approved()
+    fmt = request.values.get('format', 'zip').lower()
+    if fmt not in ARCHIVE_FORMATS:
+        return jsonify({"msg": "Format must be zip or tar"}), 400
+
+    folder_id = request.values.get('folder_id')
+    if folder_id:
+        folder_entry = shared_manager.get_approved_folder(folder_id)
+        if not folder_entry:
+            return jsonify({"msg": "Folder not found"}), 404
+        owner = folder_entry["username"]
+        base = STORAGE_DIR / owner / folder_entry["folder_path"]
+        subfolder = validate_path(owner, request.values.get('subfolder', '').strip())
+        root = base / subfolder if subfolder else base
+    else:
+        owner = username
+        base = root = STORAGE_DIR / username
+
+    paths = [p for p in (validate_path(owner, p) for p in request.values.getlist('paths')) if p]
+    if not paths:
+        if not folder_id:
+            return jsonify({"msg": "No files specified"}), 400
+        paths = [""]
+
+    items, names = [], set()
+    for rel in paths:
+        path = root / rel if rel else root
+        try:
+            path.resolve().relative_to(base.resolve())
+        except ValueError:
+            logger.warning(f"Path traversal attempt by {username}: {rel}")
+            return jsonify({"msg": "Access denied"}), 403
+        if not path.exists() or path.is_symlink():
+            return jsonify({"msg": f"Not found: {rel or path.name}"}), 404
+        stem, ext = (path.stem, path.suffix) if path.is_file() else (path.name, '')
+        arcname, counter = path.name, 1
+        while arcname in names:
+            arcname = f"{stem}_{counter}{ext}"
+            counter += 1
+        names.add(arcname)
+        items.append((path, arcname))
+
+    name = f"{items[0][1] if len(items) == 1 else 'files'}.{fmt}"
+    members = archive_members(items)
+    chunks = stream_zip(members) if fmt == "zip" else stream_tar(members)
+    response = app.response_class((c for c in chunks if c), mimetype=ARCHIVE_FORMATS[fmt],
+                                  direct_passthrough=True)
+    response.headers["Content-Disposition"] = attachment_disposition(name)
+    response.headers["Cache-Control"] = "no-store"
+    logger.info(f"Archive download ({fmt}) by {username}: {owner}/{', '.join(paths)}")
+    return response
+
 
-    file_entry = None
-    for entry in approved:
-        if entry["id"] == file_id:
-            file_entry = entry
-            break
+@app.route("/api/file/digest/<path:filepath>", methods=["GET"])
+@jwt_required()
+def file_digest(filepath):
+    """b2-1m content digest of a file, from the file index or hashed on demand."""
+    username = get_jwt_identity()
+    filepath = validate_path(username, filepath)
+    user_dir = STORAGE_DIR / username
+    file_path = user_dir / filepath
 
-    if not file_entry:
+    try:
+        file_path.resolve().relative_to(user_dir.resolve())
+    except ValueError:
+        return jsonify({"msg": "Access denied"}), 403
+
+    if not file_path.is_file():
         return jsonify({"msg": "File not found"}), 404
 
-    user_dir = STORAGE_DIR / file_entry["username"]
-    file_path = user_dir / file_entry["filepath"]
+    return jsonify({
+        "filepath": filepath,
+        "algorithm": DIGEST_ALGORITHM,
+        "digest": file_index.digest(username, filepath),
+        "size": file_path.stat().st_size
+    }), 200
 
-    if not file_path.exists():
+
+@app.route("/api/network/download/<file_id>", methods=["GET"])
+def download_network_file(file_id):
+    """Download for shared files - requires login via token"""
+    token = request.args.get('token')
+    if not token:
+        return jsonify({"msg": "No token provided"}), 401
+
+    try:
+        from flask_jwt_extended import decode_token
+        decoded = decode_token(token)
+        username = decoded['sub']
+    except Exception:
+        return jsonify({"msg": "Invalid token"}), 401
+
+    file_path = resolve_network_file(file_id)
+    if not file_path or not file_path.exists():
         return jsonify({"msg": "File not found"}), 404
 
     logger.info(f"Network file downloaded: {file_id} by {username}")
-    return send_file(file_path, as_attachment=True, download_name=file_path.name)
+    return serve_file(file_path, as_attachment=True, cache_control=NETWORK_FILE_CACHE_CONTROL)
 
 
 @app.route("/api/delete/<path:filepath>", methods=["DELETE"])
@@ -1514,17 +4405,13 @@ def delete_file(filepath):
         return jsonify({"msg": "File not found"}), 404
 
     try:
+        size = file_path.stat().st_size
         file_path.unlink()
-        user_manager.update_storage_used(username)
+        user_manager.adjust_storage_used(username, -size)
+        dir_stats.invalidate(username, os.path.dirname(filepath))
         # Remove from shared cache
-        approved = list(shared_manager.get_approved())
-        for entry in approved:
-            if entry["username"] == username and entry["filepath"] == filepath:
-                shared_manager.remove_share(entry["id"])
-        pending = list(shared_manager.get_pending())
-        for entry in pending:
-            if entry["username"] == username and entry["filepath"] == filepath:
-                shared_manager.reject_share(entry["id"])
+        shared_manager.remove_shares_bulk(e["id"] for e in shared_manager.find_shares("approved", username, filepath))
+        shared_manager.reject_shares_bulk(e["id"] for e in shared_manager.find_shares("pending", username, filepath))
         logger.info(f"File deleted: {username}/{filepath}")
         return jsonify({"msg": "File deleted"}), 200
     except Exception as e:
@@ -1532,6 +4419,47 @@ def delete_file(filepath):
         return jsonify({"msg": "Delete failed"}), 500
 
 
+def bulk_delete_job(username, filepaths, job):
+    user_dir = STORAGE_DIR / username
+    deleted = []
+    approved_ids = []
+    pending_ids = []
+    freed_bytes = 0
+
+    try:
+        for filepath in filepaths:
+            file_path = user_dir / filepath
+
+            try:
+                file_path.resolve().relative_to(user_dir.resolve())
+                if file_path.exists() and file_path.is_file():
+                    size = file_path.stat().st_size
+                    file_path.unlink()
+                    freed_bytes += size
+                    deleted.append(filepath)
+                    approved_ids += [e["id"] for e in shared_manager.find_shares("approved", username, filepath)]
+                    pending_ids += [e["id"] for e in shared_manager.find_shares("pending", username, filepath)]
+                    logger.info(f"Bulk delete: {username}/{filepath}")
+                else:
+                    job["errors"].append(filepath)
+            except Exception as e:
+                logger.error(f"Bulk delete error for {username}/{filepath}: {str(e)}")
+                job["errors"].append(filepath)
+            jobs.advance(job, 1)
+    finally:
+        # Remove from shared cache
+        shared_manager.remove_shares_bulk(approved_ids)
+        shared_manager.reject_shares_bulk(pending_ids)
+        user_manager.adjust_storage_used(username, -freed_bytes)
+        dir_stats.invalidate(username, *{os.path.dirname(p) for p in deleted})
+
+    msg = f"Deleted {len(deleted)} file(s)"
+    if job["errors"]:
+        msg += f". {len(job['errors'])} failed"
+
+    return {"msg": msg, "deleted": deleted}
+
+
 @app.route("/api/bulk/delete", methods=["POST"])
 @jwt_required()
 def bulk_delete_files():
@@ -1542,40 +4470,10 @@ def bulk_delete_files():
     if not filepaths:
         return jsonify({"msg": "No files specified"}), 400
 
-    user_dir = STORAGE_DIR / username
-    deleted = []
-    errors = []
-
-    for filepath in filepaths:
-        filepath = validate_path(username, filepath)
-        file_path = user_dir / filepath
-
-        try:
-            file_path.resolve().relative_to(user_dir.resolve())
-            if file_path.exists() and file_path.is_file():
-                file_path.unlink()
-                deleted.append(filepath)
-                # Remove from shared cache
-                for entry in list(shared_manager.get_approved()):
-                    if entry["username"] == username and entry["filepath"] == filepath:
-                        shared_manager.remove_share(entry["id"])
-                for entry in list(shared_manager.get_pending()):
-                    if entry["username"] == username and entry["filepath"] == filepath:
-                        shared_manager.reject_share(entry["id"])
-                logger.info(f"Bulk delete: {username}/{filepath}")
-            else:
-                errors.append(filepath)
-        except Exception as e:
-            logger.error(f"Bulk delete error for {username}/{filepath}: {str(e)}")
-            errors.append(filepath)
-
-    user_manager.update_storage_used(username)
-
-    msg = f"Deleted {len(deleted)} file(s)"
-    if errors:
-        msg += f". {len(errors)} failed"
-
-    return jsonify({"msg": msg, "deleted": deleted, "errors": errors}), 200
+    filepaths = [validate_path(username, p) for p in filepaths]
+    job = jobs.submit(username, "bulk_delete", lambda job: bulk_delete_job(username, filepaths, job),
+                      total=len(filepaths))
+    return jsonify({"msg": f"Deleting {len(filepaths)} file(s)", "job_id": job["id"]}), 202
 
 
 @app.route("/api/move", methods=["POST"])
@@ -1621,28 +4519,416 @@ def move_item():
     if dst_path.resolve() == src_path.resolve():
         return jsonify({"msg": "Already in that location"}), 400
 
-    # Avoid collision
-    if dst_path.exists():
-        base = src_path.stem if src_path.is_file() else src_path.name
-        ext  = src_path.suffix if src_path.is_file() else ''
-        counter = 1
-        while dst_path.exists():
-            dst_path = dst_dir / f"{base}_{counter}{ext}"
-            counter += 1
+    # Avoid collision
+    if dst_path.exists():
+        base = src_path.stem if src_path.is_file() else src_path.name
+        ext  = src_path.suffix if src_path.is_file() else ''
+        counter = 1
+        while dst_path.exists():
+            dst_path = dst_dir / f"{base}_{counter}{ext}"
+            counter += 1
+
+    try:
+        shutil.move(str(src_path), str(dst_path))
+        dir_stats.invalidate(username, os.path.dirname(src), dst_folder)
+        drop_shares_under(username, src)
+        logger.info(f"Move: {username}/{src} -> {dst_folder or '(root)'}")
+        return jsonify({"msg": "Moved", "new_path": str(dst_path.relative_to(user_dir))}), 200
+    except Exception as e:
+        logger.error(f"Move error: {e}")
+        return jsonify({"msg": f"Move failed: {str(e)}"}), 500
+
+
+def bulk_move_job(username, filepaths, destination, job):
+    user_dir = STORAGE_DIR / username
+    dest_dir = user_dir / destination if destination else user_dir
+    moved = []
+
+    try:
+        for filepath in filepaths:
+            file_path = user_dir / filepath
+
+            try:
+                file_path.resolve().relative_to(user_dir.resolve())
+                if file_path.exists() and file_path.is_file():
+                    dest_path = dest_dir / file_path.name
+
+                    if dest_path.exists():
+                        name, ext = os.path.splitext(file_path.name)
+                        counter = 1
+                        while dest_path.exists():
+                            dest_path = dest_dir / f"{name}_{counter}{ext}"
+                            counter += 1
+
+                    shutil.move(str(file_path), str(dest_path))
+                    moved.append(filepath)
+                    logger.info(f"Bulk move: {username}/{filepath} -> {destination}")
+                else:
+                    job["errors"].append(filepath)
+            except Exception as e:
+                logger.error(f"Bulk move error for {username}/{filepath}: {str(e)}")
+                job["errors"].append(filepath)
+            jobs.advance(job, 1)
+    finally:
+        if moved:
+            dir_stats.invalidate(username, destination, *{os.path.dirname(p) for p in moved})
+            drop_shares_under(username, *moved)
+
+    msg = f"Moved {len(moved)} file(s)"
+    if job["errors"]:
+        msg += f". {len(job['errors'])} failed"
+
+    return {"msg": msg, "moved": moved}
+
+
+@app.route("/api/bulk/move", methods=["POST"])
+@jwt_required()
+def bulk_move_files():
+    username = get_jwt_identity()
+    data = request.get_json()
+    filepaths = data.get('filepaths', [])
+    destination = data.get('destination', '').strip()
+
+    if not filepaths:
+        return jsonify({"msg": "No files specified"}), 400
+
+    destination = validate_path(username, destination)
+    user_dir = STORAGE_DIR / username
+    dest_dir = user_dir / destination if destination else user_dir
+
+    if not dest_dir.exists():
+        return jsonify({"msg": "Destination folder not found"}), 404
+
+    filepaths = [validate_path(username, p) for p in filepaths]
+    job = jobs.submit(username, "bulk_move", lambda job: bulk_move_job(username, filepaths, destination, job),
+                      total=len(filepaths))
+    return jsonify({"msg": f"Moving {len(filepaths)} file(s)", "job_id": job["id"]}), 202
+
+
+# ── Server-side copy ─────────────────────────────────────────────
+# Copies never leave the server: a reflink clone where the filesystem
+# supports it (btrfs/XFS), otherwise copy_range (copy_file_range/sendfile).
+# Bulk copies, and single copies over COPY_JOB_THRESHOLD bytes, run as jobs.
+
+COPY_INLINE_FILES = 500        # more files than this also go to a background job
+COPY_PROGRESS_STEP = 64 * 1024 * 1024
+
+
+def copy_file_fast(src, dst, progress=None):
+    """Copy a file's bytes and mtime to dst, which must not exist; returns the size.
+
+    progress(n) is called as bytes land; a reflink reports the whole file at once.
+    """
+    try:
+        reflink(src, dst)
+        size = os.stat(dst).st_size
+        if progress:
+            progress(size)
+    except FileExistsError:
+        raise
+    except OSError:
+        binary = getattr(os, "O_BINARY", 0)
+        src_fd = os.open(src, os.O_RDONLY | binary)
+        try:
+            size = os.fstat(src_fd).st_size
+            dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL | binary, 0o644)
+            try:
+                copied = 0
+                while copied < size:
+                    n = copy_range(src_fd, dst_fd, min(COPY_PROGRESS_STEP, size - copied), copied, copied)
+                    if not n:
+                        raise OSError(errno.EIO, f"Short copy of {src}")
+                    copied += n
+                    if progress:
+                        progress(n)
+            except BaseException:
+                os.close(dst_fd)
+                os.remove(dst)
+                raise
+            os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+    st = os.stat(src)
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+    return size
+
+
+def copy_stored_file(username, src_rel, dst_rel, progress=None):
+    """Copy one file inside a user's home, carrying its digest over to the copy.
+
+    With dedup on, a file whose blob exists is cloned from the blob instead.
+    """
+    user_dir = STORAGE_DIR / username
+    src, dst = user_dir / src_rel, user_dir / dst_rel
+    digest = file_index.lookup(username, src_rel)
+    if digest and dedup_store is not None and dedup_store.materialize(digest, dst):
+        size = dst.stat().st_size
+        if progress:
+            progress(size)
+    else:
+        size = copy_file_fast(src, dst, progress)
+    if digest:
+        file_index.record(username, dst_rel, digest)
+    return size
+
+
+def copy_tree_files(src, max_files=None, max_bytes=None):
+    """(folders, files, size) under src, paths relative to it, from one walk.
+
+    Symlinks and special files are left out; parents come before their
+    subfolders. Returns None as soon as the tree holds more than max_files
+    files or max_bytes bytes, so a request can hand big trees to a job
+    without walking them in full.
+    """
+    folders, files, size = [], [], 0
+    stack = [""]
+    while stack:
+        rel = stack.pop()
+        with os.scandir(os.path.join(src, rel)) as it:
+            for entry in it:
+                path = os.path.join(rel, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(path)
+                    stack.append(path)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append(path)
+                    size += entry.stat(follow_symlinks=False).st_size
+                    if ((max_files is not None and len(files) > max_files)
+                            or (max_bytes is not None and size > max_bytes)):
+                        return None
+    return folders, files, size
+
+
+def plan_copies(username, sources, dst_folder):
+    """Validate copy sources and pick free destination names.
+
+    Returns (plan, errors); each plan entry is a dict with src, dst, is_dir
+    and, for files, size. Folder sources get their folders, files and size
+    from scan_copies(). Sources that are missing, outside the user's home or
+    a folder being copied into itself end up in errors as (path, reason).
+    """
+    user_dir = STORAGE_DIR / username
+    dst_dir = user_dir / dst_folder if dst_folder else user_dir
+    plan, errors, taken = [], [], set()
+    for src in sources:
+        src = validate_path(username, src)
+        src_path = user_dir / src
+        try:
+            src_path.resolve().relative_to(user_dir.resolve())
+        except ValueError:
+            errors.append((src, "Access denied"))
+            continue
+        if not src or not src_path.exists() or src_path.is_symlink():
+            errors.append((src, "Source not found"))
+            continue
+        if src_path.is_dir():
+            try:
+                dst_dir.resolve().relative_to(src_path.resolve())
+                errors.append((src, "Cannot copy a folder into itself"))
+                continue
+            except ValueError:
+                pass
+
+        # Same collision naming as /api/move, also avoiding names used earlier in this batch
+        base = src_path.stem if src_path.is_file() else src_path.name
+        ext = src_path.suffix if src_path.is_file() else ''
+        dst_path, counter = dst_dir / src_path.name, 1
+        while dst_path.exists() or dst_path.name in taken:
+            dst_path = dst_dir / f"{base}_{counter}{ext}"
+            counter += 1
+        taken.add(dst_path.name)
+
+        is_dir = src_path.is_dir()
+        plan.append({"src": src, "dst": str(dst_path.relative_to(user_dir)), "is_dir": is_dir,
+                     "folders": None, "files": None, "size": None if is_dir else src_path.stat().st_size})
+    return plan, errors
+
+
+def scan_copies(username, plan, errors, max_files=None, max_bytes=None):
+    """Walk a plan's folder sources once each, filling in folders, files and size.
+
+    Folders that can't be read are dropped from the plan and added to errors.
+    Returns False, leaving the rest unscanned, once the plan adds up to more
+    than max_files files or max_bytes bytes; True when all is scanned.
+    """
+    user_dir = STORAGE_DIR / username
+    files, size = copy_totals(item for item in plan if not item["is_dir"] or item["files"] is not None)
+    for item in list(plan):
+        if not item["is_dir"] or item["files"] is not None:
+            continue
+        try:
+            tree = copy_tree_files(
+                user_dir / item["src"],
+                None if max_files is None else max_files - files,
+                None if max_bytes is None else max_bytes - size)
+        except OSError as e:
+            logger.error(f"Copy error for {username}/{item['src']}: {e}")
+            errors.append(item["src"])
+            plan.remove(item)
+            continue
+        if tree is None:
+            return False
+        item["folders"], item["files"], item["size"] = tree
+        files += len(item["files"])
+        size += item["size"]
+    return True
+
+
+def run_copies(username, plan, errors, job=None):
+    """Carry out plan_copies() entries; returns [{"src", "new_path"}] of those copied.
+
+    Sources that fail are added to errors and their partial copy removed.
+    As a job, progress goes through jobs.advance() and a cancel stops after
+    cleaning up the item in progress. Storage usage grows by the bytes of
+    the copies that completed.
+    """
+    user_dir = STORAGE_DIR / username
+
+    def progress(n):
+        if job is not None:
+            jobs.advance(job, 0, n)
+
+    def file_done():
+        if job is not None:
+            jobs.advance(job, 1)
+
+    copied, added = [], 0
+    try:
+        for item in plan:
+            dst_path = user_dir / item["dst"]
+            size = 0
+            try:
+                if not item["is_dir"]:
+                    size += copy_stored_file(username, item["src"], item["dst"], progress)
+                    file_done()
+                else:
+                    dst_path.mkdir()
+                    for folder in item["folders"]:
+                        (dst_path / folder).mkdir(exist_ok=True)
+                    for rel in item["files"]:
+                        size += copy_stored_file(username, os.path.join(item["src"], rel),
+                                                 os.path.join(item["dst"], rel), progress)
+                        file_done()
+            except Exception as e:
+                try:
+                    if dst_path.is_dir():
+                        shutil.rmtree(dst_path)
+                    elif dst_path.exists():
+                        dst_path.unlink()
+                except OSError:
+                    pass
+                if isinstance(e, JobCancelled):
+                    raise
+                logger.error(f"Copy error for {username}/{item['src']}: {e}")
+                errors.append(item["src"])
+                continue
+            added += size
+            copied.append({"src": item["src"], "new_path": item["dst"]})
+            logger.info(f"Copy: {username}/{item['src']} -> {item['dst']}")
+    finally:
+        user_manager.adjust_storage_used(username, added)
+        if copied:
+            dir_stats.invalidate(username, *{os.path.dirname(c["new_path"]) for c in copied})
+    return copied
+
+
+COPY_NO_SPACE = "Not enough free space for this copy"
+
+
+def copy_fits(plan):
+    """Whether a scanned plan's copies fit on the disk.
+
+    Reflinks and dedup clones take no space up front, but there's no telling
+    in advance whether they'll be possible, so the full size is asked for.
+    """
+    try:
+        free = shutil.disk_usage(STORAGE_DIR).free
+    except OSError:
+        return True
+    return sum(item["size"] for item in plan) <= free
+
+
+def copy_totals(plan):
+    """(files, bytes) a scanned plan will copy."""
+    files = total = 0
+    for item in plan:
+        files += len(item["files"]) if item["is_dir"] else 1
+        total += item["size"]
+    return files, total
+
+
+def copy_summary(copied, errors):
+    msg = f"Copied {len(copied)} item(s)"
+    if errors:
+        msg += f". {len(errors)} failed"
+    return {"msg": msg, "copied": [c["src"] for c in copied],
+            "new_paths": [c["new_path"] for c in copied], "errors": errors}
+
+
+def submit_copy_job(username, plan, errors):
+    """Run a plan as a job; folder sources are walked and sized in the worker."""
+    def run(job):
+        job["errors"] += errors
+        scan_copies(username, plan, job["errors"])
+        if not copy_fits(plan):
+            raise OSError(COPY_NO_SPACE)
+        job["total"], job["total_bytes"] = copy_totals(plan)
+        return copy_summary(run_copies(username, plan, job["errors"], job), job["errors"])
+
+    job = jobs.submit(username, "copy", run)
+    return jsonify({"msg": "Copy started", "job_id": job["id"]}), 202
+
+
+@app.route("/api/copy", methods=["POST"])
+@jwt_required()
+def copy_item():
+    """Copy a single file or folder into a destination folder."""
+    username = get_jwt_identity()
+    data = request.get_json()
+    src = (data.get('src') or '').strip()
+    dst_folder = (data.get('dst_folder') or '').strip()
+
+    if not src:
+        return jsonify({"msg": "Source path required"}), 400
 
+    dst_folder = validate_path(username, dst_folder) if dst_folder else ''
+    user_dir = STORAGE_DIR / username
+    dst_dir = user_dir / dst_folder if dst_folder else user_dir
     try:
-        shutil.move(str(src_path), str(dst_path))
-        user_manager.update_storage_used(username)
-        logger.info(f"Move: {username}/{src} -> {dst_folder or '(root)'}")
-        return jsonify({"msg": "Moved", "new_path": str(dst_path.relative_to(user_dir))}), 200
-    except Exception as e:
-        logger.error(f"Move error: {e}")
-        return jsonify({"msg": f"Move failed: {str(e)}"}), 500
-
+        dst_dir.resolve().relative_to(user_dir.resolve())
+    except ValueError:
+        return jsonify({"msg": "Access denied"}), 403
+    if not dst_dir.is_dir():
+        return jsonify({"msg": "Destination folder not found"}), 404
 
-@app.route("/api/bulk/move", methods=["POST"])
+    plan, errors = plan_copies(username, [src], dst_folder)
+    if errors:
+        reason = errors[0][1]
+        status = {"Access denied": 403, "Source not found": 404}.get(reason, 400)
+        return jsonify({"msg": reason}), status
+
+    # Folders are walked here only up to the inline limits; bigger ones are
+    # walked and sized by the job
+    failed = []
+    if not scan_copies(username, plan, failed, COPY_INLINE_FILES, COPY_JOB_THRESHOLD):
+        return submit_copy_job(username, plan, [])
+    if failed:
+        return jsonify({"msg": "Copy failed"}), 500
+    if not copy_fits(plan):
+        return jsonify({"msg": COPY_NO_SPACE}), 507
+    files, total = copy_totals(plan)
+    if total > COPY_JOB_THRESHOLD:
+        return submit_copy_job(username, plan, [])
+
+    copied = run_copies(username, plan, failed)
+    if failed:
+        return jsonify({"msg": "Copy failed"}), 500
+    return jsonify({"msg": "Copied", "new_path": copied[0]["new_path"]}), 200
+
+
+@app.route("/api/bulk/copy", methods=["POST"])
 @jwt_required()
-def bulk_move_files():
+def bulk_copy_files():
     username = get_jwt_identity()
     data = request.get_json()
     filepaths = data.get('filepaths', [])
@@ -1654,43 +4940,44 @@ def bulk_move_files():
     destination = validate_path(username, destination)
     user_dir = STORAGE_DIR / username
     dest_dir = user_dir / destination if destination else user_dir
+    try:
+        dest_dir.resolve().relative_to(user_dir.resolve())
+    except ValueError:
+        return jsonify({"msg": "Access denied"}), 403
 
-    if not dest_dir.exists():
+    if not dest_dir.is_dir():
         return jsonify({"msg": "Destination folder not found"}), 404
 
-    moved = []
-    errors = []
+    plan, errors = plan_copies(username, filepaths, destination)
+    return submit_copy_job(username, plan, [src for src, _ in errors])
 
-    for filepath in filepaths:
-        filepath = validate_path(username, filepath)
-        file_path = user_dir / filepath
 
-        try:
-            file_path.resolve().relative_to(user_dir.resolve())
-            if file_path.exists() and file_path.is_file():
-                dest_path = dest_dir / file_path.name
-
-                if dest_path.exists():
-                    name, ext = os.path.splitext(file_path.name)
-                    counter = 1
-                    while dest_path.exists():
-                        dest_path = dest_dir / f"{name}_{counter}{ext}"
-                        counter += 1
-
-                shutil.move(str(file_path), str(dest_path))
-                moved.append(filepath)
-                logger.info(f"Bulk move: {username}/{filepath} -> {destination}")
-            else:
-                errors.append(filepath)
-        except Exception as e:
-            logger.error(f"Bulk move error for {username}/{filepath}: {str(e)}")
-            errors.append(filepath)
+# ── Background jobs ──────────────────────────────────────────────
 
-    msg = f"Moved {len(moved)} file(s)"
-    if errors:
-        msg += f". {len(errors)} failed"
+@app.route("/api/jobs", methods=["GET"])
+@jwt_required()
+def list_jobs():
+    return jsonify({"jobs": jobs.list(get_jwt_identity())}), 200
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+@jwt_required()
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if not job or job["owner"] != get_jwt_identity():
+        return jsonify({"msg": "Unknown ID"}), 404
+    return jsonify(job), 200
 
-    return jsonify({"msg": msg, "moved": moved, "errors": errors}), 200
+
+@app.route("/api/jobs/<job_id>/cancel", methods=["POST"])
+@jwt_required()
+def cancel_job(job_id):
+    job = jobs.get(job_id)
+    if not job or job["owner"] != get_jwt_identity():
+        return jsonify({"msg": "Unknown ID"}), 404
+    if not jobs.cancel(job_id):
+        return jsonify({"msg": f"Job already {job['status']}"}), 409
+    return jsonify({"msg": "Cancelling"}), 200
 
 
 @app.route("/api/bulk/share", methods=["POST"])
@@ -1707,6 +4994,7 @@ def bulk_share_files():
     user_dir = STORAGE_DIR / username
     shared = []
     errors = []
+    entries = []
 
     for filepath in filepaths:
         filepath = validate_path(username, filepath)
@@ -1716,17 +5004,8 @@ def bulk_share_files():
             file_path.resolve().relative_to(user_dir.resolve())
             if file_path.exists() and file_path.is_file():
                 stat = file_path.stat()
-                file_id = shared_manager.request_share(
-                    username,
-                    filepath,
-                    file_path.name,
-                    stat.st_size,
-                    get_file_type(file_path.name)
-                )
-
-                if should_auto_approve(user):
-                    shared_manager.approve_share(file_id)
-
+                entries.append((username, filepath, file_path.name,
+                                stat.st_size, get_file_type(file_path.name)))
                 shared.append(filepath)
                 logger.info(f"Bulk share: {username}/{filepath}")
             else:
@@ -1735,6 +5014,8 @@ def bulk_share_files():
             logger.error(f"Bulk share error for {username}/{filepath}: {str(e)}")
             errors.append(filepath)
 
+    shared_manager.request_shares_bulk(entries, auto_approve=should_auto_approve(user))
+
     msg = f"Shared {len(shared)} file(s)"
     if errors:
         msg += f". {len(errors)} failed"
@@ -1986,6 +5267,8 @@ def delete_user(target_username):
     success, msg = user_manager.delete_user(target_username)
 
     if success:
+        dir_stats.forget(target_username)
+        file_index.forget(target_username)
         logger.info(f"User deleted by {username}: {target_username}")
         return jsonify({"msg": msg}), 200
     return jsonify({"msg": msg}), 400
@@ -2031,6 +5314,30 @@ def set_auto_share(target_username):
     return jsonify({"msg": msg}), 400
 
 
+@app.route("/api/admin/metrics", methods=["GET"])
+@jwt_required()
+def admin_metrics():
+    """Server-side counters (persistence, file index, ...) — admin only."""
+    username = get_jwt_identity()
+    user = user_manager.get_user(username)
+
+    if user["role"] != "admin":
+        return jsonify({"msg": "Admin access required"}), 403
+
+    dedup = None
+    if dedup_store is not None:
+        # Logical vs physical bytes need a full walk; it is refreshed with each storage reconcile
+        dedup = dict(dedup_store.usage_cache or dedup_store.usage(), saved_on_upload=dedup_store.saved)
+
+    return jsonify({
+        "persistence": storage_backend.metrics(),
+        "file_index": file_index.metrics(),
+        "dedup": dedup,
+        "jobs": jobs.metrics(),
+        "renditions": renditions.metrics()
+    }), 200
+
+
 @app.route("/api/account/change-password", methods=["POST"])
 @jwt_required()
 def change_password():
@@ -2048,8 +5355,7 @@ def change_password():
     if len(new_password) < 6:
         return jsonify({"msg": "New password must be at least 6 characters"}), 400
 
-    user_manager.users[username]["password_hash"] = bcrypt.hashpw(new_password.encode(), bcrypt.gensalt()).decode()
-    user_manager.save_users()
+    user_manager.set_password(username, new_password)
 
     logger.info(f"Password changed for user: {username}")
     return jsonify({"msg": "Password changed successfully"}), 200
@@ -2069,39 +5375,24 @@ def change_username():
     if not validate_username(new_username):
         return jsonify({"msg": "Invalid username format"}), 400
 
-    if new_username in user_manager.users:
+    if user_manager.user_exists(new_username):
         return jsonify({"msg": "Username already exists"}), 400
 
     if not user_manager.authenticate(old_username, password):
         return jsonify({"msg": "Password incorrect"}), 401
 
-    user_data = user_manager.users[old_username]
-    del user_manager.users[old_username]
-    user_manager.users[new_username] = user_data
-    user_manager.save_users()
+    ok, msg = user_manager.rename_user(old_username, new_username)
+    if not ok:
+        return jsonify({"msg": msg}), 400
 
     old_dir = STORAGE_DIR / old_username
     new_dir = STORAGE_DIR / new_username
     if old_dir.exists():
         old_dir.rename(new_dir)
 
-    for entry in shared_manager.shared_files.get("pending", []):
-        if entry["username"] == old_username:
-            entry["username"] = new_username
-
-    for entry in shared_manager.shared_files.get("approved", []):
-        if entry["username"] == old_username:
-            entry["username"] = new_username
-
-    for entry in shared_manager.shared_files.get("pending_folders", []):
-        if entry["username"] == old_username:
-            entry["username"] = new_username
-
-    for entry in shared_manager.shared_files.get("folders", []):
-        if entry["username"] == old_username:
-            entry["username"] = new_username
-
-    shared_manager.save_shared_files()
+    shared_manager.rename_user(old_username, new_username)
+    dir_stats.forget(old_username)
+    file_index.rename_user(old_username, new_username)
 
     new_token = create_access_token(identity=new_username)
 
@@ -2113,44 +5404,650 @@ def change_username():
     }), 200
 
 
-@app.route("/api/upload/chunk", methods=["POST"])
-@jwt_required()
-def upload_chunk():
-    username = get_jwt_identity()
-    user = user_manager.get_user(username)
+# ==================== CHUNKED UPLOADS ====================
+# Every chunked upload lives in tmp_uploads/<upload_id>/:
+#   data      the target file, preallocated (sparse) to its final size; each
+#             chunk is written straight to its own offset
+#   manifest  owner, destination and geometry of the upload (JSON)
+#   received  one bit per chunk, set once that chunk is fully on disk
+#   blocks    b2-1m block digests (see CONTENT DIGESTS), 32 bytes per 1 MiB
+#             block at its own offset; only for uploads being hashed
+# When the last bit is set `data` is renamed into place, so every byte is
+# written exactly once and chunks may arrive in any order. The manifest is
+# written last on creation, so an upload without one does not exist yet.
+#
+# Clients may send the chunks of one file over several connections at once.
+# Chunk data is written outside any lock (chunks never overlap); creating
+# the upload, setting bits and finalizing happen under upload_lock(), so
+# exactly one request sees the last bit go in and moves the file. That
+# request then rewrites the manifest with the final path, leaving a
+# tombstone that answers late duplicates and status polls.
+
+CHUNK_UPLOAD_DIR = BASE_DIR / "tmp_uploads"
+UPLOAD_ID_RE     = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+MAX_UPLOAD_CHUNKS = 1_000_000
+COPY_BUFFER_SIZE = 1024 * 1024
+
+_upload_locks = {}  # upload_id -> [threading.Lock, number of holders and waiters]
+_upload_locks_guard = threading.Lock()
+
+
+@contextmanager
+def upload_lock(upload_id):
+    """Serialize bookkeeping for one upload across threads (and workers in SHARED_STATE mode)."""
+    with _upload_locks_guard:
+        entry = _upload_locks.setdefault(upload_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            if SHARED_STATE:
+                CHUNK_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+                with process_lock(CHUNK_UPLOAD_DIR / f".{upload_id}.lock"):
+                    yield
+            else:
+                yield
+    finally:
+        with _upload_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _upload_locks[upload_id]
+
+
+def _write_at(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        if hasattr(os, "pwrite"):
+            n = os.pwrite(fd, view, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            n = os.write(fd, view)
+        view = view[n:]
+        offset += n
 
-    upload_id    = request.form.get("upload_id", "").strip()
-    filename     = request.form.get("filename", "").strip()
-    chunk_index  = int(request.form.get("chunk_index", 0))
-    total_chunks = int(request.form.get("total_chunks", 1))
-    folder_path  = validate_path(username, request.form.get("folder", "").strip())
 
-    if not upload_id or not filename:
-        return jsonify({"msg": "Missing upload_id or filename"}), 400
+def copy_range(src_fd, dst_fd, count, src_offset=0, dst_offset=0):
+    """Copy count bytes between two file descriptors at explicit offsets.
 
-    if not allowed_file(filename):
-        return jsonify({"msg": f"File type not allowed: {filename}"}), 400
+    Tries copy_file_range (in-kernel, reflinks on btrfs/XFS), then sendfile,
+    then a plain buffered loop. Returns the number of bytes copied.
+    """
+    copied = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < count:
+                n = os.copy_file_range(src_fd, dst_fd, count - copied,
+                                       src_offset + copied, dst_offset + copied)
+                if not n:
+                    break
+                copied += n
+            return copied
+        except OSError as e:
+            if copied or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                         errno.EOPNOTSUPP, errno.EPERM):
+                raise
+    if hasattr(os, "sendfile"):
+        try:
+            os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+            while copied < count:
+                n = os.sendfile(dst_fd, src_fd, src_offset + copied, count - copied)
+                if not n:
+                    break
+                copied += n
+            return copied
+        except OSError as e:
+            if copied or e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK,
+                                         errno.EOPNOTSUPP):
+                raise
+    while copied < count:
+        os.lseek(src_fd, src_offset + copied, os.SEEK_SET)
+        block = os.read(src_fd, min(COPY_BUFFER_SIZE, count - copied))
+        if not block:
+            break
+        _write_at(dst_fd, block, dst_offset + copied)
+        copied += len(block)
+    return copied
+
+
+def _stream_fileno(stream):
+    """File descriptor behind an uploaded file's stream, if it is on disk.
+
+    Werkzeug keeps small parts in memory and spools larger ones to a temp
+    file; only the latter can be handed to copy_range. Asking a spooled file
+    that is still in memory for fileno() would force it to disk, so don't.
+    """
+    if isinstance(stream, tempfile.SpooledTemporaryFile):
+        if not getattr(stream, "_rolled", False):
+            return None
+        stream = stream._file
+    try:
+        return stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
 
-    chunk_file = request.files.get("file")
-    if not chunk_file:
-        return jsonify({"msg": "No chunk data"}), 400
 
-    tmp_dir = BASE_DIR / "tmp_uploads" / upload_id
-    tmp_dir.mkdir(parents=True, exist_ok=True)
+def stream_length(stream):
+    pos = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(pos)
+    return size
 
-    chunk_path = tmp_dir / f"chunk_{chunk_index:06d}"
-    chunk_file.save(str(chunk_path))
 
-    received = len(list(tmp_dir.glob("chunk_*")))
-    if received < total_chunks:
-        return jsonify({
-            "msg": f"Chunk {chunk_index + 1}/{total_chunks} received",
-            "done": False
-        }), 200
+def write_stream_at(stream, fd, offset, length, hasher=None):
+    """Write the first `length` bytes of a file stream (or request body) to fd at offset.
+
+    With a hasher the bytes have to pass through Python anyway, so they are
+    hashed on their way to disk instead of being copied in the kernel.
+    """
+    src_fd = _stream_fileno(stream) if hasher is None else None
+    if src_fd is not None:
+        return copy_range(src_fd, fd, length, 0, offset)
+    if stream.seekable():
+        stream.seek(0)
+    written = 0
+    while written < length:
+        block = stream.read(min(COPY_BUFFER_SIZE, length - written))
+        if not block:
+            break
+        if hasher is not None:
+            hasher.update(block)
+        _write_at(fd, block, offset + written)
+        written += len(block)
+    return written
+
+
+def move_file(src, dst):
+    """Rename src to dst, copying in-kernel when they are on different filesystems."""
+    try:
+        os.replace(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    binary = getattr(os, "O_BINARY", 0)
+    src_fd = os.open(src, os.O_RDONLY | binary)
+    try:
+        size = os.fstat(src_fd).st_size
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | binary, 0o644)
+        try:
+            if copy_range(src_fd, dst_fd, size) != size:
+                raise OSError(errno.EIO, f"Short copy moving {src}")
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    os.remove(src)
+
+
+# ── Streaming uploads ────────────────────────────────────────────
+# Werkzeug spools every multipart file part to its own temp file, which
+# file.save() then copies into nas_storage. Upload routes instead hand the
+# form parser UploadSpool files inside tmp_uploads (same filesystem as
+# nas_storage), hashed as they are written and renamed into place, so each
+# byte is written once. Raw (application/octet-stream) bodies skip the
+# multipart parser altogether.
+#
+# Each request first reserves its declared Content-Length against
+# NAS_UPLOAD_BUDGET_MB (see UploadReservation); its spools are named after the
+# reservation so list_chunked_uploads can count the declared size while they live.
+
+class UploadSpool:
+    """File in tmp_uploads that one uploaded file is streamed into."""
+
+    def __init__(self, name):
+        CHUNK_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+        self.name = str(CHUNK_UPLOAD_DIR / name)
+        fd = os.open(self.name, os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+        self._file = os.fdopen(fd, "w+b")
+        self.hasher = ContentHasher() if UPLOAD_DIGESTS else None
+
+    def write(self, data):
+        if self.hasher is not None:
+            self.hasher.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def copy_from(self, stream):
+        for block in iter(lambda: stream.read(COPY_BUFFER_SIZE), b""):
+            self.write(block)
+
+    def save_as(self, target_path):
+        """Move the spooled file to target_path; returns its digest (None if not hashed)."""
+        self._file.close()
+        move_file(self.name, target_path)
+        return self.hasher.hexdigest() if self.hasher is not None else None
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self.name)
+        except FileNotFoundError:
+            pass
+
+
+class UploadReservation:
+    """Upload budget held by one streaming request: tmp_uploads/stream-<token>.size.
+
+    The file holds the declared byte count and the request's spools are
+    stream-<token>.<n>, so the whole group counts at the declared size until
+    release(). Create one with reserve_upload().
+    """
+
+    def __init__(self, size):
+        CHUNK_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+        self.upload_id = f"stream-{secrets.token_hex(8)}"
+        self.size = size
+        self._spools = 0
+        self._path = CHUNK_UPLOAD_DIR / f"{self.upload_id}.size"
+        with open(self._path, "x") as f:
+            f.write(str(size))
+        upload_ledger.add(size)
+
+    def spool(self):
+        self._spools += 1
+        return UploadSpool(f"{self.upload_id}.{self._spools}")
+
+    def release(self):
+        with upload_lock(UPLOAD_BUDGET_LOCK):
+            try:
+                os.remove(self._path)
+            except FileNotFoundError:
+                return   # the janitor got here first
+            upload_ledger.add(-self.size)
+
+
+def reserve_upload(incoming_bytes):
+    """(UploadReservation, None), or (None, 507 response) if the budget can't hold incoming_bytes.
+
+    The check and the reservation happen under the budget lock, so concurrent
+    requests can't both squeeze into the same free space. Hold the lock when
+    creating an UploadReservation directly.
+    """
+    with upload_lock(UPLOAD_BUDGET_LOCK):
+        refused = upload_budget_error(incoming_bytes)
+        if refused:
+            return None, refused
+        return UploadReservation(incoming_bytes), None
+
+
+def parse_upload_form(reservation):
+    """(form, files) for the current multipart request, files streamed into the reservation's spools.
+
+    Callers must discard() the spools they don't save_as().
+    """
+    parser = request.make_form_data_parser()
+    parser.stream_factory = lambda *args, **kwargs: reservation.spool()
+    _, form, files = parser.parse(request.stream, request.mimetype, request.content_length,
+                                  request.mimetype_params)
+    return form, files
+
+
+def upload_budget_error(incoming_bytes):
+    """507 response if incoming_bytes more would exceed NAS_UPLOAD_BUDGET_MB, else None."""
+    if not UPLOAD_BUDGET:
+        return None
+    inflight = upload_ledger.total()
+    if inflight + incoming_bytes <= UPLOAD_BUDGET:
+        return None
+    logger.warning(f"Upload space exhausted, refusing {incoming_bytes} more bytes")
+    return jsonify({
+        "msg": "Upload space is full: too many unfinished uploads. "
+               "Try again when other uploads have finished.",
+        "budget_bytes": UPLOAD_BUDGET,
+        "inflight_bytes": inflight
+    }), 507
+
+
+class ChunkedUpload:
+    """On-disk state of one chunked upload (see the section comment)."""
+
+    def __init__(self, upload_id, manifest=None):
+        self.upload_id = upload_id
+        self.dir = CHUNK_UPLOAD_DIR / upload_id
+        self.data_path = self.dir / "data"
+        self.manifest_path = self.dir / "manifest"
+        self.bitmap_path = self.dir / "received"
+        self.blocks_path = self.dir / "blocks"
+        self.manifest = manifest
+
+    @classmethod
+    def load(cls, upload_id):
+        """The upload with this id, or None if it does not exist (yet)."""
+        if not UPLOAD_ID_RE.match(upload_id or ""):
+            return None
+        upload = cls(upload_id)
+        try:
+            with open(upload.manifest_path, "r", encoding="utf-8") as f:
+                upload.manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return upload
+
+    @classmethod
+    def create(cls, upload_id, manifest):
+        upload = cls(upload_id, manifest)
+        upload.dir.mkdir(parents=True, exist_ok=True)
+        with open(upload.data_path, "wb") as f:
+            f.truncate(manifest["total_size"])
+        with open(upload.bitmap_path, "wb") as f:
+            f.write(bytes((manifest["total_chunks"] + 7) // 8))
+        if manifest["digests"]:
+            with open(upload.blocks_path, "wb") as f:
+                f.truncate(-(-manifest["total_size"] // HASH_BLOCK_SIZE) * DIGEST_SIZE)
+        atomic_write_json(upload.manifest_path, manifest)
+        return upload
+
+    @property
+    def completed(self):
+        """Final path relative to the owner's folder once the upload is finished."""
+        return self.manifest.get("completed")
+
+    def complete(self, rel):
+        self.manifest = dict(self.manifest, completed=rel)
+        with upload_lock(UPLOAD_BUDGET_LOCK):
+            atomic_write_json(self.manifest_path, self.manifest)
+            upload_ledger.add(-self.manifest["total_size"])
+        for path in (self.data_path, self.blocks_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def chunk_span(self, index):
+        """(offset, length) of chunk `index` within the file."""
+        chunk_size = self.manifest["chunk_size"]
+        offset = index * chunk_size
+        return offset, max(0, min(chunk_size, self.manifest["total_size"] - offset))
+
+    def write_chunk(self, index, stream, hash_chunk=False):
+        """Write chunk `index` at its offset; returns its digest if it was hashed.
+
+        Uploads created with digests on always hash, and store the chunk's
+        block digests for the file digest computed at the end.
+        """
+        offset, length = self.chunk_span(index)
+        hasher = ContentHasher() if hash_chunk or self.manifest["digests"] else None
+        fd = os.open(self.data_path, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+        try:
+            if FCNTL_AVAILABLE:
+                # Shared with other chunk writers, exclusive with writers_excluded().
+                # If the upload was finished meanwhile, fd may now be the user's file.
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                st, current = os.fstat(fd), os.stat(self.data_path)
+                if (st.st_dev, st.st_ino) != (current.st_dev, current.st_ino):
+                    raise OSError(errno.ESTALE, "Upload was finished by another request")
+            written = write_stream_at(stream, fd, offset, length, hasher)
+        finally:
+            os.close(fd)   # also drops the flock
+        if written != length:
+            raise OSError(errno.EIO, f"Short write for chunk {index}")
+        if hasher is None:
+            return None
+        if self.manifest["digests"]:
+            with open(self.blocks_path, "r+b") as f:
+                f.seek(offset // HASH_BLOCK_SIZE * DIGEST_SIZE)
+                f.write(b"".join(hasher.block_digests()))
+        return hasher.hexdigest()
+
+    @contextmanager
+    def writers_excluded(self):
+        """Wait for chunk writes in flight and keep new ones out, to move the data file away.
+
+        Held across threads and worker processes through flock(); a no-op where
+        fcntl is unavailable, like process_lock().
+        """
+        if not FCNTL_AVAILABLE:
+            yield
+            return
+        with open(self.data_path, "rb") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            yield
+
+    def file_digest(self):
+        """Digest of the whole upload from the stored block digests."""
+        with open(self.blocks_path, "rb") as f:
+            blocks = f.read()
+        return combine_digests(blocks[i:i + DIGEST_SIZE] for i in range(0, len(blocks), DIGEST_SIZE))
+
+    def mark_received(self, index):
+        """Set chunk `index`'s bit; call under upload_lock()."""
+        with open(self.bitmap_path, "r+b") as f:
+            f.seek(index // 8)
+            byte = f.read(1)[0] | (1 << (index % 8))
+            f.seek(index // 8)
+            f.write(bytes((byte,)))
+
+    def bitmap(self):
+        with open(self.bitmap_path, "rb") as f:
+            return f.read()
+
+    def received_count(self):
+        return bin(int.from_bytes(self.bitmap(), "big")).count("1")
+
+    def missing(self):
+        bits = self.bitmap()
+        return [i for i in range(self.manifest["total_chunks"])
+                if not bits[i // 8] & (1 << (i % 8))]
+
+    def status(self):
+        missing = self.missing()
+        return {
+            "upload_id":    self.upload_id,
+            "filename":     self.manifest["filename"],
+            "total_size":   self.manifest["total_size"],
+            "chunk_size":   self.manifest["chunk_size"],
+            "total_chunks": self.manifest["total_chunks"],
+            "received":     self.manifest["total_chunks"] - len(missing),
+            "missing":      missing,
+            "done":         self.completed is not None,
+            "filepath":     self.completed,
+        }
+
+    def discard(self):
+        """Delete the upload, handing its reservation back if it was unfinished."""
+        with upload_lock(UPLOAD_BUDGET_LOCK):
+            # Without its manifest the directory no longer counts as reserved
+            current = ChunkedUpload.load(self.upload_id)
+            try:
+                os.remove(self.manifest_path)
+            except FileNotFoundError:
+                pass
+            if current is not None and current.completed is None:
+                upload_ledger.add(-current.manifest["total_size"])
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+# Not a valid upload id, so it can't collide with one
+UPLOAD_BUDGET_LOCK = ".budget"
+# Finished uploads only answer late duplicates; they don't need the full TTL
+UPLOAD_TOMBSTONE_TTL = min(UPLOAD_TTL, 3600)
+
+
+def _disk_bytes(path):
+    """Bytes a file actually occupies (the data file is sparse until filled)."""
+    st = os.stat(path)
+    return st.st_blocks * 512 if hasattr(st, "st_blocks") else st.st_size
+
+
+def list_chunked_uploads():
+    """Every upload under tmp_uploads with its owner, size, progress and idle time.
+
+    Chunked uploads are directories; streaming uploads in progress are
+    loose stream-<token>.* files (see UploadReservation), listed at their
+    declared size while the reservation is held and at their size on disk once
+    only orphaned spools are left.
+    """
+    uploads = []
+    try:
+        entries = list(os.scandir(CHUNK_UPLOAD_DIR))
+    except FileNotFoundError:
+        return uploads
+    now = time.time()
+    streams = {}   # reservation id -> [declared size or None, bytes spooled, last write]
+    for entry in entries:
+        if entry.name.startswith("stream-") and entry.is_file(follow_symlinks=False):
+            upload_id, _, part = entry.name.partition(".")
+            stream = streams.setdefault(upload_id, [None, 0, 0])
+            try:
+                st = entry.stat()
+                if part == "size":
+                    with open(entry.path) as f:
+                        stream[0] = int(f.read() or 0)
+                else:
+                    stream[1] += st.st_size
+            except (OSError, ValueError):
+                continue
+            stream[2] = max(stream[2], st.st_mtime)
+            continue
+        if not entry.is_dir(follow_symlinks=False):
+            continue
+        upload = ChunkedUpload.load(entry.name)
+        try:
+            files = list(os.scandir(entry.path))
+            disk_bytes = sum(_disk_bytes(f.path) for f in files if f.is_file(follow_symlinks=False))
+            last_active = max([f.stat().st_mtime for f in files] or [entry.stat().st_mtime])
+        except OSError:
+            continue  # removed while we looked
+        info = {
+            "upload_id":    entry.name,
+            "username":     None,
+            "filename":     None,
+            "total_size":   0,
+            "received":     None,
+            "total_chunks": None,
+            "done":         False,
+            "disk_bytes":   disk_bytes,
+            "idle_seconds": max(0, int(now - last_active)),
+        }
+        if upload is not None:
+            manifest = upload.manifest
+            info.update({
+                "username":     manifest["username"],
+                "filename":     manifest["filename"],
+                "total_size":   manifest["total_size"],
+                "total_chunks": manifest["total_chunks"],
+                "done":         upload.completed is not None,
+            })
+            try:
+                info["received"] = upload.received_count()
+            except OSError:
+                pass
+        uploads.append(info)
+    for upload_id, (declared, spooled, last_write) in streams.items():
+        uploads.append({
+            "upload_id": upload_id, "username": None, "filename": None,
+            "total_size": spooled if declared is None else max(declared, spooled),
+            "received": None, "total_chunks": None, "done": False,
+            "disk_bytes": spooled, "idle_seconds": max(0, int(now - last_write)),
+        })
+    return uploads
+
+
+class UploadLedger:
+    """Running total of the bytes unfinished uploads have reserved: what tmp_uploads may still grow to.
+
+    Chunked uploads add their total_size when created and give it back when
+    finished or discarded; streaming uploads do the same with their
+    UploadReservation. The total lives in memory, or in tmp_uploads/.reserved
+    in SHARED_STATE mode so every worker sees the same one. It is first
+    counted from disk, and recounted by each janitor pass to repair drift
+    (e.g. after a crash). Callers hold upload_lock(UPLOAD_BUDGET_LOCK).
+    """
+
+    def __init__(self):
+        self._total = None
+        self._path = CHUNK_UPLOAD_DIR / ".reserved"
+
+    def total(self):
+        if SHARED_STATE:
+            try:
+                with open(self._path) as f:
+                    return int(f.read())
+            except (OSError, ValueError):
+                return self.recount()
+        if self._total is None:
+            return self.recount()
+        return self._total
+
+    def add(self, delta):
+        self._store(max(0, self.total() + delta))
+
+    def recount(self):
+        total = sum(u["total_size"] for u in list_chunked_uploads() if not u["done"])
+        self._store(total)
+        return total
+
+    def _store(self, total):
+        self._total = total
+        if SHARED_STATE:
+            CHUNK_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+            atomic_write_text(self._path, str(total))
+
+
+upload_ledger = UploadLedger()
+
+
+def clean_chunked_uploads():
+    """Delete uploads idle longer than UPLOAD_TTL and old tombstones; returns how many."""
+    removed = 0
+    for info in list_chunked_uploads():
+        ttl = UPLOAD_TOMBSTONE_TTL if info["done"] else UPLOAD_TTL
+        if info["idle_seconds"] < ttl:
+            continue
+        if info["upload_id"].startswith("stream-"):
+            with upload_lock(UPLOAD_BUDGET_LOCK):
+                for path in CHUNK_UPLOAD_DIR.glob(f"{info['upload_id']}.*"):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    if path.suffix == ".size":
+                        upload_ledger.add(-info["total_size"])
+            removed += 1
+            continue
+        with upload_lock(info["upload_id"]):
+            # A chunk may have arrived since we looked
+            upload = ChunkedUpload(info["upload_id"])
+            if not upload.dir.is_dir():
+                continue
+            try:
+                last_active = max([f.stat().st_mtime for f in os.scandir(upload.dir)] or [upload.dir.stat().st_mtime])
+            except OSError:
+                continue
+            if time.time() - last_active < ttl:
+                continue
+            upload.discard()
+            if SHARED_STATE:
+                try:
+                    os.remove(CHUNK_UPLOAD_DIR / f".{info['upload_id']}.lock")
+                except OSError:
+                    pass
+        removed += 1
+        if not info["done"]:
+            logger.info(f"Removed abandoned upload {info['upload_id']} "
+                        f"({info['username']}/{info['filename']}, {info['disk_bytes']} bytes on disk)")
+    with upload_lock(UPLOAD_BUDGET_LOCK):
+        upload_ledger.recount()
+    return removed
+
+
+_upload_janitor_stop = threading.Event()
+
 
+def _upload_janitor_loop():
+    while not _upload_janitor_stop.wait(UPLOAD_JANITOR_INTERVAL):
+        try:
+            clean_chunked_uploads()
+        except Exception as e:
+            logger.error(f"Upload janitor error: {e}")
+
+
+def upload_target_path(username, folder_path, filename, is_folder):
+    """Destination for an uploaded file, renamed to name_N.ext if taken."""
     user_dir = STORAGE_DIR / username
-    base_dir  = user_dir / folder_path if folder_path else user_dir
-    is_folder = request.form.get("is_folder_upload", "false") == "true"
+    base_dir = user_dir / folder_path if folder_path else user_dir
 
     if is_folder and ("/" in filename or "\\" in filename):
         rel_path    = sanitize_relative_path(filename)
@@ -2171,56 +6068,233 @@ def upload_chunk():
         while target_path.exists():
             target_path = target_path.parent / f"{name}_{counter}{ext}"
             counter += 1
+    return target_path
 
-    # Check if uploading into an already-shared folder
-    shared_folder_entry = shared_manager.get_shared_folder_for_path(username, folder_path) if folder_path else None
 
-    try:
-        with open(target_path, "wb") as out:
-            for i in range(total_chunks):
-                cp = tmp_dir / f"chunk_{i:06d}"
-                with open(cp, "rb") as c:
-                    out.write(c.read())
+@app.route("/api/upload/chunk", methods=["POST"])
+@jwt_required()
+def upload_chunk():
+    """Store one chunk of a chunked upload at its offset in the target file.
 
-        shutil.rmtree(tmp_dir, ignore_errors=True)
+    Form fields: upload_id, filename, folder, chunk_index, total_chunks,
+    total_size, chunk_size, is_folder_upload and the chunk itself as `file`;
+    optionally chunk_digest and file_digest (b2-1m hex) to have the server
+    verify them. The destination and geometry are fixed by the first chunk
+    to arrive; the request that completes the file moves it into place.
 
-        rel = str(target_path.relative_to(user_dir))
+    With Content-Type application/octet-stream the body is the chunk itself
+    and the fields come in the query string; it is then written from the
+    socket straight to its offset instead of being spooled first.
+    """
+    username = get_jwt_identity()
+    user = user_manager.get_user(username)
 
-        # Auto-share if user has auto_share flag OR uploading into a shared folder
-        if user.get("auto_share", False) or shared_folder_entry:
-            stat = target_path.stat()
-            fid  = shared_manager.request_share(
-                username, rel, target_path.name,
-                stat.st_size, get_file_type(target_path.name)
-            )
-            shared_manager.approve_share(fid)
+    raw    = request.mimetype == "application/octet-stream"
+    params = request.args if raw else request.form
 
-        user_manager.update_storage_used(username)
-        logger.info(f"Chunked upload complete: {username}/{rel}")
+    upload_id    = params.get("upload_id", "").strip()
+    filename     = params.get("filename", "").strip()
+    folder_path  = validate_path(username, params.get("folder", "").strip())
 
-        return jsonify({
-            "msg": f"'{target_path.name}' uploaded successfully",
-            "done": True,
-            "filepath": rel
-        }), 200
+    if not upload_id or not filename:
+        return jsonify({"msg": "Missing upload_id or filename"}), 400
+    if not UPLOAD_ID_RE.match(upload_id):
+        return jsonify({"msg": "Invalid upload_id"}), 400
 
-    except Exception as e:
-        shutil.rmtree(tmp_dir, ignore_errors=True)
-        logger.error(f"Chunk reassembly error for {username}/{filename}: {e}")
+    try:
+        chunk_index  = int(params.get("chunk_index", 0))
+        total_chunks = int(params.get("total_chunks", 1))
+        total_size   = int(params.get("total_size", -1))
+        chunk_size   = int(params.get("chunk_size", -1))
+    except ValueError:
+        return jsonify({"msg": "chunk_index, total_chunks, total_size and chunk_size must be integers"}), 400
+
+    if total_size < 0 or chunk_size <= 0:
+        return jsonify({"msg": "Missing total_size or chunk_size"}), 400
+    if total_chunks != max(1, -(-total_size // chunk_size)) or total_chunks > MAX_UPLOAD_CHUNKS:
+        return jsonify({"msg": "total_chunks does not match total_size and chunk_size"}), 400
+    if not 0 <= chunk_index < total_chunks:
+        return jsonify({"msg": "chunk_index out of range"}), 400
+
+    if not allowed_file(filename):
+        return jsonify({"msg": f"File type not allowed: {filename}"}), 400
+
+    if raw:
+        chunk_stream = request.stream
+        chunk_length = request.content_length
+    else:
+        chunk_file = request.files.get("file")
+        if not chunk_file:
+            return jsonify({"msg": "No chunk data"}), 400
+        chunk_stream = chunk_file.stream
+        chunk_length = stream_length(chunk_stream)
+
+    chunk_digest = params.get("chunk_digest", "").strip().lower() or None
+    file_digest  = params.get("file_digest", "").strip().lower() or None
+    # Block digests only line up with chunks that start on a block boundary
+    aligned = total_chunks == 1 or chunk_size % HASH_BLOCK_SIZE == 0
+    if file_digest and not aligned:
+        return jsonify({"msg": f"file_digest needs chunk_size to be a multiple of {HASH_BLOCK_SIZE}"}), 400
+
+    with upload_lock(upload_id):
+        upload = ChunkedUpload.load(upload_id)
+        if upload is None:
+            with upload_lock(UPLOAD_BUDGET_LOCK):
+                refused = upload_budget_error(total_size)
+                if refused:
+                    return refused
+                upload_ledger.add(total_size)
+                upload = ChunkedUpload.create(upload_id, {
+                    "username":     username,
+                    "filename":     filename,
+                    "folder":       folder_path,
+                    "is_folder":    params.get("is_folder_upload", "false") == "true",
+                    "total_size":   total_size,
+                    "chunk_size":   chunk_size,
+                    "total_chunks": total_chunks,
+                    "digests":      aligned and (UPLOAD_DIGESTS or file_digest is not None),
+                    "file_digest":  file_digest,
+                    "created":      datetime.now().isoformat(),
+                })
+    if upload.manifest["username"] != username:
+        return jsonify({"msg": "Upload not found"}), 404
+    if (upload.manifest["total_size"], upload.manifest["chunk_size"]) != (total_size, chunk_size):
+        return jsonify({"msg": "Chunk does not match the upload it belongs to"}), 409
+    if file_digest and file_digest != upload.manifest["file_digest"]:
+        return jsonify({"msg": "file_digest differs from the one this upload was started with"}), 409
+    if upload.completed is not None:
+        # A retry of a chunk whose upload another request already finished
+        return jsonify({"msg": "Upload already complete", "done": True, "filepath": upload.completed}), 200
+
+    offset, length = upload.chunk_span(chunk_index)
+    if chunk_length != length:
+        return jsonify({"msg": f"Chunk {chunk_index} must be {length} bytes"}), 400
+
+    manifest    = upload.manifest
+    folder_path = manifest["folder"]
+    user_dir    = STORAGE_DIR / username
+
+    try:
+        actual = upload.write_chunk(chunk_index, chunk_stream, hash_chunk=chunk_digest is not None)
+    except OSError as e:
+        # A duplicate chunk can race the request that finishes the upload
+        current = ChunkedUpload.load(upload_id)
+        if current is not None and current.completed is not None:
+            return jsonify({"msg": "Upload already complete", "done": True, "filepath": current.completed}), 200
+        logger.error(f"Chunk write error for {username}/{filename}: {e}")
         return jsonify({"msg": f"Upload failed: {str(e)}"}), 500
+    if chunk_digest and actual != chunk_digest:
+        # Bit stays unset: the client can simply send the chunk again
+        return jsonify({"msg": f"Chunk {chunk_index} checksum mismatch",
+                        "expected": chunk_digest, "actual": actual}), 422
+
+    with upload_lock(upload_id):
+        current = ChunkedUpload.load(upload_id)
+        if current is None:
+            return jsonify({"msg": "Upload was cancelled"}), 409
+        if current.completed is not None:
+            return jsonify({"msg": "Upload already complete", "done": True, "filepath": current.completed}), 200
+
+        upload.mark_received(chunk_index)
+        received = upload.received_count()
+        if received < total_chunks:
+            return jsonify({
+                "msg": f"Chunk {chunk_index + 1}/{total_chunks} received",
+                "done": False,
+                "received": received
+            }), 200
+
+        # This request set the last bit: it alone moves the file into place
+        digest = upload.file_digest() if manifest["digests"] else None
+        if manifest["file_digest"] and digest != manifest["file_digest"]:
+            upload.discard()
+            logger.warning(f"Checksum mismatch for chunked upload {username}/{manifest['filename']}")
+            return jsonify({"msg": "File checksum mismatch", "done": False,
+                            "expected": manifest["file_digest"], "actual": digest}), 422
+        try:
+            target_path = upload_target_path(username, folder_path, manifest["filename"], manifest["is_folder"])
+            # A retried chunk may still be writing; it must not land in the final file
+            with upload.writers_excluded():
+                move_file(upload.data_path, target_path)
+            rel = str(target_path.relative_to(user_dir))
+            upload.complete(rel)
+            if digest:
+                record_stored_file(username, rel, digest)
+        except Exception as e:
+            upload.discard()
+            logger.error(f"Chunk finalize error for {username}/{filename}: {e}")
+            return jsonify({"msg": f"Upload failed: {str(e)}"}), 500
+
+    # Auto-share if user has auto_share flag OR uploading into a shared folder
+    shared_folder_entry = shared_manager.get_shared_folder_for_path(username, folder_path) if folder_path else None
+    if user.get("auto_share", False) or shared_folder_entry:
+        shared_manager.request_shares_bulk(
+            [(username, rel, target_path.name, manifest["total_size"], get_file_type(target_path.name))],
+            auto_approve=True
+        )
+
+    user_manager.adjust_storage_used(username, manifest["total_size"])
+    dir_stats.invalidate(username, os.path.dirname(rel))
+    logger.info(f"Chunked upload complete: {username}/{rel}")
+
+    return jsonify({
+        "msg": f"'{target_path.name}' uploaded successfully",
+        "done": True,
+        "filepath": rel,
+        "digest": digest
+    }), 200
+
+
+@app.route("/api/upload/chunk/status", methods=["GET"])
+@jwt_required()
+def chunked_upload_status():
+    """Which chunks of an upload the server already has, for resuming."""
+    username = get_jwt_identity()
+    upload = ChunkedUpload.load(request.args.get("upload_id", "").strip())
+    if upload is None or upload.manifest["username"] != username:
+        return jsonify({"msg": "Upload not found"}), 404
+    return jsonify(upload.status()), 200
 
 
 @app.route("/api/upload/chunk/cancel", methods=["POST"])
 @jwt_required()
 def cancel_chunked_upload():
+    username = get_jwt_identity()
     data = request.get_json()
     upload_id = (data or {}).get("upload_id", "").strip()
-    if upload_id:
-        tmp_dir = BASE_DIR / "tmp_uploads" / upload_id
-        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if not UPLOAD_ID_RE.match(upload_id):
+        return jsonify({"msg": "Upload cancelled"}), 200
+    with upload_lock(upload_id):
+        upload = ChunkedUpload.load(upload_id)
+        if upload is not None and upload.manifest["username"] == username:
+            upload.discard()
     return jsonify({"msg": "Upload cancelled"}), 200
 
 
+@app.route("/api/admin/uploads", methods=["GET"])
+@jwt_required()
+def admin_uploads():
+    """Unfinished chunked uploads and the space they hold — admin only."""
+    username = get_jwt_identity()
+    user = user_manager.get_user(username)
+
+    if user["role"] != "admin":
+        return jsonify({"msg": "Admin access required"}), 403
+
+    uploads = list_chunked_uploads()
+    return jsonify({
+        "uploads": uploads,
+        "inflight_bytes": sum(u["total_size"] for u in uploads if not u["done"]),
+        "disk_bytes": sum(u["disk_bytes"] for u in uploads),
+        "budget_bytes": UPLOAD_BUDGET or None,
+        "ttl_seconds": UPLOAD_TTL
+    }), 200
+
+
+if UPLOAD_JANITOR_INTERVAL > 0:
+    threading.Thread(target=_upload_janitor_loop, daemon=True).start()
+
+
 # ==================== TEXT FILE EDITOR ENDPOINTS ====================
 
 EDITABLE_EXTENSIONS = {'md', 'txt', 'json', 'xml', 'csv', 'log', 'yaml', 'yml',
@@ -2298,10 +6372,19 @@ def write_file_content(filepath):
 
     try:
         file_path.parent.mkdir(parents=True, exist_ok=True)
-        file_path.write_text(content, encoding='utf-8')
-        user_manager.update_storage_used(username)
+        old_size = path_size(file_path)
+        # Replace rather than rewrite in place: a crash can't truncate the file,
+        # and the folder mtime moves, which listing ETags rely on
+        atomic_write_text(file_path, content)
+        if UPLOAD_DIGESTS:
+            hasher = ContentHasher()
+            hasher.update(content.encode('utf-8'))
+            record_stored_file(username, filepath, hasher.hexdigest())
+        new_size = file_path.stat().st_size
+        user_manager.adjust_storage_used(username, new_size - old_size)
+        dir_stats.invalidate(username, os.path.dirname(filepath))
         logger.info(f"File written: {username}/{filepath}")
-        return jsonify({"msg": "Saved", "size": file_path.stat().st_size}), 200
+        return jsonify({"msg": "Saved", "size": new_size}), 200
     except Exception as e:
         logger.error(f"Write file error: {e}")
         return jsonify({"msg": f"Failed to save: {str(e)}"}), 500
@@ -2351,8 +6434,9 @@ def create_text_file():
         base.mkdir(parents=True, exist_ok=True)
         initial = f"# {filename.rsplit('.', 1)[0]}\n\n" if filename.endswith('.md') else ""
         file_path.write_text(initial, encoding='utf-8')
-        user_manager.update_storage_used(username)
+        user_manager.adjust_storage_used(username, file_path.stat().st_size)
         rel = str(file_path.relative_to(user_dir))
+        dir_stats.invalidate(username, os.path.dirname(rel))
         logger.info(f"Text file created: {username}/{rel}")
         return jsonify({"msg": "File created", "filepath": rel, "filename": filename}), 200
     except Exception as e:
@@ -2370,6 +6454,8 @@ def create_text_file():
 def get_pinned():
     username = get_jwt_identity()
     user = user_manager.get_user(username)
+    if user is None:
+        return jsonify({"msg": "User not found"}), 404
     pinned = user.get("pinned_folders", [])
     return jsonify({"pinned": pinned}), 200
 
@@ -2383,13 +6469,12 @@ def add_pinned():
     name = data.get("name", path.split("/")[-1] if path else "Root").strip()
     if not path:
         return jsonify({"msg": "Path required"}), 400
-    user = user_manager.get_user(username)
-    pinned = user.get("pinned_folders", [])
-    if any(p["path"] == path for p in pinned):
+    result = user_manager.add_path_item(username, "pinned_folders", path, name)
+    if result is None:
+        return jsonify({"msg": "User not found"}), 404
+    added, pinned = result
+    if not added:
         return jsonify({"msg": "Already pinned"}), 409
-    pinned.append({"path": path, "name": name})
-    user_manager.users[username]["pinned_folders"] = pinned
-    user_manager.save_users()
     return jsonify({"msg": "Pinned", "pinned": pinned}), 200
 
 
@@ -2399,10 +6484,9 @@ def remove_pinned():
     username = get_jwt_identity()
     data = request.get_json() or {}
     path = data.get("path", "").strip()
-    user = user_manager.get_user(username)
-    pinned = [p for p in user.get("pinned_folders", []) if p["path"] != path]
-    user_manager.users[username]["pinned_folders"] = pinned
-    user_manager.save_users()
+    pinned = user_manager.remove_path_item(username, "pinned_folders", path)
+    if pinned is None:
+        return jsonify({"msg": "User not found"}), 404
     return jsonify({"msg": "Unpinned", "pinned": pinned}), 200
 
 
@@ -2415,6 +6499,8 @@ def remove_pinned():
 def get_favorites():
     username = get_jwt_identity()
     user = user_manager.get_user(username)
+    if user is None:
+        return jsonify({"msg": "User not found"}), 404
     favs = user.get("favorites", [])
     return jsonify({"favorites": favs}), 200
 
@@ -2428,13 +6514,12 @@ def add_favorite():
     name = data.get("name", path.split("/")[-1] if path else "").strip()
     if not path:
         return jsonify({"msg": "Path required"}), 400
-    user = user_manager.get_user(username)
-    favs = user.get("favorites", [])
-    if any(f["path"] == path for f in favs):
+    result = user_manager.add_path_item(username, "favorites", path, name)
+    if result is None:
+        return jsonify({"msg": "User not found"}), 404
+    added, favs = result
+    if not added:
         return jsonify({"msg": "Already favorited"}), 409
-    favs.append({"path": path, "name": name})
-    user_manager.users[username]["favorites"] = favs
-    user_manager.save_users()
     return jsonify({"msg": "Favorited", "favorites": favs}), 200
 
 
@@ -2444,10 +6529,9 @@ def remove_favorite():
     username = get_jwt_identity()
     data = request.get_json() or {}
     path = data.get("path", "").strip()
-    user = user_manager.get_user(username)
-    favs = [f for f in user.get("favorites", []) if f["path"] != path]
-    user_manager.users[username]["favorites"] = favs
-    user_manager.save_users()
+    favs = user_manager.remove_path_item(username, "favorites", path)
+    if favs is None:
+        return jsonify({"msg": "User not found"}), 404
     return jsonify({"msg": "Unfavorited", "favorites": favs}), 200
 
 
@@ -2497,7 +6581,8 @@ def rename_item():
 
     try:
         src_path.rename(dst_path)
-        user_manager.update_storage_used(username)
+        dir_stats.invalidate(username, os.path.dirname(filepath))
+        drop_shares_under(username, filepath)
         return jsonify({"msg": "Renamed", "new_path": str(dst_path.relative_to(user_dir))}), 200
     except Exception as e:
         return jsonify({"msg": str(e)}), 500
@@ -2561,11 +6646,7 @@ def music_stream(filename):
     if not path or not path.exists():
         return abort(404)
     mime = mimetypes.guess_type(str(path))[0] or "audio/mpeg"
-    # Use send_file with conditional=True — Flask handles Range requests,
-    # ETags and Last-Modified automatically → instant seek, zero delay
-    response = make_response(send_file(str(path), mimetype=mime, conditional=True))
-    response.headers["Accept-Ranges"] = "bytes"
-    return response
+    return serve_file(path, mimetype=mime)
 
 
 @app.route("/api/music/upload", methods=["POST"])
@@ -2796,23 +6877,12 @@ def music_channel():
 
             # Auto-create or overwrite playlist in user prefs
             if final_tracks and auto_pl_name:
-                user = user_manager.get_user(username)
-                playlists = user.get("music_playlists", [])
-                # Find existing playlist with same name → overwrite
-                existing = next((p for p in playlists if p["name"] == auto_pl_name), None)
-                if existing:
-                    existing["tracks"] = final_tracks
-                    new_pl = existing
+                # Existing playlist with the same name is overwritten
+                new_pl = user_manager.upsert_music_playlist(username, auto_pl_name, final_tracks)
+                if new_pl:
+                    _dl_status[did]["playlist"] = new_pl["name"]
                 else:
-                    new_pl = {
-                        "id": secrets.token_urlsafe(6),
-                        "name": auto_pl_name,
-                        "tracks": final_tracks,
-                    }
-                    playlists.append(new_pl)
-                user_manager.users[username]["music_playlists"] = playlists
-                user_manager.save_users()
-                _dl_status[did]["playlist"] = new_pl["name"]
+                    logger.warning(f"Channel download: user {username} no longer exists, playlist not saved")
 
             count = len(final_tracks)
             _dl_status[did].update({
@@ -2888,6 +6958,8 @@ def music_rename():
 def music_get_prefs():
     username = get_jwt_identity()
     user = user_manager.get_user(username)
+    if user is None:
+        return jsonify({"msg": "User not found"}), 404
     return jsonify({
         "playlists":  user.get("music_playlists", []),
         "favorites":  user.get("music_favorites", []),
@@ -2899,11 +6971,13 @@ def music_get_prefs():
 def music_save_prefs():
     username = get_jwt_identity()
     data = request.get_json() or {}
-    if "playlists" in data:
-        user_manager.users[username]["music_playlists"] = data["playlists"]
-    if "favorites" in data:
-        user_manager.users[username]["music_favorites"] = data["favorites"]
-    user_manager.save_users()
+    saved = user_manager.save_music_prefs(
+        username,
+        playlists=data.get("playlists"),
+        favorites=data.get("favorites"),
+    )
+    if not saved:
+        return jsonify({"msg": "User not found"}), 404
     return jsonify({"msg": "Saved"}), 200
 
 
@@ -3755,8 +7829,19 @@ def music_set_cover():
         if not webp_data:
             return jsonify({"error": "WEBP encoder returned empty output — try a different image"}), 500
 
-        # Write bytes directly to disk
-        webp_path.write_bytes(webp_data)
+        # Write bytes directly to disk, replacing rather than rewriting an old
+        # cover that may be streaming (see NAS_STREAM_MMAP)
+        fd, tmp_name = tempfile.mkstemp(dir=str(MUSIC_DIR), prefix=".", suffix=".webp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(webp_data)
+            os.replace(tmp_name, webp_path)
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            raise
 
         return jsonify({"ok": True, "file": base + ".webp"}), 200
 
@@ -3778,12 +7863,7 @@ def music_set_cover():
 @jwt_required()
 def music_popular():
     """Return tracks sorted by how many users have liked them."""
-    from collections import Counter
-    counts = Counter()
-    for uname, udata in user_manager.users.items():
-        favs = udata.get("music_favorites", [])
-        for f in favs:
-            counts[f] += 1
+    counts = user_manager.music_like_counts()
     # Return top 20 with count > 0
     top = [{"name": k, "likes": v} for k, v in counts.most_common(20) if v > 0]
     return jsonify({"popular": top}), 200
@@ -4224,6 +8304,10 @@ if __name__ == "__main__":
     print("\n  ⚠️  CHANGE THE ADMIN PASSWORD AFTER FIRST LOGIN!")
     print("=" * 60 + "\n")
 
+    # Turn SIGTERM into a normal exit so atexit handlers (pending JSON writes) run
+    import signal, sys
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
     debug_mode = os.getenv("FLASK_DEBUG", "false").lower() == "true"
     port       = int(os.getenv("PORT", 5000))
 
@@ -0,0 +1,29 @@
+import importlib.util
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+MAIN = Path(__file__).resolve().parent.parent / "main.py"
+
+
+@pytest.fixture
+def load_nas(tmp_path, monkeypatch):
+    """Import a fresh copy of main.py whose data files live in tmp_path.
+
+    main.py keeps its state next to itself and reads its NAS_* settings at
+    import time, so each test gets its own copy with the given environment.
+    """
+    def load(**env):
+        for key, value in env.items():
+            monkeypatch.setenv(key, value)
+        shutil.copy(MAIN, tmp_path / "main.py")
+        name = f"nas_main_{tmp_path.name}"
+        spec = importlib.util.spec_from_file_location(name, tmp_path / "main.py")
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        monkeypatch.delitem(sys.modules, name)
+        return module
+    return load
@@ -0,0 +1,103 @@
+"""Parallel pins, favorites, shares and playlist saves must all survive."""
+import threading
+
+import pytest
+
+USERS = ["alice", "bob", "carol"]
+ROUNDS = 40
+
+BACKENDS = {
+    "sqlite": {"NAS_STORAGE_BACKEND": "sqlite"},
+    "json": {"NAS_STORAGE_BACKEND": "json", "NAS_JSON_WRITE_DELAY_MS": "20"},
+    # No delay: every mutation writes its document from the calling thread
+    "json-sync": {"NAS_STORAGE_BACKEND": "json", "NAS_JSON_WRITE_DELAY_MS": "0"},
+}
+
+
+def run_parallel(workers):
+    errors = []
+
+    def guard(fn):
+        def run():
+            try:
+                fn()
+            except BaseException as e:   # surfaced by the assertion below
+                errors.append(e)
+        return run
+
+    threads = [threading.Thread(target=guard(fn), daemon=True) for fn in workers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=60)
+    assert not any(t.is_alive() for t in threads), "workers deadlocked"
+    assert not errors, errors
+
+
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+def test_parallel_mutations_keep_every_update(load_nas, backend):
+    nas = load_nas(**BACKENDS[backend])
+    users, shares = nas.user_manager, nas.shared_manager
+    for name in USERS:
+        assert users.add_user(name, "secret1")[0]
+
+    def pins(user):
+        def run():
+            for i in range(ROUNDS):
+                assert users.add_path_item(user, "pinned_folders", f"pin{i}", f"Pin {i}")[0]
+            for i in range(0, ROUNDS, 2):
+                users.remove_path_item(user, "pinned_folders", f"pin{i}")
+        return run
+
+    def favorites(user):
+        def run():
+            for i in range(ROUNDS):
+                assert users.add_path_item(user, "favorites", f"fav{i}.txt", f"fav{i}.txt")[0]
+        return run
+
+    def playlists(user):
+        def run():
+            for i in range(ROUNDS):
+                users.upsert_music_playlist(user, f"list{i % 5}", [f"track{i}.mp3"])
+            users.save_music_prefs(user, favorites=[f"song{i}.mp3" for i in range(3)])
+        return run
+
+    def share(user):
+        def run():
+            for i in range(ROUNDS):
+                file_id = shares.request_share(user, f"docs/f{i}.txt", f"f{i}.txt", i, "text")
+                if i % 2:
+                    assert shares.approve_share(file_id)
+        return run
+
+    run_parallel([make(u) for u in USERS for make in (pins, favorites, playlists, share)])
+
+    def check(users, shares):
+        for name in USERS:
+            user = users.get_user(name)
+            assert sorted(p["path"] for p in user["pinned_folders"]) == sorted(
+                f"pin{i}" for i in range(1, ROUNDS, 2))
+            assert len(user["favorites"]) == ROUNDS
+            assert sorted(p["name"] for p in user["music_playlists"]) == [f"list{i}" for i in range(5)]
+            assert {tuple(p["tracks"]) for p in user["music_playlists"]} == {
+                (f"track{i}.mp3",) for i in range(ROUNDS - 5, ROUNDS)}
+            assert len(shares.find_shares_under("pending", name, "")) == ROUNDS // 2
+            assert len(shares.find_shares_under("approved", name, "docs")) == ROUNDS // 2
+        assert users.music_like_counts()["song0.mp3"] == len(USERS)
+
+    check(users, shares)
+
+    # What was persisted matches what is in memory
+    if backend.startswith("json"):
+        nas.storage_backend.persister.flush()
+    reloaded = nas.create_storage_backend()
+    check(nas.UserManager(reloaded), nas.SharedFilesManager(reloaded))
+
+
+def test_unknown_user_is_not_an_error(load_nas):
+    nas = load_nas(NAS_STORAGE_BACKEND="sqlite")
+    users = nas.user_manager
+    assert users.add_path_item("ghost", "favorites", "a.txt", "a.txt") is None
+    assert users.remove_path_item("ghost", "favorites", "a.txt") is None
+    assert users.upsert_music_playlist("ghost", "mix", ["a.mp3"]) is None
+    assert users.save_music_prefs("ghost", favorites=["a.mp3"]) is False
@@ -0,0 +1,23 @@
+"""SharedFilesManager path lookups."""
+
+
+def test_find_shares_under(load_nas):
+    nas = load_nas(NAS_STORAGE_BACKEND="sqlite")
+    shares = nas.shared_manager
+    ids = {}
+    for path in ("a.txt", "docs/b.txt", "docs/sub/c.txt", "docsx/d.txt"):
+        ids[path] = shares.request_share("alice", path, path.rsplit("/", 1)[-1], 1, "text")
+    shares.request_share("bob", "docs/b.txt", "b.txt", 1, "text")
+
+    def found(path):
+        return sorted(e["filepath"] for e in shares.find_shares_under("pending", "alice", path))
+
+    # Exact path
+    assert found("docs/b.txt") == ["docs/b.txt"]
+    # Subtree, without siblings sharing a name prefix
+    assert found("docs") == ["docs/b.txt", "docs/sub/c.txt"]
+    # The user's root is every entry of theirs
+    assert found("") == ["a.txt", "docs/b.txt", "docs/sub/c.txt", "docsx/d.txt"]
+    assert found("missing") == []
+    assert shares.find_shares_under("pending", "carol", "") == []
+    assert shares.find_shares_under("approved", "alice", "") == []